@@ -0,0 +1,252 @@
+"""
+Throughput benchmark for the BER/LDAP codec.
+
+Encodes and decodes a set of realistic LDAP messages and reports, for
+each of them, operations per second and megabytes per second:
+
+  bind                 simple bind request
+  entry-small          search result entry with a handful of attributes
+  entry-large          search result entry with thousands of values
+  search-filter        search request with a deep AND/OR filter
+  modify               modify request adding and deleting many values
+  extended             password modify extended request
+
+With --json the results are written as JSON, to keep as a baseline.
+With --baseline FILE the results are compared against such a file and
+the exit status is 1 if any of them is slower than the baseline by
+more than --threshold (10% by default).
+
+Usage: python benchmarks/bench_codec.py [options] [case ...]
+
+Like the other benchmarks, it runs against the ldaptor of the checkout
+it is in, whether or not another one is installed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ldaptor
+from ldaptor.protocols import pureber, pureldap
+from ldaptor.protocols.ldap import ldapclient, ldapserver
+
+
+def bind():
+    return pureldap.LDAPBindRequest(
+        dn='uid=jdoe,ou=People,dc=example,dc=com',
+        auth='secret')
+
+
+def entry(values):
+    return pureldap.LDAPSearchResultEntry(
+        objectName='uid=jdoe,ou=People,dc=example,dc=com',
+        attributes=[
+            ('objectClass', ['top', 'person', 'inetOrgPerson']),
+            ('uid', ['jdoe']),
+            ('cn', ['John Doe']),
+            ('sn', ['Doe']),
+            ('mail', ['jdoe@example.com']),
+            ('memberOf', ['cn=group%d,ou=Groups,dc=example,dc=com' % i
+                          for i in xrange(values)]),
+            ])
+
+
+def nestedFilter(depth):
+    if depth == 0:
+        return pureldap.LDAPFilter_equalityMatch(
+            attributeDesc=pureldap.LDAPAttributeDescription('uid'),
+            assertionValue=pureldap.LDAPAssertionValue('jdoe'))
+    if depth % 2:
+        klass = pureldap.LDAPFilter_and
+    else:
+        klass = pureldap.LDAPFilter_or
+    return klass([
+        nestedFilter(depth - 1),
+        pureldap.LDAPFilter_present('objectClass'),
+        pureldap.LDAPFilter_substrings(
+            type='cn',
+            substrings=[pureldap.LDAPFilter_substrings_initial('jo'),
+                        pureldap.LDAPFilter_substrings_any('h'),
+                        pureldap.LDAPFilter_substrings_final('oe')]),
+        pureldap.LDAPFilter_not(nestedFilter(depth - 1)),
+        ])
+
+
+def searchRequest():
+    return pureldap.LDAPSearchRequest(
+        baseObject='dc=example,dc=com',
+        filter=nestedFilter(6))
+
+
+def modification(operation, attributeType, values):
+    return pureber.BERSequence([
+        pureber.BEREnumerated(operation),
+        pureber.BERSequence([
+            pureldap.LDAPAttributeDescription(attributeType),
+            pureber.BERSet([pureldap.LDAPString(v) for v in values]),
+            ]),
+        ])
+
+
+def modify():
+    # made of BER objects, not of the strings delta.ModifyOp.asLDAP()
+    # returns, so that encoding it does the work
+    return pureldap.LDAPModifyRequest(
+        object='uid=jdoe,ou=People,dc=example,dc=com',
+        modification=[
+            modification(0, 'memberOf',
+                         ['cn=group%d,ou=Groups,dc=example,dc=com' % i
+                          for i in xrange(500)]),
+            modification(1, 'mail', ['jdoe%d@example.com' % i
+                                     for i in xrange(100)]),
+            modification(2, 'description', ['x' * 1000]),
+            ])
+
+
+def extended():
+    return pureldap.LDAPPasswordModifyRequest(
+        userIdentity='uid=jdoe,ou=People,dc=example,dc=com',
+        oldPasswd='secret',
+        newPasswd='new secret')
+
+
+serverDecoder = ldapserver.BaseLDAPServer.berdecoder
+clientDecoder = ldapclient.LDAPClient.berdecoder
+
+cases = [
+    ('bind', bind, serverDecoder),
+    ('entry-small', lambda: entry(5), clientDecoder),
+    ('entry-large', lambda: entry(5000), clientDecoder),
+    ('search-filter', searchRequest, serverDecoder),
+    ('modify', modify, serverDecoder),
+    ('extended', extended, serverDecoder),
+    ]
+
+
+def measure(func, minTime, repeat):
+    """
+    Return the best rate, in calls per second, of repeat runs of func,
+    each of them long enough to take at least minTime seconds.
+    """
+    number = 1
+    while True:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= minTime:
+            break
+        number *= 2
+    best = elapsed
+    for i in xrange(repeat - 1):
+        start = time.time()
+        for i in xrange(number):
+            func()
+        best = min(best, time.time() - start)
+    return number / best
+
+
+def run(names, minTime, repeat):
+    results = []
+    for name, factory, berdecoder in cases:
+        if names and name not in names:
+            continue
+        msg = pureldap.LDAPMessage(factory(), id=42)
+        encoded = str(msg)
+
+        def encode():
+            str(msg)
+
+        def decode():
+            pureber.berDecodeObject(berdecoder, encoded)
+
+        for op, func in [('encode', encode), ('decode', decode)]:
+            rate = measure(func, minTime, repeat)
+            results.append({
+                'case': name,
+                'op': op,
+                'bytes': len(encoded),
+                'ops_per_sec': rate,
+                'mb_per_sec': rate * len(encoded) / 1048576.0,
+                })
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print how results compare to baseline and return the number of
+    results that are slower than it by more than threshold.
+    """
+    old = {}
+    for r in baseline['results']:
+        old[r['case'], r['op']] = r['ops_per_sec']
+    regressions = 0
+    for r in results:
+        key = r['case'], r['op']
+        if key not in old:
+            continue
+        ratio = r['ops_per_sec'] / old[key]
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print >>sys.stderr, '%-14s %-6s %6.2fx baseline%s' % (
+            r['case'], r['op'], ratio, flag)
+    return regressions
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description='Measure BER/LDAP encode and decode throughput.')
+    parser.add_argument('cases', nargs='*', metavar='case',
+                        help='cases to run (default: all of %s)'
+                        % ', '.join(name for name, _, _ in cases))
+    parser.add_argument('--json', action='store_true',
+                        help='write the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare against results written by --json')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='allowed slowdown against the baseline, '
+                        'as a fraction (default: %(default)s)')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds per measurement '
+                        '(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='measurements per result, the best one is '
+                        'kept (default: %(default)s)')
+    options = parser.parse_args(args)
+    unknown = set(options.cases) - set(name for name, _, _ in cases)
+    if unknown:
+        parser.error('unknown case: %s' % ', '.join(sorted(unknown)))
+
+    results = run(options.cases, options.min_time, options.repeat)
+
+    if options.json:
+        json.dump({
+            'ldaptor': ldaptor.__version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'results': results,
+            }, sys.stdout, indent=2, sort_keys=True)
+        print
+    else:
+        for r in results:
+            print '%-14s %-6s %8d bytes %12.1f ops/s %9.2f MB/s' % (
+                r['case'], r['op'], r['bytes'],
+                r['ops_per_sec'], r['mb_per_sec'])
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,96 @@
+"""
+Microbenchmark for BERDecoderContext tag lookup.
+
+Decodes an LDAPSearchResultEntry and an LDAPSearchRequest carrying a
+nested LDAPFilter, once with the flattened dispatch tables and once
+with the old lookup that walks the fallback chain, and prints the time
+per decode for both.
+
+Usage: python benchmarks/bench_decodercontext.py [--iterations N]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ldaptor import ldapfilter
+from ldaptor.protocols import pureber, pureldap
+from ldaptor.protocols.ldap import ldapclient, ldapserver
+
+
+def chainWalkingLookup(self, id):
+    try:
+        return self.Identities[id]
+    except KeyError:
+        if self.fallback:
+            return self.fallback.lookup_id(id)
+        else:
+            return None
+
+
+def searchResultEntry():
+    return str(pureldap.LDAPMessage(
+        pureldap.LDAPSearchResultEntry(
+            objectName='uid=jdoe,ou=People,dc=example,dc=com',
+            attributes=[
+                ('objectClass', ['top', 'person', 'inetOrgPerson']),
+                ('uid', ['jdoe']),
+                ('cn', ['John Doe']),
+                ('sn', ['Doe']),
+                ('mail', ['jdoe@example.com']),
+                ('memberOf', ['cn=group%d,ou=Groups,dc=example,dc=com' % i
+                              for i in range(20)]),
+                ]),
+        id=42))
+
+
+def searchRequest():
+    filt = ldapfilter.parseFilter(
+        '(&(objectClass=person)'
+        '(|(uid=jdoe)(mail=jdoe*)(cn=*doe*))'
+        '(!(shadowExpire<=17000))'
+        '(&(ou=People)(|(l=Helsinki)(uidNumber>=1000))))')
+    return str(pureldap.LDAPMessage(
+        pureldap.LDAPSearchRequest(
+            baseObject='dc=example,dc=com',
+            filter=filt),
+        id=42))
+
+
+def run(name, berdecoder, data, iterations):
+    def decode():
+        pureber.berDecodeObject(berdecoder, data)
+    flat = min(timeit.repeat(decode, number=iterations, repeat=3))
+    original = pureber.BERDecoderContext.lookup_id
+    pureber.BERDecoderContext.lookup_id = chainWalkingLookup
+    try:
+        chain = min(timeit.repeat(decode, number=iterations, repeat=3))
+    finally:
+        pureber.BERDecoderContext.lookup_id = original
+    print '%-22s chain walk %8.1f us  flat table %8.1f us  (%.2fx)' % (
+        name,
+        chain / iterations * 1e6,
+        flat / iterations * 1e6,
+        chain / flat)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description='Measure BERDecoderContext tag lookup.')
+    parser.add_argument('--iterations', type=int, default=2000,
+                        help='decodes per measurement (default: %(default)s)')
+    options = parser.parse_args(args)
+    if options.iterations < 1:
+        parser.error('--iterations must be at least 1')
+    iterations = options.iterations
+    run('LDAPSearchResultEntry', ldapclient.LDAPClient.berdecoder,
+        searchResultEntry(), iterations)
+    run('LDAPFilter', ldapserver.BaseLDAPServer.berdecoder,
+        searchRequest(), iterations)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
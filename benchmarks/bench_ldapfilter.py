@@ -0,0 +1,79 @@
+"""
+Benchmark for parsing LDAP filters.
+
+Parses a few typical filters with the hand-written parser in
+ldaptor.ldapfilter and with the pyparsing grammar it replaced, in
+ldaptor.test.pyparsingfilter, and prints microseconds per parse for both.
+Also prints how long it takes to import each module in a fresh
+interpreter.
+
+Usage: python benchmarks/bench_ldapfilter.py [--iterations N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from ldaptor import ldapfilter
+from ldaptor.test import pyparsingfilter
+
+
+filters = [
+    '(uid=jdoe)',
+    '(objectClass=*)',
+    '(&(objectClass=person)(|(cn=John*)(mail=*@example.com)))',
+    '(&(|(uid=jdoe)(mail=jdoe@example.com))(!(cn=*admin*))(employeeNumber>=100))',
+    '(cn:dn:2.4.6.8.10:=Dino\\2a)',
+    ]
+
+
+def timed(parse, text, iterations):
+    best = None
+    for i in xrange(3):
+        start = time.time()
+        for i in xrange(iterations):
+            parse(text)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / iterations * 1e6
+
+
+def importTime(module):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + filter(None, [env.get('PYTHONPATH')]))
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', 'import %s' % module],
+                          env=env)
+    return time.time() - start
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description='Measure LDAP filter parsing.')
+    parser.add_argument('--iterations', type=int, default=2000,
+                        help='parses per measurement (default: %(default)s)')
+    options = parser.parse_args(args)
+    if options.iterations < 1:
+        parser.error('--iterations must be at least 1')
+    iterations = options.iterations
+    for module in ['ldaptor.ldapfilter', 'ldaptor.test.pyparsingfilter']:
+        print 'import %-28s %7.3f s' % (module, importTime(module))
+    for text in filters:
+        assert ldapfilter.parseFilter(text) \
+               == pyparsingfilter.parseFilter(text)
+        new = timed(ldapfilter.parseFilter, text, iterations)
+        old = timed(pyparsingfilter.parseFilter, text, iterations)
+        print text
+        print '  hand-written %8.1f us  pyparsing %8.1f us  %5.1fx' % (
+            new, old, old / new)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,96 @@
+"""
+Benchmark for loading LDIF into an in-memory LDAP tree.
+
+Writes an LDIF file of people (20000 by default) under a single
+organizational unit and loads it with inmemory.fromLDIFFile, once in
+bulk mode and once as before, printing the time each takes. The old
+loader takes time quadratic in the size of the file, so use
+--bulk-only for large numbers of entries.
+
+Usage: python benchmarks/bench_ldifload.py [--bulk-only] [--entries N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ldaptor import inmemory
+
+
+def writeLDIF(f, count):
+    f.write('dn: dc=example,dc=com\n'
+            'objectClass: dcObject\n'
+            'dc: example\n'
+            '\n'
+            'dn: ou=People,dc=example,dc=com\n'
+            'objectClass: organizationalUnit\n'
+            'ou: People\n'
+            '\n')
+    for i in xrange(count):
+        f.write('dn: uid=user%d,ou=People,dc=example,dc=com\n'
+                'objectClass: top\n'
+                'objectClass: person\n'
+                'objectClass: inetOrgPerson\n'
+                'uid: user%d\n'
+                'cn: User %d\n'
+                'sn: %d\n'
+                'mail: user%d@example.com\n'
+                '\n' % (i, i, i, i, i))
+
+
+def asLDIF(db):
+    return sorted([str(e) for e in db.subtree().result])
+
+
+def load(path, **kw):
+    result = []
+    f = open(path)
+    try:
+        start = time.time()
+        inmemory.fromLDIFFile(f, **kw).addBoth(result.append)
+        elapsed = time.time() - start
+    finally:
+        f.close()
+    return elapsed, result[0]
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description='Measure loading LDIF into an in-memory tree.')
+    parser.add_argument('--entries', type=int, default=20000,
+                        help='people in the LDIF file (default: %(default)s)')
+    parser.add_argument('--bulk-only', action='store_true',
+                        help='do not load the file with the old loader')
+    options = parser.parse_args(args)
+    if options.entries < 0:
+        parser.error('--entries can not be negative')
+    count = options.entries
+    bulkOnly = options.bulk_only
+    fd, path = tempfile.mkstemp(suffix='.ldif')
+    try:
+        f = os.fdopen(fd, 'w')
+        writeLDIF(f, count)
+        f.close()
+
+        def progress(loaded):
+            sys.stdout.write('\r%d entries' % loaded)
+            sys.stdout.flush()
+        elapsed, db = load(path, bulk=True, progress=progress)
+        print
+        print 'bulk    %7.1f s  %6.1f us/entry' % (
+            elapsed, elapsed / (count + 2) * 1e6)
+        if not bulkOnly:
+            elapsed, old = load(path)
+            print 'default %7.1f s  %6.1f us/entry' % (
+                elapsed, elapsed / (count + 2) * 1e6)
+            assert asLDIF(db) == asLDIF(old)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
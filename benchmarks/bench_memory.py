@@ -0,0 +1,144 @@
+"""
+Memory benchmark for decoded BER objects and DistinguishedNames.
+
+Builds a number of objects (100000 by default) and keeps them alive,
+then reports how much the resident size of the process grew. Each
+mode runs in a fresh child process so the numbers do not disturb each
+other:
+
+  ber        LDAPSearchResultEntry messages decoded into generic
+             BERSequence/BEROctetString trees
+  ldap       LDAPSearchResultEntry messages decoded into
+             LDAPMessage/LDAPSearchResultEntry objects
+  dn-flat    DNs of entries under a common parent, each holding the
+             tuple of all its RDNs, as addChild used to build them
+  dn-linked  the same DNs made with DistinguishedName.child(), which
+             refer to the shared parent DN for all but their first RDN
+
+The DNs are used as a search would use them, by taking their string
+form and key().
+
+Usage: python benchmarks/bench_memory.py [--entries N] [--mode MODE ...]
+"""
+
+import argparse
+import gc
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ldaptor.protocols import pureber, pureldap
+from ldaptor.protocols.ldap import distinguishedname, ldapclient
+
+
+def residentSize():
+    """Return the resident size of this process in bytes (Linux only)."""
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def entry(i):
+    return str(pureldap.LDAPMessage(
+        pureldap.LDAPSearchResultEntry(
+            objectName='uid=user%d,ou=People,dc=example,dc=com' % i,
+            attributes=[
+                ('objectClass', ['top', 'person', 'inetOrgPerson']),
+                ('uid', ['user%d' % i]),
+                ('cn', ['User %d' % i]),
+                ('sn', ['%d' % i]),
+                ('mail', ['user%d@example.com' % i]),
+                ]),
+        id=i % 1000 + 1))
+
+
+class GenericDecoderContext(pureber.BERDecoderContext):
+    """Decodes the search result entry op as a plain BERSequence."""
+    Identities = dict(pureber.BERDecoderContext.Identities)
+    Identities[pureber.CLASS_APPLICATION | 0x04] = pureber.BERSequence
+
+
+def decodeWith(berdecoder):
+    def prepare(count):
+        encoded = [entry(i) for i in xrange(count)]
+        def build():
+            return [pureber.berDecodeObject(berdecoder, m)[0]
+                    for m in encoded]
+        return build
+    return prepare
+
+
+def flatDN(parent, rdn):
+    return distinguishedname.DistinguishedName(
+        listOfRDNs=(distinguishedname.RelativeDistinguishedName(rdn),)
+        + parent.split())
+
+
+def linkedDN(parent, rdn):
+    return parent.child(rdn)
+
+
+def makeDNsWith(make):
+    def prepare(count):
+        parent = distinguishedname.DistinguishedName(
+            'ou=People,dc=example,dc=com')
+        rdns = ['uid=user%d' % i for i in xrange(count)]
+        def build():
+            dns = []
+            for rdn in rdns:
+                dn = make(parent, rdn)
+                str(dn)
+                dn.key()
+                dns.append(dn)
+            return dns
+        return build
+    return prepare
+
+
+modes = {
+    'ber': decodeWith(GenericDecoderContext()),
+    'ldap': decodeWith(ldapclient.LDAPClient.berdecoder),
+    'dn-flat': makeDNsWith(flatDN),
+    'dn-linked': makeDNsWith(linkedDN),
+    }
+
+
+def measure(count, mode):
+    build = modes[mode](count)
+    gc.collect()
+    before = residentSize()
+    kept = build()
+    gc.collect()
+    after = residentSize()
+    print '%-9s %7d objects  %10.1f MiB  %7.0f bytes/object' % (
+        mode, len(kept),
+        (after - before) / 1048576.0,
+        float(after - before) / max(count, 1))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description='Measure the memory used by decoded BER objects '
+        'and DistinguishedNames.')
+    parser.add_argument('--entries', type=int, default=100000,
+                        help='objects to build (default: %(default)s)')
+    parser.add_argument('--mode', action='append', choices=sorted(modes),
+                        help='mode to run, may be repeated '
+                        '(default: all of them)')
+    options = parser.parse_args(args)
+    if options.entries < 1:
+        parser.error('--entries must be at least 1')
+    selected = options.mode or sorted(modes)
+    if len(selected) == 1:
+        measure(options.entries, selected[0])
+        return
+    for mode in selected:
+        subprocess.check_call([sys.executable, os.path.abspath(__file__),
+                               '--entries', str(options.entries),
+                               '--mode', mode])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+"""
+Benchmark for searching an in-memory LDAP tree.
+
+Builds a ReadOnlyInMemoryLDAPEntry tree of people (20000 by default)
+and runs whole-subtree searches with a few typical filters, printing
+the time per search. For comparison, each filter is also matched
+against a flat list of all entries, once with MatchMixin.match, which
+interprets the filter tree anew for each entry, and once with a
+predicate from entryhelpers.compileFilter. Finally, the searches are
+repeated with equality indexes on uid, l and objectClass, substring
+indexes on uid, cn and mail and a range index on uidNumber.
+
+Usage: python benchmarks/bench_search.py [--entries N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ldaptor import entryhelpers, inmemory, ldapfilter
+
+
+filters = [
+    '(uid=user4242)',
+    '(&(objectClass=person)(mail=user42*))',
+    '(|(cn=*99*)(sn=12345)(!(employeeNumber>=5)))',
+    '(&(objectClass=inetOrgPerson)(|(l=Helsinki)(l=Oslo))(uid=*5))',
+    '(&(uidNumber>=1000)(uidNumber<=1099))',
+    ]
+
+
+def buildTree(count):
+    root = inmemory.ReadOnlyInMemoryLDAPEntry(
+        dn='dc=example,dc=com',
+        attributes={'objectClass': ['dcObject'], 'dc': ['example']})
+    people = root.addChild(
+        rdn='ou=People',
+        attributes={'objectClass': ['organizationalUnit'], 'ou': ['People']})
+    cities = ['Helsinki', 'Oslo', 'Stockholm', 'Copenhagen', 'Reykjavik']
+    for i in xrange(count):
+        people.addChild(
+            rdn='uid=user%d' % i,
+            attributes={
+                'objectClass': ['top', 'person', 'inetOrgPerson'],
+                'uid': ['user%d' % i],
+                'cn': ['User %d' % i],
+                'sn': ['%d' % i],
+                'mail': ['user%d@example.com' % i],
+                'l': [cities[i % len(cities)]],
+                'employeeNumber': [str(i % 10)],
+                'uidNumber': [str(i)],
+                })
+    return root
+
+
+def timed(func):
+    start = time.time()
+    result = func()
+    return time.time() - start, result
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description='Measure searching an in-memory tree.')
+    parser.add_argument('--entries', type=int, default=20000,
+                        help='people in the tree (default: %(default)s)')
+    options = parser.parse_args(args)
+    if options.entries < 0:
+        parser.error('--entries can not be negative')
+    count = options.entries
+    elapsed, root = timed(lambda: buildTree(count))
+    print 'built %d entries in %.1f s' % (count, elapsed)
+    entries = []
+    root.subtree(callback=entries.append)
+
+    for text in filters:
+        filt = ldapfilter.parseFilter(text)
+        interpreted, matches = timed(
+            lambda: len([e for e in entries if e.match(filt)]))
+        predicate = entryhelpers.compileFilter(filt)
+        compiled, _ = timed(
+            lambda: len([e for e in entries if predicate(e)]))
+        results = []
+        searched, _ = timed(lambda: root.search(filterObject=filt,
+                                                callback=results.append))
+        assert len(results) == matches
+        print text
+        print '  %6d hits  match() %7.3f s  compiled %7.3f s  ' \
+              'search() %7.3f s' % (
+                  matches, interpreted, compiled, searched)
+
+    for attributeType in ['uid', 'l', 'objectClass']:
+        root.addIndex(attributeType)
+    for attributeType in ['uid', 'cn', 'mail']:
+        root.addIndex(attributeType, 'substring')
+    root.addIndex('uidNumber', 'range')
+    for text in filters:
+        filt = ldapfilter.parseFilter(text)
+        results = []
+        searched, _ = timed(lambda: root.search(filterObject=filt,
+                                                callback=results.append))
+        print text
+        print '  %6d hits  indexed search() %7.3f s' % (
+            len(results), searched)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
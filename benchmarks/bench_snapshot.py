@@ -0,0 +1,80 @@
+"""
+Benchmark for loading an in-memory LDAP tree from a snapshot.
+
+Writes an LDIF file of people (100000 by default), loads it with
+inmemory.fromLDIFFile in bulk mode and indexes it, writes a snapshot
+of the tree with inmemory.toSnapshotFile and loads that again with
+inmemory.fromSnapshotFile, printing the time each takes and checking
+that the loaded tree has the same entries.
+
+Usage: python benchmarks/bench_snapshot.py [--entries N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ldaptor import inmemory
+from bench_ldifload import writeLDIF
+
+
+def timed(f, *args):
+    start = time.time()
+    l = []
+    f(*args).addCallback(l.append)
+    return l[0], time.time() - start
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description='Measure loading an in-memory tree from a snapshot.')
+    parser.add_argument('--entries', type=int, default=100000,
+                        help='people in the tree (default: %(default)s)')
+    options = parser.parse_args(args)
+    if options.entries < 0:
+        parser.error('--entries can not be negative')
+    count = options.entries
+    fd, ldifPath = tempfile.mkstemp(suffix='.ldif')
+    fd2, snapshotPath = tempfile.mkstemp(suffix='.snapshot')
+    try:
+        f = os.fdopen(fd, 'w')
+        writeLDIF(f, count)
+        f.close()
+        os.close(fd2)
+
+        db, elapsed = timed(inmemory.fromLDIFFile, open(ldifPath), True)
+        print 'load LDIF         %7.2f s' % elapsed
+        start = time.time()
+        db.addIndex('uid')
+        db.addIndex('cn', 'substring')
+        print 'index             %7.2f s' % (time.time() - start)
+
+        start = time.time()
+        f = open(snapshotPath, 'wb')
+        inmemory.toSnapshotFile(db, f)
+        f.close()
+        print 'write snapshot    %7.2f s  %d bytes' % (
+            time.time() - start, os.path.getsize(snapshotPath))
+
+        loaded, elapsed = timed(inmemory.fromSnapshotFile, snapshotPath)
+        print 'load snapshot     %7.2f s' % elapsed
+
+        start = time.time()
+        for e in loaded._walk():
+            e.keys()
+        print 'decode entries    %7.2f s' % (time.time() - start)
+        loaded.close()
+
+        assert (sorted([str(e) for e in db._walk()])
+                == sorted([str(e) for e in loaded._walk()]))
+    finally:
+        os.unlink(ldifPath)
+        os.unlink(snapshotPath)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
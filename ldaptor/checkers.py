@@ -15,9 +15,11 @@ def makeFilter(name, template=None):
         except ldapfilter.InvalidLDAPFilter:
             if template is not None:
                 try:
-                    filter=ldapfilter.parseFilter(template % {'name':name})
+                    prepared=ldapfilter.prepareFilter(template)
                 except ldapfilter.InvalidLDAPFilter:
                     pass
+                else:
+                    filter=prepared.bind({'name':name})
     return filter
 
 class LDAPBindingChecker:
@@ -55,6 +57,13 @@ class LDAPBindingChecker:
         d.addCallback(self._found, credentials)
         return d
 
+    def _identitySearchFilter(self, name):
+        getFilter = getattr(self.config, 'getIdentitySearchFilter', None)
+        if getFilter is None:
+            # configurations written before getIdentitySearchFilter
+            return ldapfilter.parseFilter(self.config.getIdentitySearch(name))
+        return getFilter(name)
+
     def requestAvatarId(self, credentials):
         try:
             baseDN = self.config.getIdentityBaseDN()
@@ -62,9 +71,8 @@ class LDAPBindingChecker:
             return failure.Failure(error.UnauthorizedLogin("Disabled due configuration error: %s." % e))
         if not credentials.username:
             return failure.Failure(error.UnauthorizedLogin("I don't support anonymous"))
-        filtText = self.config.getIdentitySearch(credentials.username)
         try:
-            filt = ldapfilter.parseFilter(filtText)
+            filt = self._identitySearchFilter(credentials.username)
         except ldapfilter.InvalidLDAPFilter:
             return failure.Failure(error.UnauthorizedLogin("Couldn't create filter"))
 
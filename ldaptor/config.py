@@ -1,7 +1,7 @@
 import os.path
 import ConfigParser
 from zope.interface import implements
-from ldaptor import interfaces
+from ldaptor import interfaces, ldapfilter
 from ldaptor.insensitive import InsensitiveString
 from ldaptor.protocols.ldap import distinguishedname
 
@@ -115,6 +115,35 @@ class LDAPConfig(object):
                 f='(|(cn=%(name)s)(uid=%(name)s))' % data
         return f
 
+    def getIdentitySearchTemplate(self):
+        """
+        Return the identity search filter with a %(name)s placeholder
+        for the user name, for ldapfilter.prepareFilter().
+        """
+        if self.identitySearch is not None:
+            return self.identitySearch
+
+        cfg = loadConfig()
+        try:
+            # interpolate other options, but keep the placeholder
+            f=cfg.get('authentication', 'identity-search',
+                      vars={'name': '%%(name)s'})
+        except (ConfigParser.NoOptionError,
+                ConfigParser.NoSectionError):
+            return '(|(cn=%(name)s)(uid=%(name)s))'
+        return f.replace('%', '%%').replace('%%(name)s', '%(name)s')
+
+    def getIdentitySearchFilter(self, name):
+        """
+        Return the identity search filter for name, as an LDAPFilter.
+
+        Unlike parsing the result of getIdentitySearch(), name is
+        used as a literal value even if it contains characters like
+        "*" or ")", and the template is parsed only once.
+        """
+        prepared = ldapfilter.prepareFilter(self.getIdentitySearchTemplate())
+        return prepared.bind({'name': name})
+
 
 DEFAULTS = {
     'samba': { 'use-lmhash': 'no',
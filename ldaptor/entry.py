@@ -35,14 +35,20 @@ class BaseLDAPEntry(object):
 
         Initialize the object.
 
-        @param dn: Distinguished Name of the object, as a string.
+        @param dn: Distinguished Name of the object, as a string or a
+        DistinguishedName, which is used as is.
 
         @param attributes: Attributes of the object. A dictionary of
         attribute types to list of attribute values.
 
         """
         self._attributes = InsensitiveDict()
-        self.dn = distinguishedname.DistinguishedName(dn)
+        if isinstance(dn, distinguishedname.DistinguishedName):
+            # DistinguishedNames are not modified, so they can be
+            # shared; this keeps the DNs made by child() linked
+            self.dn = dn
+        else:
+            self.dn = distinguishedname.DistinguishedName(dn)
 
         for k, vs in attributes.items():
             if k not in self._attributes:
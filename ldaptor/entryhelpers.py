@@ -1,3 +1,6 @@
+import calendar
+import re
+
 from twisted.internet import defer
 from ldaptor import delta, ldapfilter
 from ldaptor.protocols import pureldap
@@ -12,6 +15,85 @@ def safelower(s):
     except AttributeError:
         return s
 
+def integerOrdering(value):
+    """
+    Return the key that orders value, an LDAP Integer, numerically.
+    """
+    return int(value)
+
+_generalizedTime = re.compile(r'''
+    (?P<year>\d{4})(?P<month>\d\d)(?P<day>\d\d)(?P<hour>\d\d)
+    (?:(?P<minute>\d\d)(?P<second>\d\d)?)?
+    (?:[.,](?P<fraction>\d+))?
+    (?:(?P<utc>Z)|(?P<sign>[+-])(?P<offsetHours>\d\d)(?P<offsetMinutes>\d\d)?)?
+    $''', re.VERBOSE)
+
+def generalizedTimeOrdering(value):
+    """
+    Return the key that orders value, an LDAP GeneralizedTime,
+    chronologically: the seconds since the epoch, in UTC.
+
+    Times without a time zone are taken to be in UTC.
+    """
+    m = _generalizedTime.match(str(value))
+    if m is None:
+        raise ValueError, value
+    seconds = calendar.timegm((int(m.group('year')),
+                               int(m.group('month')),
+                               int(m.group('day')),
+                               int(m.group('hour')),
+                               int(m.group('minute') or 0),
+                               int(m.group('second') or 0)))
+    if m.group('fraction') is not None:
+        # the fraction is of the last unit given
+        if m.group('minute') is None:
+            unit = 3600
+        elif m.group('second') is None:
+            unit = 60
+        else:
+            unit = 1
+        seconds = seconds + float('0.' + m.group('fraction')) * unit
+    if m.group('sign') is not None:
+        offset = (int(m.group('offsetHours')) * 3600
+                  + int(m.group('offsetMinutes') or 0) * 60)
+        if m.group('sign') == '+':
+            seconds = seconds - offset
+        else:
+            seconds = seconds + offset
+    return seconds
+
+def _unordered(value):
+    return value
+
+# Functions by lowercased attribute type that map values to the keys
+# greaterOrEqual and lessOrEqual matches compare. They raise
+# ValueError for values that can not be ordered, which then match
+# nothing. Values of other attribute types are compared as they are.
+orderings = {}
+for _attributeType in ['uidNumber', 'gidNumber',
+                       'shadowLastChange', 'shadowMin', 'shadowMax',
+                       'shadowWarning', 'shadowInactive', 'shadowExpire',
+                       'shadowFlag']:
+    orderings[_attributeType.lower()] = integerOrdering
+for _attributeType in ['createTimestamp', 'modifyTimestamp',
+                       'validFrom', 'validUntil']:
+    orderings[_attributeType.lower()] = generalizedTimeOrdering
+del _attributeType
+
+def orderingFor(attributeType):
+    """
+    Return the function that maps values of attributeType to the keys
+    that order them, see orderings.
+    """
+    return orderings.get(attributeType.lower(), _unordered)
+
+def _orderedKeys(ordering, values):
+    for value in values:
+        try:
+            yield ordering(value)
+        except ValueError:
+            pass
+
 class DiffTreeMixin(object):
     def _diffTree_gotMyChildren(self, myChildren, other, result):
         d = other.children()
@@ -188,15 +270,27 @@ class MatchMixin(object):
         elif isinstance(filter, pureldap.LDAPFilter_greaterOrEqual):
             if filter.attributeDesc.value not in self:
                 return False
-            for value in self[filter.attributeDesc.value]:
-                if value  >= filter.assertionValue.value:
+            ordering = orderingFor(filter.attributeDesc.value)
+            try:
+                assertion = ordering(filter.assertionValue.value)
+            except ValueError:
+                return False
+            for key in _orderedKeys(ordering,
+                                    self[filter.attributeDesc.value]):
+                if key >= assertion:
                     return True
             return False
         elif isinstance(filter, pureldap.LDAPFilter_lessOrEqual):
             if filter.attributeDesc.value not in self:
                 return False
-            for value in self[filter.attributeDesc.value]:
-                if value <= filter.assertionValue.value:
+            ordering = orderingFor(filter.attributeDesc.value)
+            try:
+                assertion = ordering(filter.assertionValue.value)
+            except ValueError:
+                return False
+            for key in _orderedKeys(ordering,
+                                    self[filter.attributeDesc.value]):
+                if key <= assertion:
                     return True
             return False
         elif isinstance(filter, pureldap.LDAPFilter_and):
@@ -229,7 +323,235 @@ class MatchMixin(object):
         else:
             raise ldapsyntax.MatchNotImplemented, filter
 
+_notImplementedCost = float('inf')
+
+def _compilePresent(filter):
+    attr = filter.value
+    def match(entry):
+        return attr in entry
+    return 1, match
+
+def _compileEqualityMatch(filter):
+    # TODO case insensitivity depends on different attribute syntaxes
+    attr = filter.attributeDesc.value
+    value = filter.assertionValue.value.lower()
+    def match(entry):
+        for val in entry.get(attr, ()):
+            if val.lower() == value:
+                return True
+        return False
+    return 2, match
+
+def _compileSubstrings(filter):
+    attr = filter.type
+    substrings = filter.substrings[:]
+    initial = None
+    final = None
+    if (substrings
+        and isinstance(substrings[0],
+                       pureldap.LDAPFilter_substrings_initial)):
+        initialLength = len(substrings[0].value)
+        initial = substrings.pop(0).value.lower()
+    if (substrings
+        and isinstance(substrings[-1],
+                       pureldap.LDAPFilter_substrings_final)):
+        final = substrings.pop().value.lower()
+        # What MatchMixin.match cuts off the end of the value.
+        finalLength = len(filter.substrings[0].value)
+    for any_ in substrings:
+        assert isinstance(any_, pureldap.LDAPFilter_substrings_any)
+    anys = [any_.value.lower() for any_ in substrings]
+
+    def match(entry):
+        if attr not in entry:
+            return False
+        possibleMatches = entry.get(attr)
+        if initial is not None:
+            possibleMatches = [
+                x[initialLength:]
+                for x in possibleMatches
+                if x.lower().startswith(initial)
+                ]
+        if final is not None:
+            possibleMatches = [
+                x[:-finalLength]
+                for x in possibleMatches
+                if x.lower().endswith(final)
+                ]
+        for any_ in anys:
+            if not possibleMatches:
+                return False
+            r = []
+            for possible in possibleMatches:
+                i = possible.lower().find(any_)
+                if i >= 0:
+                    r.append(possible[i:])
+            possibleMatches = r
+        return bool(possibleMatches)
+    return 4, match
+
+def _matchNothing(entry):
+    return False
+
+def _compileGreaterOrEqual(filter):
+    attr = filter.attributeDesc.value
+    ordering = orderingFor(attr)
+    try:
+        value = ordering(filter.assertionValue.value)
+    except ValueError:
+        return 0, _matchNothing
+    def match(entry):
+        for val in _orderedKeys(ordering, entry.get(attr, ())):
+            if val >= value:
+                return True
+        return False
+    return 3, match
+
+def _compileLessOrEqual(filter):
+    attr = filter.attributeDesc.value
+    ordering = orderingFor(attr)
+    try:
+        value = ordering(filter.assertionValue.value)
+    except ValueError:
+        return 0, _matchNothing
+    def match(entry):
+        for val in _orderedKeys(ordering, entry.get(attr, ())):
+            if val <= value:
+                return True
+        return False
+    return 3, match
+
+def _compileMembers(filter):
+    compiled = [_compileFilter(f) for f in filter]
+    cost = sum([c for c, _ in compiled])
+    # A member that can not be matched raises when called; keep the
+    # filter's order then, so it raises exactly when
+    # MatchMixin.match would rather than being skipped.
+    if cost != _notImplementedCost:
+        compiled.sort(key=lambda (cost, p): cost)
+    return cost, [p for _, p in compiled]
+
+def _compileAnd(filter):
+    cost, predicates = _compileMembers(filter)
+    def match(entry):
+        for p in predicates:
+            if not p(entry):
+                return False
+        return True
+    return cost, match
+
+def _compileOr(filter):
+    cost, predicates = _compileMembers(filter)
+    def match(entry):
+        for p in predicates:
+            if p(entry):
+                return True
+        return False
+    return cost, match
+
+def _compileNot(filter):
+    cost, p = _compileFilter(filter.value)
+    def match(entry):
+        return not p(entry)
+    return cost, match
+
+def _compileNotImplemented(filter):
+    def match(entry):
+        raise ldapsyntax.MatchNotImplemented, filter
+    return _notImplementedCost, match
+
+def _compileExtensibleMatch(filter):
+    if filter.matchingRule is not None:
+        return _compileNotImplemented(filter)
+    attrib = filter.type.value
+    match_value_lower = safelower(filter.matchValue.value)
+    def match(entry):
+        for val in entry.get(attrib, ()):
+            if val.lower() == match_value_lower:
+                return True
+        for rdn in entry.dn.listOfRDNs:
+            for av in rdn.attributeTypesAndValues:
+                if attrib == av.attributeType:
+                    if match_value_lower == safelower(av.value):
+                        return True
+        return False
+    return 5, match
+
+# Checked in order, so subclasses must come before their bases.
+_filterCompilers = [
+    (pureldap.LDAPFilter_present, _compilePresent),
+    (pureldap.LDAPFilter_equalityMatch, _compileEqualityMatch),
+    (pureldap.LDAPFilter_substrings, _compileSubstrings),
+    (pureldap.LDAPFilter_greaterOrEqual, _compileGreaterOrEqual),
+    (pureldap.LDAPFilter_lessOrEqual, _compileLessOrEqual),
+    (pureldap.LDAPFilter_and, _compileAnd),
+    (pureldap.LDAPFilter_or, _compileOr),
+    (pureldap.LDAPFilter_not, _compileNot),
+    (pureldap.LDAPFilter_extensibleMatch, _compileExtensibleMatch),
+    ]
+
+def _compileFilter(filter):
+    """
+    Return a tuple of (cost, predicate) for filter, where cost is a
+    rough estimate of how expensive the predicate is to call.
+    """
+    for klass, compiler in _filterCompilers:
+        if isinstance(filter, klass):
+            return compiler(filter)
+    return _compileNotImplemented(filter)
+
+def compileFilter(filter):
+    """
+    Compile an LDAPFilter into a predicate.
+
+    The returned callable takes an entry and returns whether it
+    matches filter, as MatchMixin.match(filter) would. The work that
+    does not depend on the entry, like walking the filter tree and
+    lowercasing assertion values, is done once here; AND and OR try
+    their cheapest members first. Filters that can not be matched
+    raise MatchNotImplemented when the predicate is called, and AND
+    and OR keep their members in order around them.
+    """
+    cost, predicate = _compileFilter(filter)
+    return predicate
+
+def _usesMatchMixin(klass):
+    """
+    Return whether klass matches filters with MatchMixin.match, so
+    the predicate from compileFilter can be used in its place.
+    """
+    match = getattr(klass, 'match', None)
+    return getattr(match, 'im_func', None) is MatchMixin.match.im_func
+
 class SearchByTreeWalkingMixin(object):
+    # An ldapfilter.FilterCache to parse and compile filters with,
+    # or None to do that anew for every search.
+    filterCache = None
+
+    def _searchIterator(self, scope, filterObject):
+        """
+        Return a callable that calls its callback argument with every
+        entry in scope that may match filterObject.
+
+        The entries are matched against filterObject afterwards, so
+        subclasses that can narrow down the candidates may override
+        this to skip entries that can not match.
+        """
+        # choose iterator: base/children/subtree
+        if scope == pureldap.LDAP_SCOPE_wholeSubtree:
+            iterator = self.subtree
+        elif scope == pureldap.LDAP_SCOPE_singleLevel:
+            iterator = self.children
+        elif scope == pureldap.LDAP_SCOPE_baseObject:
+            def iterateSelf(callback):
+                callback(self)
+                return defer.succeed(None)
+            iterator = iterateSelf
+        else:
+            raise ldaperrors.LDAPProtocolError, \
+                  'unknown search scope: %r' % scope
+        return iterator
+
     def search(self,
                filterText=None,
                filterObject=None,
@@ -240,14 +562,21 @@ class SearchByTreeWalkingMixin(object):
                timeLimit=0,
                typesOnly=0,
                callback=None):
+        if self.filterCache is None:
+            parseFilter = ldapfilter.parseFilter
+            compileMatch = compileFilter
+        else:
+            parseFilter = self.filterCache.parse
+            compileMatch = self.filterCache.compile
+
         if filterObject is None and filterText is None:
             filterObject=pureldap.LDAPFilterMatchAll
         elif filterObject is None and filterText is not None:
-            filterObject=ldapfilter.parseFilter(filterText)
+            filterObject=parseFilter(filterText)
         elif filterObject is not None and filterText is None:
             pass
         elif filterObject is not None and filterText is not None:
-            f=ldapfilter.parseFilter(filterText)
+            f=parseFilter(filterText)
             filterObject=pureldap.LDAPFilter_and((f, filterObject))
 
         if scope is None:
@@ -255,19 +584,7 @@ class SearchByTreeWalkingMixin(object):
         if derefAliases is None:
             derefAliases = pureldap.LDAP_DEREF_neverDerefAliases
 
-        # choose iterator: base/children/subtree
-        if scope == pureldap.LDAP_SCOPE_wholeSubtree:
-            iterator = self.subtree
-        elif scope == pureldap.LDAP_SCOPE_singleLevel:
-            iterator = self.children
-        elif scope == pureldap.LDAP_SCOPE_baseObject:
-            def iterateSelf(callback):
-                callback(self)
-                return defer.succeed(None)
-            iterator = iterateSelf
-        else:
-            raise ldaperrors.LDAPProtocolError, \
-                  'unknown search scope: %r' % scope
+        iterator = self._searchIterator(scope, filterObject)
 
         results = []
         if callback is None:
@@ -276,8 +593,21 @@ class SearchByTreeWalkingMixin(object):
             matchCallback = callback
 
         # gather results, send them
+        match = compileMatch(filterObject)
+        compiled = {}
         def _tryMatch(entry):
-            if entry.match(filterObject):
+            # the compiled filter only stands in for MatchMixin.match,
+            # entries overriding match() are asked themselves
+            klass = type(entry)
+            try:
+                useCompiled = compiled[klass]
+            except KeyError:
+                useCompiled = compiled[klass] = _usesMatchMixin(klass)
+            if useCompiled:
+                matched = match(entry)
+            else:
+                matched = entry.match(filterObject)
+            if matched:
                 matchCallback(entry)
 
         iterator(callback=_tryMatch)
@@ -1,7 +1,16 @@
+import gc
+import marshal
+import mmap
+import struct
+import sys
+from bisect import bisect_left, bisect_right
+
 from zope.interface import implements
 from twisted.internet import defer, error
 from twisted.python.failure import Failure
-from ldaptor import interfaces, entry, entryhelpers
+from twisted.python.util import InsensitiveDict
+from ldaptor import interfaces, entry, entryhelpers, attributeset
+from ldaptor.protocols import pureldap
 from ldaptor.protocols.ldap import distinguishedname, ldaperrors, ldifprotocol
 
 
@@ -9,6 +18,365 @@ class LDAPCannotRemoveRootError(ldaperrors.LDAPNamingViolation):
     """Cannot remove root of LDAP tree"""
 
 
+class InvalidSnapshotError(Exception):
+    """Not an ldaptor snapshot, or not one that can be loaded here."""
+
+    def __init__(self, path, reason=None):
+        Exception.__init__(self)
+        self.path = path
+        self.reason = reason
+
+    def __str__(self):
+        if self.reason is None:
+            return "%s is not an ldaptor snapshot." % repr(self.path)
+        return "Cannot load snapshot %s: %s." % (repr(self.path),
+                                                 self.reason)
+
+
+def _intersect(candidates):
+    """
+    Return the entries that are in all of the dicts by id() in
+    candidates, as a new dict by id().
+    """
+    candidates = sorted(candidates, key=len)
+    first, rest = candidates[0], candidates[1:]
+    r = {}
+    for k, e in first.iteritems():
+        for c in rest:
+            if k not in c:
+                break
+        else:
+            r[k] = e
+    return r
+
+
+class _AttributeIndex(object):
+    """
+    Index of the entries of a tree by keys made from the values of
+    one attribute.
+
+    Entries are kept in dicts by their id(), as entries compare and
+    hash by their DN and attributes, which may change.
+    """
+
+    def __init__(self, attributeType):
+        self.attributeType = attributeType
+        # key -> {id(entry): entry}
+        self._entries = {}
+        # id(entry) -> the keys entry is indexed under
+        self._keys = {}
+
+    def keys(self, values):
+        """Return the set of keys to index values under."""
+        raise NotImplementedError
+
+    def _added(self, key):
+        """Called when the first entry is indexed under key."""
+
+    def _removed(self, key):
+        """Called when the last entry indexed under key is removed."""
+
+    def add(self, entry):
+        self._addKeys(entry, self.keys(entry.get(self.attributeType, ())))
+
+    def _addKeys(self, entry, keys):
+        """Index entry under keys, as computed by keys()."""
+        if not keys:
+            return
+        self._keys[id(entry)] = keys
+        for key in keys:
+            entries = self._entries.get(key)
+            if entries is None:
+                entries = self._entries[key] = {}
+                self._added(key)
+            entries[id(entry)] = entry
+
+    def remove(self, entry):
+        for key in self._keys.pop(id(entry), ()):
+            entries = self._entries[key]
+            del entries[id(entry)]
+            if not entries:
+                del self._entries[key]
+                self._removed(key)
+
+
+class EqualityIndex(_AttributeIndex):
+    """
+    Index of entries by the lowercased values of one attribute, for
+    equality matches.
+    """
+
+    def keys(self, values):
+        return set([value.lower() for value in values])
+
+    def equal(self, value):
+        """
+        Return the entries with value, as a dict by id(); the dict
+        must not be modified.
+        """
+        return self._entries.get(value.lower(), {})
+
+
+# Put around values by SubstringIndex, so that initial and final
+# substrings only match at the start and end of values.
+_START = '\x02'
+_END = '\x03'
+
+def _trigrams(s):
+    return [s[i:i+3] for i in xrange(len(s)-2)]
+
+class SubstringIndex(_AttributeIndex):
+    """
+    Index of entries by the trigrams of the lowercased values of one
+    attribute, for substring matches.
+
+    Values are put between _START and _END before they are split, and
+    their first and last two characters are indexed too, so initial
+    and final substrings of one character can be looked up. Values
+    that contain _START or _END may be returned for substrings they
+    do not match, which the search then filters out.
+    """
+
+    def keys(self, values):
+        r = set()
+        for value in values:
+            s = _START + value.lower() + _END
+            r.update(_trigrams(s))
+            r.add(s[:2])
+            r.add(s[-2:])
+        return r
+
+    def substrings(self, substrings):
+        """
+        Return the entries that may match the LDAPFilter_substrings_*
+        in substrings, as a dict by id(), or None if the substrings
+        are too short to tell.
+        """
+        keys = set()
+        for substring in substrings:
+            value = substring.value.lower()
+            if isinstance(substring, pureldap.LDAPFilter_substrings_initial):
+                value = _START + value
+                if len(value) == 2:
+                    keys.add(value)
+            elif isinstance(substring, pureldap.LDAPFilter_substrings_final):
+                value = value + _END
+                if len(value) == 2:
+                    keys.add(value)
+            keys.update(_trigrams(value))
+        if not keys:
+            return None
+        return _intersect([self._entries.get(key, {}) for key in keys])
+
+
+class RangeIndex(_AttributeIndex):
+    """
+    Index of entries by the ordering keys of the values of one
+    attribute, for greaterOrEqual and lessOrEqual matches.
+
+    The values are ordered as the matches order them, see
+    entryhelpers.orderings; the ordering is looked up when the index
+    is created. The keys are kept in a list that is sorted when it
+    is next needed, so adding many entries costs one sort.
+    """
+
+    def __init__(self, attributeType):
+        super(RangeIndex, self).__init__(attributeType)
+        self.ordering = entryhelpers.orderingFor(attributeType)
+        self._sorted = []
+        self._dirty = False
+        # entries with more than one key, by id()
+        self._multiValued = {}
+
+    def _addKeys(self, entry, keys):
+        super(RangeIndex, self)._addKeys(entry, keys)
+        if len(self._keys.get(id(entry), ())) > 1:
+            self._multiValued[id(entry)] = entry
+
+    def remove(self, entry):
+        super(RangeIndex, self).remove(entry)
+        self._multiValued.pop(id(entry), None)
+
+    def keys(self, values):
+        r = set()
+        for value in values:
+            try:
+                r.add(self.ordering(value))
+            except ValueError:
+                pass
+        return r
+
+    def _sort(self):
+        if self._dirty:
+            self._sorted.sort()
+            self._dirty = False
+
+    def _added(self, key):
+        self._sorted.append(key)
+        self._dirty = True
+
+    def _removed(self, key):
+        self._sort()
+        del self._sorted[bisect_left(self._sorted, key)]
+
+    def range(self, filters):
+        """
+        Return the entries that may match all of filters, which are
+        LDAPFilter_greaterOrEqual and LDAPFilter_lessOrEqual on the
+        attribute of self, as a dict by id().
+        """
+        low = high = None
+        try:
+            for filter in filters:
+                key = self.ordering(filter.assertionValue.value)
+                if isinstance(filter, pureldap.LDAPFilter_greaterOrEqual):
+                    if low is None or key > low:
+                        low = key
+                else:
+                    if high is None or key < high:
+                        high = key
+        except ValueError:
+            return {}
+        self._sort()
+        if low is None:
+            start = 0
+        else:
+            start = bisect_left(self._sorted, low)
+        if high is None:
+            end = len(self._sorted)
+        else:
+            end = bisect_right(self._sorted, high)
+        r = {}
+        for key in self._sorted[start:end]:
+            r.update(self._entries[key])
+        if len(filters) > 1:
+            # each filter may match a different value of the entry
+            r.update(self._multiValued)
+        return r
+
+
+indexKinds = {
+    'equality': EqualityIndex,
+    'substring': SubstringIndex,
+    'range': RangeIndex,
+    }
+
+
+class _Versions(object):
+    """
+    The versions of an in-memory tree, shared by all its entries.
+
+    Every change to the tree makes a new version of it. A search pins
+    the version that is current when it starts, and the entries
+    changed while it runs keep their state as of that version for
+    it, until no search pins that version any more. See
+    ReadOnlyInMemoryLDAPEntry._save().
+    """
+
+    def __init__(self):
+        self.current = 0
+        # pinned version -> number of readers pinning it
+        self._readers = {}
+        # the entries that keep states as of older versions
+        self._saved = []
+
+    def newest(self):
+        """Return the newest pinned version, or None."""
+        if not self._readers:
+            return None
+        return max(self._readers)
+
+    def pin(self):
+        version = self.current
+        self._readers[version] = self._readers.get(version, 0) + 1
+        return version
+
+    def unpin(self, version):
+        readers = self._readers[version] - 1
+        if readers:
+            self._readers[version] = readers
+            return
+        del self._readers[version]
+        if self._readers and version > min(self._readers):
+            # older versions are still pinned
+            return
+        # drop the states that no pinned version sees any more
+        saved = []
+        for e in self._saved:
+            if self._readers:
+                oldest = min(self._readers)
+                e._old = [x for x in e._old if x[0] >= oldest] or None
+            else:
+                e._old = None
+            if e._old is not None:
+                saved.append(e)
+        self._saved = saved
+
+
+def _changing(name):
+    change = getattr(set, name)
+    def method(self, *args):
+        return change(self._writable(), *args)
+    method.__name__ = name
+    return method
+
+
+class _AttributeSet(attributeset.LDAPAttributeSet):
+    """
+    The values of an attribute of a ReadOnlyInMemoryLDAPEntry.
+
+    Changing them saves the entry first, see
+    ReadOnlyInMemoryLDAPEntry._save(), and changes the values the
+    entry has then, so reading them never copies the entry.
+    """
+
+    def __init__(self, key, *a, **kw):
+        self._entry = kw.pop('entry', None)
+        super(_AttributeSet, self).__init__(key, *a, **kw)
+
+    def _writable(self):
+        """Return the set to change instead of self."""
+        e = self._entry
+        if e is None:
+            return self
+        e._save()
+        live = e._attributes.get(self.key)
+        if live is None:
+            if e._old is not None:
+                # self may be kept for a pinned version
+                return attributeset.LDAPAttributeSet(self.key, self)
+            return self
+        return live
+
+    add = _changing('add')
+    clear = _changing('clear')
+    discard = _changing('discard')
+    pop = _changing('pop')
+    remove = _changing('remove')
+    update = _changing('update')
+    difference_update = _changing('difference_update')
+    intersection_update = _changing('intersection_update')
+    symmetric_difference_update = _changing('symmetric_difference_update')
+    __ior__ = _changing('__ior__')
+    __iand__ = _changing('__iand__')
+    __isub__ = _changing('__isub__')
+    __ixor__ = _changing('__ixor__')
+
+
+class _EntryVersion(entry.BaseLDAPEntry, entryhelpers.MatchMixin):
+    """
+    An in-memory entry as of an older version of its tree, kept for
+    the searches that pin that version. Filters are matched against
+    it with MatchMixin.match, whatever the class of the live entry.
+    """
+
+    def __init__(self, e):
+        self.dn = e.dn
+        self._attributes = e._attributes
+        self._parent = e._parent
+        self._children = e._children
+
+
 class ReadOnlyInMemoryLDAPEntry(entry.EditableLDAPEntry,
                                 entryhelpers.DiffTreeMixin,
                                 entryhelpers.SubtreeFromChildrenMixin,
@@ -17,11 +385,304 @@ class ReadOnlyInMemoryLDAPEntry(entry.EditableLDAPEntry,
                                 ):
     implements(interfaces.IConnectedLDAPEntry)
 
+    # All entries of a tree share one dict of the entries by the key()
+    # of their DN, so lookup() does not need to walk the tree. It is
+    # created when the tree gets its first child.
+    _index = None
+
+    # The attribute indexes of the tree by kind and lowercased
+    # attribute type, shared by all entries of the tree like _index.
+    # See addIndex().
+    _attributeIndexes = None
+
+    # The versions of the tree, shared by all entries of the tree like
+    # _index. Created when the tree is first searched. See _save().
+    _versions = None
+
+    # The states of the entry as of older versions of the tree that
+    # are still pinned, as (last version, _EntryVersion), oldest
+    # first, or None.
+    _old = None
+
     def __init__(self, *a, **kw):
         entry.BaseLDAPEntry.__init__(self, *a, **kw)
         self._parent = None
         self._children = {}
 
+    def _save(self):
+        """
+        Call before changing self, its attributes or its children.
+
+        If a pinned version of the tree sees self as it is, keep that
+        state of self for it, and give self copies of its attributes
+        and children to change. Searches never see the changes made to
+        the tree after they started, and the changes are not made in
+        place while a search may be looking.
+        """
+        versions = self._versions
+        if versions is None or not versions._readers:
+            return
+        old = self._old
+        if old is not None and versions.newest() <= old[-1][0]:
+            # no pinned version sees self as it is
+            return
+        state = (versions.current, _EntryVersion(self))
+        if old is None:
+            self._old = [state]
+            versions._saved.append(self)
+        else:
+            old.append(state)
+        self._children = dict(self._children)
+        attributes = InsensitiveDict()
+        for k, vs in self._attributes.items():
+            attributes[k] = self.buildAttributeSet(k, vs)
+        self._attributes = attributes
+
+    def _publish(self):
+        """Call after changing the tree, to make a new version of it."""
+        if self._versions is not None:
+            self._versions.current += 1
+
+    def _pin(self):
+        """
+        Pin the current version of the tree, and return it. The tree
+        keeps its entries as of that version until _unpin() is called
+        with it.
+        """
+        versions = self._versions
+        if versions is None:
+            versions = _Versions()
+            for e in self._root()._walk():
+                e._versions = versions
+        return versions.pin()
+
+    def _unpin(self, version):
+        self._versions.unpin(version)
+
+    def _at(self, version):
+        """
+        Return self as of a pinned version of the tree: self, or an
+        _EntryVersion if self has been changed since.
+        """
+        if self._old is not None:
+            for v, state in self._old:
+                if version <= v:
+                    return state
+        return self
+
+    def _walkAt(self, version):
+        e = self._at(version)
+        # before the caller can change e
+        children = e._children
+        yield e
+        for c in children.itervalues():
+            for x in c._walkAt(version):
+                yield x
+
+    def buildAttributeSet(self, key, values):
+        return _AttributeSet(key, values, entry=self)
+
+    def __setitem__(self, key, value):
+        self._save()
+        entry.EditableLDAPEntry.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._save()
+        entry.EditableLDAPEntry.__delitem__(self, key)
+
+    def _walk(self):
+        yield self
+        for c in self._children.itervalues():
+            for e in c._walk():
+                yield e
+
+    def _unindex(self):
+        for e in self._walk():
+            if self._index is not None:
+                del self._index[e.dn.key()]
+            if self._attributeIndexes is not None:
+                for index in self._attributeIndexes.itervalues():
+                    index.remove(e)
+
+    def _reindex(self):
+        for e in self._walk():
+            if self._index is not None:
+                self._index[e.dn.key()] = e
+            if self._attributeIndexes is not None:
+                for index in self._attributeIndexes.itervalues():
+                    index.add(e)
+
+    def _root(self):
+        root = self
+        while root._parent is not None:
+            root = root._parent
+        return root
+
+    def addIndex(self, attributeType, kind='equality'):
+        """
+        Index the entries of the whole tree by the values of
+        attributeType, so searches on it do not need to look at every
+        entry.
+
+        kind is a key of indexKinds: 'equality' indexes values for
+        equality matches, 'substring' indexes their trigrams for
+        substring matches and 'range' keeps them sorted for
+        greaterOrEqual and lessOrEqual matches.
+
+        The indexes are kept up to date when entries are added,
+        deleted or moved; other changes to the attributes of an entry
+        are seen by the indexes when it is committed.
+        """
+        root = self._root()
+        indexes = root._attributeIndexes
+        if indexes is None:
+            indexes = {}
+            for e in root._walk():
+                e._attributeIndexes = indexes
+        index = indexKinds[kind](attributeType)
+        for e in root._walk():
+            index.add(e)
+        indexes[kind, attributeType.lower()] = index
+
+    def removeIndex(self, attributeType, kind='equality'):
+        """Stop indexing the tree by attributeType."""
+        indexes = self._attributeIndexes
+        if indexes is None or (kind, attributeType.lower()) not in indexes:
+            raise KeyError, attributeType
+        del indexes[kind, attributeType.lower()]
+
+    def _plan(self, filter):
+        """
+        Return the entries of the tree that may match filter, as a
+        dict by id(), or None if the indexes can not tell.
+        """
+        if isinstance(filter, pureldap.LDAPFilter_equalityMatch):
+            index = self._attributeIndexes.get(
+                ('equality', filter.attributeDesc.value.lower()))
+            if index is None:
+                return None
+            return index.equal(filter.assertionValue.value)
+        elif isinstance(filter, pureldap.LDAPFilter_substrings):
+            index = self._attributeIndexes.get(
+                ('substring', filter.type.lower()))
+            if index is None:
+                return None
+            return index.substrings(filter.substrings)
+        elif isinstance(filter, (pureldap.LDAPFilter_greaterOrEqual,
+                                 pureldap.LDAPFilter_lessOrEqual)):
+            index = self._rangeIndex(filter)
+            if index is None:
+                return None
+            return index.range([filter])
+        elif isinstance(filter, pureldap.LDAPFilter_and):
+            # look up all the bounds on one attribute in one go
+            plans = []
+            ranges = {}
+            for f in filter:
+                index = self._rangeIndex(f)
+                if index is None:
+                    p = self._plan(f)
+                    if p is not None:
+                        plans.append(p)
+                else:
+                    ranges.setdefault(index, []).append(f)
+            for index, filters in ranges.iteritems():
+                plans.append(index.range(filters))
+            if not plans:
+                return None
+            return _intersect(plans)
+        elif isinstance(filter, pureldap.LDAPFilter_or):
+            r = {}
+            for f in filter:
+                p = self._plan(f)
+                if p is None:
+                    return None
+                r.update(p)
+            return r
+        else:
+            return None
+
+    def _rangeIndex(self, filter):
+        if not isinstance(filter, (pureldap.LDAPFilter_greaterOrEqual,
+                                   pureldap.LDAPFilter_lessOrEqual)):
+            return None
+        return self._attributeIndexes.get(
+            ('range', filter.attributeDesc.value.lower()))
+
+    def _searchIterator(self, scope, filterObject):
+        """
+        Iterate over the entries as of the version of the tree that is
+        current when the search starts; changes made to the tree while
+        the search runs, as by its callback, are not seen. See _save().
+        """
+        if scope not in (pureldap.LDAP_SCOPE_wholeSubtree,
+                         pureldap.LDAP_SCOPE_singleLevel,
+                         pureldap.LDAP_SCOPE_baseObject):
+            return super(ReadOnlyInMemoryLDAPEntry, self)._searchIterator(
+                scope, filterObject)
+
+        candidates = None
+        if (self._attributeIndexes
+            and scope != pureldap.LDAP_SCOPE_baseObject):
+            candidates = self._plan(filterObject)
+            if candidates is not None:
+                candidates = candidates.values()
+
+        def iterate(callback):
+            version = self._pin()
+            try:
+                if candidates is None:
+                    entries = self._scopeAt(scope, version)
+                else:
+                    entries = self._candidatesAt(candidates, scope, version)
+                for e in entries:
+                    callback(e)
+            finally:
+                self._unpin(version)
+            return defer.succeed(None)
+        return iterate
+
+    def _scopeAt(self, scope, version):
+        """Yield the entries in scope as of version."""
+        if scope == pureldap.LDAP_SCOPE_wholeSubtree:
+            for e in self._walkAt(version):
+                yield e
+        elif scope == pureldap.LDAP_SCOPE_singleLevel:
+            for c in self._at(version)._children.itervalues():
+                yield c._at(version)
+        else:
+            yield self._at(version)
+
+    def _candidatesAt(self, candidates, scope, version):
+        """
+        Yield the entries of candidates in scope as of version, leaving
+        out the ones that were not in the tree under self then.
+        """
+        wholeSubtree = scope == pureldap.LDAP_SCOPE_wholeSubtree
+        for e in candidates:
+            depth = self._depthAt(e, version)
+            if depth == 1 or (wholeSubtree and depth is not None):
+                yield e._at(version)
+
+    def _depthAt(self, e, version):
+        """
+        Return how many levels below self e was as of version, 0 for
+        self, or None if it was not under self, going up from e
+        through the parents and children the entries had then.
+        """
+        depth = 0
+        while e is not self:
+            state = e._at(version)
+            parent = state._parent
+            if parent is None:
+                return None
+            rdn_str = str(state.dn.split()[0])
+            if parent._at(version)._children.get(rdn_str) is not e:
+                return None
+            e = parent
+            depth += 1
+        return depth
+
     def parent(self):
         return self._parent
 
@@ -33,17 +694,29 @@ class ReadOnlyInMemoryLDAPEntry(entry.EditableLDAPEntry,
                 callback(c)
             return defer.succeed(None)
 
+    def _get(self, key):
+        """
+        Return the entry under self whose DN has key, see
+        DistinguishedName.key(), or None if there is none.
+        """
+        mine = self.dn.key()
+        if key[:len(mine)] != mine:
+            return None
+        if key == mine:
+            return self
+        if self._index is not None:
+            return self._index.get(key)
+        return None
+
     def _lookup(self, dn):
-        if not self.dn.contains(dn):
+        if isinstance(dn, distinguishedname.DistinguishedName):
+            key = dn.key()
+        else:
+            key = distinguishedname.DistinguishedName(dn).key()
+        e = self._get(key)
+        if e is None:
             raise ldaperrors.LDAPNoSuchObject(dn)
-        if dn == self.dn:
-            return defer.succeed(self)
-
-        for c in self._children.values():
-            if c.dn.contains(dn):
-                return c.lookup(dn)
-
-        raise ldaperrors.LDAPNoSuchObject(dn)
+        return defer.succeed(e)
 
     def lookup(self, dn):
         return defer.maybeDeferred(self._lookup, dn)
@@ -54,15 +727,45 @@ class ReadOnlyInMemoryLDAPEntry(entry.EditableLDAPEntry,
     def addChild(self, rdn, attributes):
         """TODO ugly API. Returns the created entry."""
         rdn = distinguishedname.RelativeDistinguishedName(rdn)
-        rdn_str = str(rdn)
-        if rdn_str in self._children:
-            raise ldaperrors.LDAPEntryAlreadyExists, self._children[rdn_str].dn
-        dn = distinguishedname.DistinguishedName(
-            listOfRDNs=(rdn,) + self.dn.split())
-        e = ReadOnlyInMemoryLDAPEntry(dn, attributes)
+        existing = self._existing(rdn)
+        if existing is not None:
+            raise ldaperrors.LDAPEntryAlreadyExists, existing.dn
+        e = ReadOnlyInMemoryLDAPEntry(self.dn.child(rdn), attributes)
+        self._adopt(str(rdn), e)
+        return e
+
+    def _existing(self, rdn):
+        """
+        Return the child of self with rdn, ignoring case like lookup(),
+        or None.
+        """
+        e = self._children.get(str(rdn))
+        if e is None and self._index is not None:
+            e = self._index.get(self.dn.key() + (rdn.key(),))
+        return e
+
+    def _adopt(self, rdn_str, e):
+        """
+        Add e, an entry without a parent or children whose DN is
+        that of self with an RDN of rdn_str in front, as a child of
+        self.
+        """
+        self._save()
         e._parent = self
+        if self._index is None:
+            index = {}
+            for x in self._root()._walk():
+                x._index = index
+                index[x.dn.key()] = x
+        e._index = self._index
+        self._index[e.dn.key()] = e
+        e._attributeIndexes = self._attributeIndexes
+        if self._attributeIndexes is not None:
+            for index in self._attributeIndexes.itervalues():
+                index.add(e)
+        e._versions = self._versions
         self._children[rdn_str] = e
-        return e
+        self._publish()
 
     def _delete(self):
         if self._parent is None:
@@ -78,10 +781,18 @@ class ReadOnlyInMemoryLDAPEntry(entry.EditableLDAPEntry,
         if not isinstance(rdn, distinguishedname.RelativeDistinguishedName):
             rdn = distinguishedname.RelativeDistinguishedName(stringValue=rdn)
         rdn_str = str(rdn)
-        try:
-            return self._children.pop(rdn_str)
-        except KeyError:
+        if rdn_str not in self._children:
             raise ldaperrors.LDAPNoSuchObject, rdn
+        self._save()
+        e = self._children.pop(rdn_str)
+        # the deleted entries become a tree of their own
+        e._unindex()
+        e._save()
+        e._parent = None
+        for x in e._walk():
+            x._index = x._attributeIndexes = None
+        self._publish()
+        return e
 
     def deleteChild(self, rdn):
         return defer.maybeDeferred(self._deleteChild, rdn)
@@ -101,9 +812,19 @@ class ReadOnlyInMemoryLDAPEntry(entry.EditableLDAPEntry,
         return d
 
     def _move2(self, newParent, newDN):
-        if newParent is not None:
-            newParent._children[str(newDN.split()[0])] = self
+        if self._parent is not None:
+            existing = (newParent or self._parent)._existing(newDN.split()[0])
+            if existing is not None and existing is not self:
+                raise ldaperrors.LDAPEntryAlreadyExists, existing.dn
+        self._unindex()
+        self._save()
+        if self._parent is not None:
+            self._parent._save()
             del self._parent._children[str(self.dn.split()[0])]
+            if newParent is not None:
+                self._parent = newParent
+            self._parent._save()
+            self._parent._children[str(newDN.split()[0])] = self
         # remove old RDN attributes
         for attr in self.dn.split()[0].split():
             self[attr.attributeType].remove(attr.value)
@@ -112,12 +833,26 @@ class ReadOnlyInMemoryLDAPEntry(entry.EditableLDAPEntry,
             # TODO what if the key does not exist?
             self[attr.attributeType].add(attr.value)
         self.dn = newDN
+        self._renameChildren()
+        self._reindex()
+        self._publish()
         return self
 
+    def _renameChildren(self):
+        for c in self._children.itervalues():
+            c._save()
+            c.dn = self.dn.child(c.dn.split()[0])
+            c._renameChildren()
+
     def move(self, newDN):
         return defer.maybeDeferred(self._move, newDN)
 
     def commit(self):
+        if self._attributeIndexes is not None:
+            for index in self._attributeIndexes.itervalues():
+                index.remove(self)
+                index.add(self)
+        self._publish()
         return defer.succeed(True)
 
 
@@ -184,8 +919,113 @@ class InMemoryLDIFProtocol(ldifprotocol.LDIF):
         del self._deferred  # invalidate it to flush out bugs
 
 
-def fromLDIFFile(f):
-    """Read LDIF data from a file."""
+class BulkInMemoryLDIFProtocol(InMemoryLDIFProtocol):
+
+    """
+    Receive LDIF data and build an ReadOnlyInMemoryLDAPEntry from it,
+    like InMemoryLDIFProtocol, but faster.
+
+    Entries are parsed straight into ReadOnlyInMemoryLDAPEntries and
+    added to their parent, which is found by its DN in the tree,
+    instead of through a lookup and a chain of Deferreds; the tree
+    built is the same. Parents must still come before their
+    children. lookupFailed and addFailed are called as
+    with InMemoryLDIFProtocol, but with the reason as a Failure
+    rather than as a Deferred errback; returning a Failure aborts the
+    load, returning None skips the entry.
+
+    If progress is not None, it is called with the number of entries
+    loaded so far after every progressInterval entries, and when all
+    the entries have been loaded.
+    """
+
+    progressInterval = 10000
+
+    def __init__(self, progress=None):
+        InMemoryLDIFProtocol.__init__(self)
+        self.progress = progress
+        self.count = 0
+        self._failure = None
+
+    def _abort(self, reason):
+        if isinstance(reason, Failure):
+            self._failure = reason
+            return True
+        return False
+
+    def makeEntry(self, dn, attributes):
+        # InMemoryLDIFProtocol copies entries, which names objectClass
+        # as BaseLDAPEntry.items() does
+        objectClasses = []
+        for key in attributes.keys():
+            if key.lower() == 'objectclass':
+                objectClasses.extend(attributes.pop(key))
+        if objectClasses:
+            attributes['objectClass'] = objectClasses
+        return ReadOnlyInMemoryLDAPEntry(
+            dn=distinguishedname.parseLinked(dn),
+            attributes=attributes)
+
+    def gotEntry(self, entry):
+        if self._failure is not None:
+            return
+        if self.db is None:
+            self.db = entry
+        else:
+            parent = self.db._get(entry.dn.key()[:-1])
+            if parent is None:
+                reason = self.lookupFailed(
+                    Failure(ldaperrors.LDAPNoSuchObject(entry.dn.up())),
+                    entry)
+                if reason is None or self._abort(reason):
+                    return
+                parent = reason
+            try:
+                rdn = entry.dn.split()[0]
+                existing = parent._existing(rdn)
+                if existing is not None:
+                    raise ldaperrors.LDAPEntryAlreadyExists, existing.dn
+                entry.dn = parent.dn.child(rdn)
+                parent._adopt(str(rdn), entry)
+            except Exception:
+                self._abort(self.addFailed(Failure(), entry))
+                return
+        self.count += 1
+        if self.progress is not None and self.count % self.progressInterval == 0:
+            self.progress(self.count)
+
+    def connectionLost(self, reason):
+        ldifprotocol.LDIF.connectionLost(self, reason)
+        if not reason.check(error.ConnectionDone):
+            self.completed.errback(reason)
+        elif self._failure is not None:
+            self.completed.errback(self._failure)
+        else:
+            if self.progress is not None:
+                self.progress(self.count)
+            self.completed.callback(self.db)
+
+
+def fromLDIFFile(f, bulk=False, progress=None):
+    """
+    Read LDIF data from a file.
+
+    If bulk is true, load the entries with a BulkInMemoryLDIFProtocol,
+    which calls progress, if given, as the entries are loaded. The
+    lines of f are then passed to it one by one, so it does not
+    search the rest of the file for the end of each line.
+    """
+
+    if bulk:
+        p = BulkInMemoryLDIFProtocol(progress=progress)
+        for line in f:
+            if not line.endswith(p.delimiter):
+                # keep it buffered, as dataReceived would
+                p.dataReceived(line)
+                break
+            p.lineReceived(line[:-len(p.delimiter)])
+        p.connectionLost(Failure(error.ConnectionDone()))
+        return p.completed
 
     p = InMemoryLDIFProtocol()
     while 1:
@@ -196,3 +1036,326 @@ def fromLDIFFile(f):
     p.connectionLost(Failure(error.ConnectionDone()))
 
     return p.completed
+
+
+# The snapshot file format of toSnapshotFile() and fromSnapshotFile().
+# All numbers are little-endian. A snapshot starts with a header of
+# the magic string, the format version, the marshal version and the
+# major and minor Python version (as in sys.hexversion >> 16) it was
+# written with, the number of entries and the offsets of the entry
+# data, the entry table, the attribute names and the indexes, in that
+# order in the file. Only the same marshal and Python versions load
+# a snapshot, as marshal does not promise anything else.
+SNAPSHOT_MAGIC = 'ldaptor-snapshot'
+_SNAPSHOT_VERSION = 2
+_snapshotHeader = struct.Struct('<16sIIIIQQQQ')
+_pythonVersion = sys.hexversion >> 16
+# The entry table has, for each entry, the number of its parent entry,
+# -1 for the root, and the offset of its data in the entry data. The
+# entries are numbered in the order of the table, parents first.
+_snapshotEntry = struct.Struct('<iQ')
+# The data of an entry is the str of its first RDN, the number of RDNs
+# of its DN, all of them for the root and only the first one for the
+# others, then the number of attribute types and values of each RDN,
+# each made of the number of the attribute name and the value. Then
+# the number of attributes, each made of the number of its name, the
+# number of values and the values. Strings are prefixed with their
+# length. Attribute names are a marshalled list and the indexes are a
+# marshalled list of the kind, attribute type and {number of entry:
+# keys} of each index.
+_uint = struct.Struct('<I')
+
+
+def _snapshotValue(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def toSnapshotFile(db, f):
+    """
+    Write the tree under db to f, a file open for writing in binary
+    mode, as a snapshot for fromSnapshotFile().
+
+    The attribute indexes of the tree are written along with the
+    entries under db. Attribute values are written as str, unicode
+    ones encoded in UTF-8, and are indexed as such.
+    """
+    names = {}
+    def name(n):
+        i = names.get(n)
+        if i is None:
+            i = names[n] = len(names)
+        return _uint.pack(i)
+
+    def string(s):
+        return _uint.pack(len(s)) + s
+
+    indexes = []
+    if db._attributeIndexes is not None:
+        for (kind, attributeType), index in sorted(
+            db._attributeIndexes.iteritems()):
+            indexes.append((kind, index, {}))
+
+    f.write(_snapshotHeader.pack('', 0, 0, 0, 0, 0, 0, 0, 0))
+    dataOffset = f.tell()
+    offset = 0
+    table = []
+    numbers = {}
+    for e in db._walk():
+        if e is db:
+            parent = -1
+            rdns = e.dn.split()
+        else:
+            parent = numbers[id(e._parent)]
+            rdns = e.dn.split()[:1]
+        number = numbers[id(e)] = len(table)
+        table.append(_snapshotEntry.pack(parent, offset))
+
+        l = [string(str(rdns[0])), _uint.pack(len(rdns))]
+        for rdn in rdns:
+            avas = rdn.split()
+            l.append(_uint.pack(len(avas)))
+            for ava in avas:
+                l.append(name(ava.attributeType))
+                l.append(string(_snapshotValue(ava.value)))
+        l.append(_uint.pack(len(e.keys())))
+        for attributeType, values in e.items():
+            l.append(name(attributeType))
+            l.append(_uint.pack(len(values)))
+            for value in values:
+                l.append(string(_snapshotValue(value)))
+        data = ''.join(l)
+        f.write(data)
+        offset += len(data)
+
+        for kind, index, keys in indexes:
+            k = index.keys([_snapshotValue(v)
+                            for v in e.get(index.attributeType, ())])
+            if k:
+                keys[number] = list(k)
+
+    tableOffset = dataOffset + offset
+    f.write(''.join(table))
+    namesOffset = f.tell()
+    l = [None] * len(names)
+    for n, i in names.iteritems():
+        l[i] = n
+    f.write(marshal.dumps(l))
+    indexesOffset = f.tell()
+    f.write(marshal.dumps([(kind, index.attributeType, keys)
+                           for kind, index, keys in indexes]))
+    f.seek(0)
+    f.write(_snapshotHeader.pack(SNAPSHOT_MAGIC, _SNAPSHOT_VERSION,
+                                 marshal.version, _pythonVersion,
+                                 len(table), dataOffset, tableOffset,
+                                 namesOffset, indexesOffset))
+    f.seek(0, 2)
+
+
+class _Snapshot(object):
+    """The mapped data of a snapshot file, see toSnapshotFile()."""
+
+    def __init__(self, data, dataOffset, names):
+        self.data = data
+        self.dataOffset = dataOffset
+        self.names = names
+        self.entries = []
+
+    def close(self):
+        """Decode the entries not decoded yet and unmap the data."""
+        for e in self.entries:
+            e._attributes
+        self.entries = None
+        self.data.close()
+
+    def _uint(self, offset):
+        return _uint.unpack_from(self.data, offset)[0], offset + 4
+
+    def _string(self, offset):
+        length, offset = self._uint(offset)
+        return self.data[offset:offset + length], offset + length
+
+    def rdns(self, offset):
+        """
+        Return the str of the first RDN of the entry at offset, its
+        RDNs, and the offset of its attributes.
+        """
+        rdn_str, offset = self._string(offset + self.dataOffset)
+        rdns = []
+        count, offset = self._uint(offset)
+        for i in xrange(count):
+            avas = []
+            avaCount, offset = self._uint(offset)
+            for j in xrange(avaCount):
+                n, offset = self._uint(offset)
+                value, offset = self._string(offset)
+                avas.append(distinguishedname.LDAPAttributeTypeAndValue(
+                    attributeType=self.names[n], value=value))
+            rdns.append(distinguishedname.RelativeDistinguishedName(
+                attributeTypesAndValues=avas))
+        return rdn_str, rdns, offset
+
+    def attributes(self, e, offset):
+        """Return the attributes of e, whose data is at offset."""
+        attributes = InsensitiveDict()
+        count, offset = self._uint(offset)
+        for i in xrange(count):
+            n, offset = self._uint(offset)
+            valueCount, offset = self._uint(offset)
+            values = []
+            for j in xrange(valueCount):
+                value, offset = self._string(offset)
+                values.append(value)
+            attributeType = self.names[n]
+            attributes[attributeType] = e.buildAttributeSet(attributeType,
+                                                            values)
+        return attributes
+
+
+class _SnapshotEntry(ReadOnlyInMemoryLDAPEntry):
+    """
+    An entry loaded by fromSnapshotFile(). Its attributes are decoded
+    from the snapshot when first used.
+    """
+
+    _decoded = None
+
+    def __init__(self, dn, snapshot, offset):
+        self.dn = dn
+        self._parent = None
+        self._children = {}
+        self._snapshot = snapshot
+        self._offset = offset
+
+    def _getAttributes(self):
+        if self._decoded is None:
+            self._decoded = self._snapshot.attributes(self, self._offset)
+            self._snapshot = None
+        return self._decoded
+
+    def _setAttributes(self, attributes):
+        self._decoded = attributes
+        self._snapshot = None
+
+    _attributes = property(_getAttributes, _setAttributes)
+
+
+class _SnapshotRoot(_SnapshotEntry):
+    """The root entry of a tree loaded by fromSnapshotFile()."""
+
+    def __init__(self, dn, snapshot, offset):
+        _SnapshotEntry.__init__(self, dn, snapshot, offset)
+        self._mapped = snapshot
+
+    def close(self):
+        """
+        Decode the attributes of all the entries loaded with this one
+        that have not been used yet, and close the snapshot file.
+
+        The file stays mapped to memory until then, or until the
+        tree is garbage collected.
+        """
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+
+def fromSnapshotFile(path):
+    """
+    Load the snapshot written by toSnapshotFile() to the file at
+    path. Returns a Deferred of the root of the tree, like
+    fromLDIFFile().
+
+    The file is mapped to memory. Only the DNs of the entries are
+    read when loading; the attributes of each entry are decoded the
+    first time they are used, and its indexes are loaded as written.
+    Call close() on the root to decode the rest and close the file.
+
+    The Deferred fails with InvalidSnapshotError if the file is not a
+    snapshot, was written by another version of Python, or is damaged.
+    """
+    return defer.maybeDeferred(_fromSnapshotFile, path)
+
+
+def _fromSnapshotFile(path):
+    f = open(path, 'rb')
+    try:
+        header = f.read(_snapshotHeader.size)
+        if len(header) < _snapshotHeader.size:
+            raise InvalidSnapshotError(path)
+        (magic, version, marshalVersion, pythonVersion, count, dataOffset,
+         tableOffset, namesOffset, indexesOffset) = \
+            _snapshotHeader.unpack(header)
+        if magic != SNAPSHOT_MAGIC:
+            raise InvalidSnapshotError(path)
+        if version != _SNAPSHOT_VERSION:
+            raise InvalidSnapshotError(
+                path, 'format version %d, not %d' % (version,
+                                                     _SNAPSHOT_VERSION))
+        if (marshalVersion != marshal.version
+            or pythonVersion != _pythonVersion):
+            raise InvalidSnapshotError(
+                path, 'written with marshal version %d by Python %d.%d'
+                % (marshalVersion, pythonVersion >> 8, pythonVersion & 0xff))
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+    try:
+        if not (_snapshotHeader.size <= dataOffset <= tableOffset
+                and tableOffset + count * _snapshotEntry.size == namesOffset
+                and namesOffset <= indexesOffset <= len(data)):
+            raise InvalidSnapshotError(path, 'damaged header')
+        try:
+            db = _loadSnapshot(data, count, dataOffset, tableOffset,
+                               namesOffset, indexesOffset)
+        except (struct.error, ValueError, EOFError, TypeError, IndexError,
+                KeyError):
+            raise InvalidSnapshotError(path, 'damaged data')
+    except Exception:
+        data.close()
+        raise
+    return db
+
+
+def _loadSnapshot(data, count, dataOffset, tableOffset, namesOffset,
+                  indexesOffset):
+    """Build the tree of the snapshot in data, see fromSnapshotFile()."""
+    # Loading creates many objects that all live as long as the tree;
+    # do not have the garbage collector look at them over and over.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        snapshot = _Snapshot(data, dataOffset,
+                             marshal.loads(data[namesOffset:indexesOffset]))
+        entries = []
+        for number in xrange(count):
+            parent, offset = _snapshotEntry.unpack_from(
+                data, tableOffset + number * _snapshotEntry.size)
+            rdn_str, rdns, offset = snapshot.rdns(offset)
+            if parent < 0:
+                e = _SnapshotRoot(
+                    distinguishedname.DistinguishedName(listOfRDNs=rdns),
+                    snapshot, offset)
+                # filled in below, once all entries are in the tree
+                e._attributeIndexes = {}
+            else:
+                parent = entries[parent]
+                e = _SnapshotEntry(parent.dn.child(rdns[0]),
+                                   snapshot, offset)
+                parent._adopt(rdn_str, e)
+            entries.append(e)
+        snapshot.entries = entries
+
+        db = entries[0]
+        indexes = marshal.loads(data[indexesOffset:])
+        for kind, attributeType, keys in indexes:
+            index = indexKinds[kind](attributeType)
+            for number, k in keys.iteritems():
+                index._addKeys(entries[number], set(k))
+            db._attributeIndexes[kind, attributeType.lower()] = index
+    finally:
+        if enabled:
+            gc.enable()
+    return db
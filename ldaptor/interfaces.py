@@ -366,3 +366,20 @@ class ILDAPConfig(Interface):
 
     def getIdentitySearch(self, name):
         """TODO"""
+
+    def getIdentitySearchTemplate(self):
+        """
+        Return the identity search filter, with a %(name)s placeholder
+        for the user name.
+
+        Optional; configurations without it only provide
+        getIdentitySearch().
+        """
+
+    def getIdentitySearchFilter(self, name):
+        """
+        Return the identity search filter for name, as an LDAPFilter.
+
+        Optional; LDAPBindingChecker parses getIdentitySearch(name)
+        for configurations without it.
+        """
@@ -1,5 +1,8 @@
 #!/usr/bin/python
 
+import re
+from collections import OrderedDict
+
 from ldaptor.protocols import pureldap
 
 """
@@ -29,6 +32,10 @@ RFC2254:
         attr       = AttributeDescription from Section 4.1.5 of [1]
         matchingrule = MatchingRuleId from Section 4.1.9 of [1]
         value      = AttributeValue from Section 4.1.6 of [1]
+
+The grammar is parsed by hand, one character of lookahead at a
+time. It accepts exactly what the pyparsing grammar in
+ldaptor.test.pyparsingfilter accepts, and builds the same objects.
 """
 
 class InvalidLDAPFilter(Exception):
@@ -45,191 +52,472 @@ class InvalidLDAPFilter(Exception):
 def parseExtensible(attr, s):
     raise NotImplementedError
 
-from pyparsing import Word, Literal, Optional, ZeroOrMore, Suppress, \
-                       Group, Forward, OneOrMore, ParseException, \
-                       CharsNotIn, Combine, StringStart, \
-                       StringEnd, delimitedList
-
-import string
-
-filter_ = Forward()
-attr = Word(string.ascii_letters,
-            string.ascii_letters + string.digits + ';-',)
-attr.leaveWhitespace()
-attr.setName('attr')
-hexdigits = Word(string.hexdigits, exact=2)
-hexdigits.setName('hexdigits')
-escaped = Suppress(Literal('\\'))+hexdigits
-escaped.setName('escaped')
-def _p_escaped(s,l,t):
-    text=t[0]
-    return chr(int(text, 16))
-escaped.setParseAction(_p_escaped)
-value = Combine(OneOrMore(CharsNotIn('*()\\\0') | escaped))
-value.setName('value')
-equal = Literal("=")
-equal.setParseAction(lambda s,l,t: pureldap.LDAPFilter_equalityMatch)
-approx = Literal("~=")
-approx.setParseAction(lambda s,l,t: pureldap.LDAPFilter_approxMatch)
-greater = Literal(">=")
-greater.setParseAction(lambda s,l,t: pureldap.LDAPFilter_greaterOrEqual)
-less = Literal("<=")
-less.setParseAction(lambda s,l,t: pureldap.LDAPFilter_lessOrEqual)
-filtertype = equal | approx | greater | less
-filtertype.setName('filtertype')
-simple = attr + filtertype + value
-simple.leaveWhitespace()
-simple.setName('simple')
-def _p_simple(s,l,t):
-    attr, filtertype, value = t
-    return filtertype(attributeDesc=pureldap.LDAPAttributeDescription(attr),
-                      assertionValue=pureldap.LDAPAssertionValue(value))
-simple.setParseAction(_p_simple)
-present = attr + "=*"
-present.setParseAction(lambda s,l,t: pureldap.LDAPFilter_present(t[0]))
-initial = value.copy()
-initial.setParseAction(lambda s,l,t: pureldap.LDAPFilter_substrings_initial(t[0]))
-initial.setName('initial')
-any_value = value + Suppress(Literal("*"))
-any_value.setParseAction(lambda s,l,t: pureldap.LDAPFilter_substrings_any(t[0]))
-any = Suppress(Literal("*")) + ZeroOrMore(any_value)
-any.setName('any')
-final = value.copy()
-final.setName('final')
-final.setParseAction(lambda s,l,t: pureldap.LDAPFilter_substrings_final(t[0]))
-substring = attr + Suppress(Literal("=")) + Group(Optional(initial) + any + Optional(final))
-substring.setName('substring')
-def _p_substring(s,l,t):
-    attrtype, substrings = t
-    return pureldap.LDAPFilter_substrings(
-        type=attrtype,
-        substrings=substrings)
-substring.setParseAction(_p_substring)
-
-keystring = Word(string.ascii_letters,
-                 string.ascii_letters + string.digits + ';-')
-keystring.setName('keystring')
-numericoid = delimitedList(Word(string.digits), delim='.', combine=True)
-numericoid.setName('numericoid')
-oid = numericoid | keystring
-oid.setName('oid')
-matchingrule = oid.copy()
-matchingrule.setName('matchingrule')
-
-extensible_dn = Optional(":dn")
-def _p_extensible_dn(s,l,t):
-    return bool(t)
-extensible_dn.setParseAction(_p_extensible_dn)
-
-matchingrule_or_none = Optional(Suppress(":") + matchingrule)
-def _p_matchingrule_or_none(s,l,t):
-    if not t:
-        return [None]
+_attr = re.compile(r'[a-zA-Z][a-zA-Z0-9;-]*')
+_numericoid = re.compile(r'[0-9]+(?:\.[0-9]+)*')
+_hexdigits = re.compile(r'[0-9a-fA-F]{2}')
+_valueChars = re.compile(r'[^*()\\\0]+')
+_maybeSubStringChars = re.compile(r'[^*\\\0]+')
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+_filtertypes = {
+    '~': pureldap.LDAPFilter_approxMatch,
+    '>': pureldap.LDAPFilter_greaterOrEqual,
+    '<': pureldap.LDAPFilter_lessOrEqual,
+    }
+
+def _fail(msg, loc, s):
+    raise InvalidLDAPFilter(msg, loc, s)
+
+def _value(s, i, chars=_valueChars):
+    """
+    Parse a value at s[i:], with escapes already decoded.
+
+    Returns (value, end), value being None if there is no value at i.
+    """
+    parts = []
+    while True:
+        m = chars.match(s, i)
+        if m is not None:
+            parts.append(m.group())
+            i = m.end()
+        elif s.startswith('\\', i):
+            m = _hexdigits.match(s, i+1)
+            if m is None:
+                break
+            parts.append(chr(int(m.group(), 16)))
+            i = m.end()
+        else:
+            break
+    if not parts:
+        return None, i
+    return ''.join(parts), i
+
+def _substrings(s, i, initial, skip=None):
+    """
+    Parse the rest of a substring filter, s[i] being the first "*".
+
+    If skip is given, it is matched before every "*" and value, to
+    skip whitespace.
+
+    Returns (substrings, end).
+    """
+    substrings = []
+    if initial is not None:
+        substrings.append(pureldap.LDAPFilter_substrings_initial(initial))
+    i += 1
+    while True:
+        if skip is not None:
+            i = skip.match(s, i).end()
+        value, j = _value(s, i)
+        if value is None:
+            break
+        if skip is not None:
+            j = skip.match(s, j).end()
+        if s.startswith('*', j):
+            substrings.append(pureldap.LDAPFilter_substrings_any(value))
+            i = j + 1
+        else:
+            substrings.append(pureldap.LDAPFilter_substrings_final(value))
+            i = j
+            break
+    return substrings, i
+
+def _matchingrule(s, i):
+    m = _numericoid.match(s, i) or _attr.match(s, i)
+    if m is None:
+        return None, i
+    return m.group(), m.end()
+
+def _extensible(s, i, attr):
+    """
+    Parse an extensible match, s[i:] following the attr (if any).
+    """
+    dn = s.startswith(':dn', i)
+    if dn:
+        i += 3
+    if attr is None:
+        if not s.startswith(':', i):
+            _fail('Expected ":"', i, s)
+        matchingRule, i = _matchingrule(s, i+1)
+        if matchingRule is None:
+            _fail('Expected matchingrule', i, s)
     else:
-        return t[0]
-matchingrule_or_none.setParseAction(_p_matchingrule_or_none)
-
-extensible_attr = attr + extensible_dn + matchingrule_or_none + Suppress(":=") + value
-extensible_attr.setName('extensible_attr')
-def _p_extensible_attr(s,l,t):
-    return list(t)
-extensible_attr.setParseAction(_p_extensible_attr)
-
-
-extensible_noattr = extensible_dn + Suppress(":") + matchingrule + Suppress(":=") + value
-extensible_noattr.setName('extensible_noattr')
-def _p_extensible_noattr(s,l,t):
-    return [None]+list(t)
-extensible_noattr.setParseAction(_p_extensible_noattr)
-
-extensible = extensible_attr | extensible_noattr
-extensible.setName('extensible')
-def _p_extensible(s,l,t):
-    attr, dn, matchingRule, value = t
+        matchingRule = None
+        if s.startswith(':', i):
+            matchingRule, j = _matchingrule(s, i+1)
+            if matchingRule is not None:
+                i = j
+    if not s.startswith(':=', i):
+        _fail('Expected ":="', i, s)
+    value, i = _value(s, i+2)
+    if value is None:
+        _fail('Expected value', i, s)
     return pureldap.LDAPFilter_extensibleMatch(
         matchingRule=matchingRule,
         type=attr,
         matchValue=value,
-        dnAttributes=dn)
-extensible.setParseAction(_p_extensible)
-item = simple ^ present ^ substring ^ extensible
-item.setName('item')
-item.leaveWhitespace()
-not_ = Suppress(Literal('!')) + filter_
-not_.setParseAction(lambda s,l,t: pureldap.LDAPFilter_not(t[0]))
-not_.setName('not')
-filterlist = OneOrMore(filter_)
-or_ = Suppress(Literal('|')) + filterlist
-or_.setParseAction(lambda s,l,t: pureldap.LDAPFilter_or(t))
-or_.setName('or')
-and_ = Suppress(Literal('&')) + filterlist
-and_.setParseAction(lambda s,l,t: pureldap.LDAPFilter_and(t))
-and_.setName('and')
-filtercomp = and_ | or_ | not_ | item
-filtercomp.setName('filtercomp')
-filter_ << (Suppress(Literal('(').leaveWhitespace())
-            + filtercomp
-            + Suppress(Literal(')').leaveWhitespace()))
-filter_.setName('filter')
-filtercomp.leaveWhitespace()
-filter_.leaveWhitespace()
-
-toplevel = (StringStart().leaveWhitespace()
-            + filter_
-            + StringEnd().leaveWhitespace())
-toplevel.leaveWhitespace()
-toplevel.setName('toplevel')
+        dnAttributes=dn), i
+
+def _item(s, i):
+    m = _attr.match(s, i)
+    if m is None:
+        if s.startswith(':', i):
+            return _extensible(s, i, None)
+        _fail('Expected filtercomp', i, s)
+    attr = m.group()
+    i = m.end()
+    c = s[i:i+1]
+    if c == '=':
+        value, j = _value(s, i+1)
+        if s.startswith('*', j):
+            substrings, j = _substrings(s, j, value)
+            if not substrings:
+                return pureldap.LDAPFilter_present(attr), j
+            return pureldap.LDAPFilter_substrings(
+                type=attr,
+                substrings=substrings), j
+        filtertype = pureldap.LDAPFilter_equalityMatch
+    elif c in _filtertypes and s.startswith('=', i+1):
+        filtertype = _filtertypes[c]
+        value, j = _value(s, i+2)
+    elif c == ':':
+        return _extensible(s, i, attr)
+    else:
+        _fail('Expected filtertype', i, s)
+    if value is None:
+        _fail('Expected value', j, s)
+    return filtertype(attributeDesc=pureldap.LDAPAttributeDescription(attr),
+                      assertionValue=pureldap.LDAPAssertionValue(value)), j
+
+def _filter(s, i):
+    if not s.startswith('(', i):
+        _fail('Expected "("', i, s)
+    i += 1
+    c = s[i:i+1]
+    if c == '&' or c == '|':
+        i += 1
+        filters = []
+        while s.startswith('(', i):
+            f, i = _filter(s, i)
+            filters.append(f)
+        if not filters:
+            _fail('Expected filter', i, s)
+        if c == '&':
+            result = pureldap.LDAPFilter_and(filters)
+        else:
+            result = pureldap.LDAPFilter_or(filters)
+    elif c == '!':
+        f, i = _filter(s, i+1)
+        result = pureldap.LDAPFilter_not(f)
+    else:
+        result, i = _item(s, i)
+    if not s.startswith(')', i):
+        _fail('Expected ")"', i, s)
+    return result, i+1
 
 def parseFilter(s):
     try:
-        x=toplevel.parseString(s)
-    except ParseException, e:
-        raise InvalidLDAPFilter, (e.msg,
-                                  e.loc,
-                                  e.line)
-    assert len(x)==1
-    return x[0]
-
-
-maybeSubString_value = Combine(OneOrMore(CharsNotIn('*\\\0') | escaped))
-
-maybeSubString_simple = maybeSubString_value.copy()
-def _p_maybeSubString_simple(s,l,t):
-    return (lambda attr:
-            pureldap.LDAPFilter_equalityMatch(
-        attributeDesc=pureldap.LDAPAttributeDescription(attr),
-        assertionValue=pureldap.LDAPAssertionValue(t[0])))
-maybeSubString_simple.setParseAction(_p_maybeSubString_simple)
-
-maybeSubString_present = Literal("*")
-def _p_maybeSubString_present(s,l,t):
-    return (lambda attr:
-            pureldap.LDAPFilter_present(attr))
-maybeSubString_present.setParseAction(_p_maybeSubString_present)
-
-maybeSubString_substring = Optional(initial) + any + Optional(final)
-def _p_maybeSubString_substring(s,l,t):
-    return (lambda attr:
-            pureldap.LDAPFilter_substrings(
-        type=attr,
-        substrings=t))
-maybeSubString_substring.setParseAction(_p_maybeSubString_substring)
-
-maybeSubString = (maybeSubString_simple
-                  ^ maybeSubString_present
-                  ^ maybeSubString_substring
-                  )
+        result, i = _filter(s, 0)
+    except RuntimeError:
+        # maximum recursion depth exceeded
+        raise InvalidLDAPFilter('Filter nested too deeply', 0, s)
+    if i != len(s):
+        raise InvalidLDAPFilter('Expected end of text', i, s)
+    return result
 
 def parseMaybeSubstring(attrType, s):
-    try:
-        x=maybeSubString.parseString(s)
-    except ParseException, e:
-        raise InvalidLDAPFilter, (e.msg,
-                                  e.loc,
-                                  e.line)
-    assert len(x)==1
-    fn = x[0]
-    return fn(attrType)
+    """
+    Parse the value part of an "attr=value" filter, where value may
+    be a substring pattern, e.g. "foo*bar". Leading whitespace and
+    any text after the longest valid value are ignored.
+
+    A plain value may contain unescaped parentheses. A substring
+    pattern may not, and whitespace around its "*"s is skipped.
+    """
+    i = _whitespace.match(s).end()
+    simple, simpleEnd = _value(s, i, _maybeSubStringChars)
+    initial, j = _value(s, i)
+    j = _whitespace.match(s, j).end()
+    if s.startswith('*', j):
+        substrings, j = _substrings(s, j, initial, _whitespace)
+        if simple is None or j > simpleEnd:
+            if initial is None and j == i+1:
+                return pureldap.LDAPFilter_present(attrType)
+            return pureldap.LDAPFilter_substrings(
+                type=attrType,
+                substrings=substrings)
+    if simple is None:
+        raise InvalidLDAPFilter('Expected value', i, s)
+    return pureldap.LDAPFilter_equalityMatch(
+        attributeDesc=pureldap.LDAPAttributeDescription(attrType),
+        assertionValue=pureldap.LDAPAssertionValue(simple))
+
+def _canonicalValue(filter):
+    return filter.attributeDesc.value.lower(), filter.assertionValue.value
+
+def _canonicalSet(filter):
+    return tuple(sorted(set([canonicalKey(f) for f in filter])))
+
+def _canonicalSubstrings(filter):
+    return filter.type.lower(), tuple([(s.tag, s.value)
+                                       for s in filter.substrings])
+
+def _canonicalExtensible(filter):
+    matchingRule = type = None
+    if filter.matchingRule is not None:
+        matchingRule = filter.matchingRule.value
+    if filter.type is not None:
+        type = filter.type.value.lower()
+    return (matchingRule, type, filter.matchValue.value,
+            bool(filter.dnAttributes and filter.dnAttributes.value))
+
+_canonicalizers = {
+    pureldap.LDAPFilter_and.tag: _canonicalSet,
+    pureldap.LDAPFilter_or.tag: _canonicalSet,
+    pureldap.LDAPFilter_not.tag: lambda f: canonicalKey(f.value),
+    pureldap.LDAPFilter_equalityMatch.tag: _canonicalValue,
+    pureldap.LDAPFilter_substrings.tag: _canonicalSubstrings,
+    pureldap.LDAPFilter_greaterOrEqual.tag: _canonicalValue,
+    pureldap.LDAPFilter_lessOrEqual.tag: _canonicalValue,
+    pureldap.LDAPFilter_present.tag: lambda f: f.value.lower(),
+    pureldap.LDAPFilter_approxMatch.tag: _canonicalValue,
+    pureldap.LDAPFilter_extensibleMatch.tag: _canonicalExtensible,
+    }
+
+def canonicalKey(filter):
+    """
+    Return a hashable key for an LDAPFilter, equal for filters that
+    match the same entries because they only differ in the order or
+    repetition of AND and OR members, or in the case of attribute
+    names. Assertion values are kept as they are.
+    """
+    canonicalize = _canonicalizers.get(filter.tag)
+    if canonicalize is None:
+        return filter.tag, str(filter)
+    return filter.tag, canonicalize(filter)
+
+class FilterCache(object):
+    """
+    Bounded LRU cache of parsed and compiled LDAP filters.
+
+    Filters are looked up either by their text, as given to
+    parseFilter, or as LDAPFilter objects, by their canonicalKey().
+    The cached filter objects and predicates are shared between all
+    lookups, and must not be modified.
+
+    hits and misses count the lookups since the cache was created or
+    last cleared; evictions counts the filters dropped to stay within
+    maxSize.
+    """
+
+    def __init__(self, maxSize=1000):
+        assert maxSize > 0
+        self.maxSize = maxSize
+        self._cache = OrderedDict()
+        self.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        """Forget all cached filters and reset the statistics."""
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def hitRate(self):
+        """Return the fraction of lookups that were hits, 0.0 if none."""
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def _lookup(self, filter):
+        if isinstance(filter, basestring):
+            key = filter
+        else:
+            key = canonicalKey(filter)
+        cache = self._cache
+        entry = cache.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            if isinstance(filter, basestring):
+                filter = parseFilter(filter)
+            entry = [filter, None]
+            if len(cache) >= self.maxSize:
+                cache.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+        cache[key] = entry
+        return entry
+
+    def parse(self, filter):
+        """
+        Return the LDAPFilter for filter, which is either filter text
+        or an LDAPFilter equivalent to the one returned.
+
+        Raises InvalidLDAPFilter for invalid filter text; it is not
+        cached.
+        """
+        return self._lookup(filter)[0]
+
+    def compile(self, filter):
+        """
+        Return the predicate from entryhelpers.compileFilter for
+        filter, which is either filter text or an LDAPFilter.
+        """
+        entry = self._lookup(filter)
+        if entry[1] is None:
+            from ldaptor.entryhelpers import compileFilter
+            entry[1] = compileFilter(entry[0])
+        return entry[1]
+
+_marker = re.compile('\x01([0-9]+)\x01')
+
+class _Markers(object):
+    """
+    Mapping that gives each key a marker made of characters that may
+    appear unescaped in a filter value, and remembers the keys.
+    """
+    def __init__(self):
+        self.keys = []
+
+    def __getitem__(self, key):
+        if key not in self.keys:
+            self.keys.append(key)
+        return '\x01%d\x01' % self.keys.index(key)
+
+class PreparedFilter(object):
+    """
+    A filter template, parsed once and then bound to values.
+
+    The template is filter text with %(key)s placeholders, as used
+    with the % operator, e.g. '(|(uid=%(name)s)(mail=%(name)s))'.
+    Placeholders may only appear in assertion values. bind() puts the
+    values in the filter as they are, so they need no escaping and
+    can not change the structure of the filter: binding name='*'
+    above matches a uid or mail of "*", not every entry.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        if '\x01' in template:
+            raise InvalidLDAPFilter('Invalid character', template.index('\x01'),
+                                    template)
+        markers = _Markers()
+        try:
+            text = template % markers
+        except (KeyError, ValueError, TypeError), e:
+            raise InvalidLDAPFilter('Invalid placeholder: %s' % e, 0, template)
+        try:
+            filter = parseFilter(text)
+        except InvalidLDAPFilter, e:
+            raise InvalidLDAPFilter(e.msg, e.loc, template)
+        self._filter = filter
+        self._keys = markers.keys
+        self._bind = self._prepare(filter)
+
+    def _format(self, value):
+        """
+        Turn a value with markers back into a format string, or return
+        None if it has no markers.
+        """
+        if _marker.search(value) is None:
+            return None
+        return _marker.sub(lambda m: '%%(%s)s' % self._keys[int(m.group(1))],
+                           value.replace('%', '%%'))
+
+    def _prepare(self, filter):
+        """
+        Return a function that, given the values, builds a copy of
+        filter with them; or None if filter has no placeholders.
+        """
+        if isinstance(filter, (pureldap.LDAPFilter_and,
+                               pureldap.LDAPFilter_or)):
+            members = [(f, self._prepare(f)) for f in filter]
+            if not [bind for f, bind in members if bind is not None]:
+                return None
+            klass = filter.__class__
+            def bindMembers(values):
+                l = []
+                for f, bind in members:
+                    if bind is not None:
+                        f = bind(values)
+                    l.append(f)
+                return klass(l)
+            return bindMembers
+
+        elif isinstance(filter, pureldap.LDAPFilter_not):
+            bindValue = self._prepare(filter.value)
+            if bindValue is None:
+                return None
+            return lambda values: pureldap.LDAPFilter_not(bindValue(values))
+
+        elif isinstance(filter, pureldap.LDAPAttributeValueAssertion):
+            format = self._format(filter.assertionValue.value)
+            if format is None:
+                return None
+            klass = filter.__class__
+            attributeDesc = filter.attributeDesc
+            return lambda values: klass(
+                attributeDesc=attributeDesc,
+                assertionValue=pureldap.LDAPAssertionValue(format % values))
+
+        elif isinstance(filter, pureldap.LDAPFilter_substrings):
+            substrings = [(s.__class__, s.value, self._format(s.value))
+                          for s in filter.substrings]
+            if not [format for _, _, format in substrings
+                    if format is not None]:
+                return None
+            type = filter.type
+            def bind(values):
+                l = []
+                for klass, value, format in substrings:
+                    if format is not None:
+                        value = format % values
+                    l.append(klass(value))
+                return pureldap.LDAPFilter_substrings(type=type, substrings=l)
+            return bind
+
+        elif isinstance(filter, pureldap.LDAPFilter_extensibleMatch):
+            format = self._format(filter.matchValue.value)
+            if format is None:
+                return None
+            return lambda values: pureldap.LDAPFilter_extensibleMatch(
+                matchingRule=filter.matchingRule,
+                type=filter.type,
+                matchValue=format % values,
+                dnAttributes=filter.dnAttributes)
+
+        return None
+
+    def bind(self, values):
+        """
+        Return the LDAPFilter of the template with the values of the
+        mapping values in place of the placeholders.
+
+        Parts of the filter without placeholders are shared between
+        all the filters returned, and must not be modified.
+        """
+        if self._bind is None:
+            return self._filter
+        return self._bind(values)
+
+_prepared = {}
+
+def prepareFilter(template):
+    """
+    Return a PreparedFilter for template, reusing one made earlier
+    for the same template if possible.
+    """
+    prepared = _prepared.get(template)
+    if prepared is None:
+        if len(_prepared) >= 100:
+            _prepared.clear()
+        prepared = _prepared[template] = PreparedFilter(template)
+    return prepared
 
 if __name__=='__main__':
     import sys
@@ -186,9 +186,7 @@ class LDIFTreeEntry(entry.EditableLDAPEntry,
                     continue
                 seen.add(base)
 
-                dn = distinguishedname.DistinguishedName(
-                    listOfRDNs=((distinguishedname.RelativeDistinguishedName(base),)
-                                + self.dn.split()))
+                dn = self.dn.child(base)
                 e = self.__class__(os.path.join(self.path, base + '.dir'), dn)
                 children.append(e)
         return children
@@ -222,7 +220,7 @@ class LDIFTreeEntry(entry.EditableLDAPEntry,
         if not os.path.isdir(path) and not os.path.isfile(entry):
             return defer.fail(ldaperrors.LDAPNoSuchObject(dn))
         else:
-            childDN = distinguishedname.DistinguishedName(listOfRDNs=(rdn,)+me)
+            childDN = self.dn.child(rdn)
             c = self.__class__(path, childDN)
             return c.lookup(dn)
 
@@ -232,8 +230,7 @@ class LDIFTreeEntry(entry.EditableLDAPEntry,
             if c.dn.split()[0] == rdn:
                 raise ldaperrors.LDAPEntryAlreadyExists, c.dn
 
-        dn = distinguishedname.DistinguishedName(
-            listOfRDNs=(rdn,) + self.dn.split())
+        dn = self.dn.child(rdn)
         e = entry.BaseLDAPEntry(dn, attributes)
         if not os.path.exists(self.path):
             os.mkdir(self.path)
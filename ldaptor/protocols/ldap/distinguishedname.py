@@ -1,5 +1,7 @@
 # See rfc2253
 
+import re
+
 # Note that RFC 2253 sections 2.4 and 3 disagree whether "=" needs to
 # be quoted. Let's trust the syntax, slapd refuses to accept unescaped
 # "=" in RDN values.
@@ -7,6 +9,14 @@ escapedChars = r',+"\<>;='
 escapedChars_leading = r' #'
 escapedChars_trailing = r' #'
 
+_needsEscape = re.compile(r'[,+"\\<>;=\x00-\x1f]')
+
+def _escapeMatch(m):
+    c = m.group()
+    if c in escapedChars:
+        return '\\'+c
+    return '\\%02X' % ord(c)
+
 def escape(s):
     r=''
     r_trailer=''
@@ -19,49 +29,43 @@ def escape(s):
         r_trailer='\\'+s[-1]
         s=s[:-1]
 
-    for c in s:
-        if c in escapedChars:
-            r=r+'\\'+c
-        elif ord(c)<=31:
-            r=r+'\\%02X' % ord(c)
-        else:
-            r=r+c
+    if _needsEscape.search(s) is not None:
+        s=_needsEscape.sub(_escapeMatch, s)
+
+    return r+s+r_trailer
 
-    return r+r_trailer
+_escaped = re.compile(r'\\(?:([0-9a-f].?)|(.))', re.DOTALL)
+
+def _unescapeMatch(m):
+    hexpair = m.group(1)
+    if hexpair is not None:
+        return chr(int(hexpair, 16))
+    return m.group(2)
 
 def unescape(s):
-    r=''
-    while s:
-        if s[0]=='\\':
-            if s[1] in '0123456789abcdef':
-                r=r+chr(int(s[1:3], 16))
-                s=s[3:]
-            else:
-                r=r+s[1]
-                s=s[2:]
-        else:
-            r=r+s[0]
-            s=s[1:]
-    return r
+    if '\\' not in s:
+        return s
+    return _escaped.sub(_unescapeMatch, s)
+
+_separators = {
+    ',': re.compile(r'\\.?|, *', re.DOTALL),
+    '+': re.compile(r'\\.?|\+ *', re.DOTALL),
+    }
 
 def _splitOnNotEscaped(s, separator):
     if not s:
         return []
 
-    r=['']
-    while s:
-        if s[0]=='\\':
-            r[-1]=r[-1]+s[:2]
-            s=s[2:]
-        else:
-            if s[0] in separator:
-                r.append('')
-                s=s[1:]
-                while s[0]==' ':
-                    s=s[1:]
-            else:
-                r[-1]=r[-1]+s[0]
-                s=s[1:]
+    r=[]
+    start=0
+    for m in _separators[separator].finditer(s):
+        if m.group()[0] != '\\':
+            r.append(s[start:m.start()])
+            start=m.end()
+    if start==len(s):
+        # nothing after the last separator
+        raise InvalidRelativeDistinguishedName(s)
+    r.append(s[start:])
     return r
 
 class InvalidRelativeDistinguishedName(Exception):
@@ -75,10 +79,9 @@ class InvalidRelativeDistinguishedName(Exception):
         return "Invalid relative distinguished name %s." \
                % repr(self.rdn)
 
-class LDAPAttributeTypeAndValue:
+class LDAPAttributeTypeAndValue(object):
     # TODO I should be used everywhere
-    attributeType = None
-    value = None
+    __slots__ = ('attributeType', 'value')
 
     def __init__(self, stringValue=None, attributeType=None, value=None):
         if stringValue is None:
@@ -134,12 +137,13 @@ class LDAPAttributeTypeAndValue:
     def __ge__(self, other):
         return not self < other
 
-class RelativeDistinguishedName:
+class RelativeDistinguishedName(object):
     """LDAP Relative Distinguished Name."""
 
-    attributeTypesAndValues = None
+    __slots__ = ('attributeTypesAndValues', '_key', '_hash', '_str')
 
     def __init__(self, magic=None, stringValue=None, attributeTypesAndValues=None):
+        self._key = self._hash = self._str = None
         if magic is not None:
             assert stringValue is None
             assert attributeTypesAndValues is None
@@ -163,8 +167,24 @@ class RelativeDistinguishedName:
     def split(self):
         return self.attributeTypesAndValues
 
+    def key(self):
+        """
+        Return the canonical form of self: its lowercased attribute
+        types and values, in sorted order.
+        """
+        key = self._key
+        if key is None:
+            key = self._key = tuple(sorted(
+                [(x.attributeType.lower(), x.value.lower())
+                 for x in self.attributeTypesAndValues]))
+        return key
+
     def __str__(self):
-        return '+'.join([str(x) for x in self.attributeTypesAndValues])
+        s = self._str
+        if s is None:
+            s = self._str = '+'.join([str(x)
+                                      for x in self.attributeTypesAndValues])
+        return s
 
     def __repr__(self):
         return (self.__class__.__name__
@@ -173,12 +193,18 @@ class RelativeDistinguishedName:
                 + ')')
 
     def __hash__(self):
-        return hash(self.attributeTypesAndValues)
+        h = self._hash
+        if h is None:
+            h = self._hash = hash(self.attributeTypesAndValues)
+        return h
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, RelativeDistinguishedName):
             return NotImplemented
-        return self.split() == other.split()
+        return (hash(self) == hash(other)
+                and self.split() == other.split())
 
     def __ne__(self, other):
         return not (self == other)
@@ -202,10 +228,58 @@ class RelativeDistinguishedName:
         return len(self.attributeTypesAndValues)
 
 
-class DistinguishedName:
-    """LDAP Distinguished Name."""
-    listOfRDNs = None
+# Interned DistinguishedNames parsed from strings, by string. Cleared
+# when it reaches _MAXCACHE entries, like the cache of the re module.
+_cache = {}
+_MAXCACHE = 10000
+
+def _new(cls):
+    self = object.__new__(cls)
+    self._rdns = self._rdn = self._parent = None
+    self._key = self._hash = self._str = None
+    return self
+
+class DistinguishedName(object):
+    """
+    LDAP Distinguished Name.
+
+    DistinguishedNames made from the same str share a single
+    instance, parsed only once, so they must not be modified:
+    assigning to listOfRDNs raises AttributeError for them. Other
+    DistinguishedNames may still get a new listOfRDNs, as long as no
+    entry or child DistinguishedName shares them.
+
+    A DistinguishedName made with child() is linked: it holds only
+    its first RDN and refers to the DistinguishedName of its parent
+    for the rest, which saves memory in deep trees. Its listOfRDNs
+    is built anew when asked for.
+
+    The string form and key() of DistinguishedNames and their RDNs
+    are computed once and kept, except that a linked
+    DistinguishedName only keeps them once they have been used for
+    a child of it: it builds them from the ones its parent keeps
+    otherwise, so the leaves of a tree do not each hold a copy.
+    """
+    __slots__ = ('_rdns', '_rdn', '_parent', '_key', '_hash', '_str')
+
+    def __new__(cls, magic=None, stringValue=None, listOfRDNs=None):
+        if stringValue is None and isinstance(magic, str):
+            stringValue = magic
+        if type(stringValue) is not str or cls is not DistinguishedName:
+            return _new(cls)
+        self = _cache.get(stringValue)
+        if self is None:
+            self = _new(cls)
+            self._parse(stringValue)
+            if len(_cache) >= _MAXCACHE:
+                _cache.clear()
+            _cache[stringValue] = self
+        return self
+
     def __init__(self, magic=None, stringValue=None, listOfRDNs=None):
+        if self._rdns is not None:
+            # interned, see __new__
+            return
         assert (magic is not None
                 or stringValue is not None
                 or listOfRDNs is not None)
@@ -223,20 +297,92 @@ class DistinguishedName:
             assert listOfRDNs is not None
             for x in listOfRDNs:
                 assert isinstance(x, RelativeDistinguishedName)
-            self.listOfRDNs = tuple(listOfRDNs)
+            self._rdns = tuple(listOfRDNs)
         else:
             assert listOfRDNs is None
-            self.listOfRDNs = tuple([RelativeDistinguishedName(stringValue=x)
-                                     for x in _splitOnNotEscaped(stringValue, ',')])
+            self._parse(stringValue)
+
+    def _parse(self, stringValue):
+        self._rdns = tuple([RelativeDistinguishedName(stringValue=x)
+                            for x in _splitOnNotEscaped(stringValue, ',')])
 
     def split(self):
-        return self.listOfRDNs
+        rdns = self._rdns
+        if rdns is None:
+            rdns = (self._rdn,) + self._parent.split()
+        return rdns
+
+    def _setListOfRDNs(self, listOfRDNs):
+        if _cache.get(str(self)) is self:
+            raise AttributeError, \
+                  ('DistinguishedName %r is interned and shared by every'
+                   ' DistinguishedName made from that string, it can not'
+                   ' be modified; make a new DistinguishedName instead'
+                   % str(self))
+        for x in listOfRDNs:
+            assert isinstance(x, RelativeDistinguishedName)
+        self._rdns = tuple(listOfRDNs)
+        self._rdn = self._parent = None
+        self._key = self._hash = self._str = None
+
+    listOfRDNs = property(split, _setListOfRDNs)
+
+    def key(self):
+        """
+        Return the canonical form of self: the keys of its RDNs,
+        starting from the root. DNs that differ only in the case of
+        their attribute types and values, or the order of the parts
+        of multi-valued RDNs, have the same key; a DN contains the
+        DNs whose keys start with its key.
+        """
+        key = self._key
+        if key is None:
+            if self._rdns is None:
+                return self._parent._keptKey() + (self._rdn.key(),)
+            l = [rdn.key() for rdn in self._rdns]
+            l.reverse()
+            key = self._key = tuple(l)
+        return key
+
+    def _keptKey(self):
+        key = self._key
+        if key is None:
+            key = self._key = self.key()
+        return key
 
     def up(self):
-        return DistinguishedName(listOfRDNs=self.listOfRDNs[1:])
+        if self._rdns is None:
+            return self._parent
+        return DistinguishedName(listOfRDNs=self._rdns[1:])
+
+    def child(self, rdn):
+        """
+        Return the linked DistinguishedName of rdn under self, without
+        copying the RDNs of self.
+        """
+        if not isinstance(rdn, RelativeDistinguishedName):
+            rdn = RelativeDistinguishedName(rdn)
+        dn = _new(DistinguishedName)
+        dn._rdn = rdn
+        dn._parent = self
+        return dn
 
     def __str__(self):
-        return ','.join([str(x) for x in self.listOfRDNs])
+        s = self._str
+        if s is None:
+            if self._rdns is None:
+                parent = self._parent._keptStr()
+                if parent:
+                    return str(self._rdn) + ',' + parent
+                return str(self._rdn)
+            s = self._str = ','.join([str(x) for x in self._rdns])
+        return s
+
+    def _keptStr(self):
+        s = self._str
+        if s is None:
+            s = self._str = str(self)
+        return s
 
     def __repr__(self):
         return (self.__class__.__name__
@@ -245,14 +391,20 @@ class DistinguishedName:
                 + ')')
 
     def __hash__(self):
-        return hash(str(self))
+        h = self._hash
+        if h is None:
+            h = self._hash = hash(str(self))
+        return h
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, basestring):
             return str(self) == other
         if not isinstance(other, DistinguishedName):
             return NotImplemented
-        return self.split() == other.split()
+        return (hash(self) == hash(other)
+                and self.split() == other.split())
 
     def __ne__(self, other):
         return not (self == other)
@@ -281,19 +433,44 @@ class DistinguishedName:
             return None
 
     def contains(self, other):
-        """Does the tree rooted at DN contain or equal the other DN."""
-        if self == other:
-            return 1
+        """
+        Does the tree rooted at DN contain or equal the other DN.
+
+        Like ==, this tells case differences apart; see
+        containsIgnoringCase().
+        """
+        if not isinstance(other, DistinguishedName):
+            other=DistinguishedName(other)
+        mine=self.split()
+        its=other.split()
+        return (len(its) >= len(mine)
+                and its[len(its)-len(mine):] == mine)
+
+    def containsIgnoringCase(self, other):
+        """
+        Like contains(), but ignoring the differences key() ignores,
+        as LDAP servers do.
+        """
         if not isinstance(other, DistinguishedName):
             other=DistinguishedName(other)
-        its=list(other.split())
-        mine=list(self.split())
-
-        while mine and its:
-            m=mine.pop()
-            i=its.pop()
-            if m!=i:
-                return 0
-        if mine:
-            return 0
-        return 1
+        mine=self.key()
+        return other.key()[:len(mine)] == mine
+
+def parseLinked(stringValue):
+    """
+    Parse stringValue into a DistinguishedName made with child() from
+    the interned DistinguishedName of its parent.
+
+    Only the first RDN is parsed anew when DNs with the same parent
+    are parsed one after another, as when loading LDIF, and the DNs
+    share their parent.
+    """
+    for m in _separators[','].finditer(stringValue):
+        if m.group()[0] != '\\':
+            if m.end() == len(stringValue):
+                # nothing after the last separator
+                raise InvalidRelativeDistinguishedName(stringValue)
+            parent = DistinguishedName(stringValue[m.end():])
+            return parent.child(
+                RelativeDistinguishedName(stringValue[:m.start()]))
+    return DistinguishedName(stringValue)
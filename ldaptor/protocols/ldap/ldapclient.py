@@ -45,27 +45,47 @@ class LDAPClient(protocol.Protocol):
     """An LDAP client"""
     debug = False
 
+    # Limits on the responses a server may send, see
+    # pureber.BERFramer; None means no limit. A factory that has
+    # attributes of the same names overrides these for the protocols
+    # it builds. A server exceeding them is disconnected. Unlike those
+    # of BaseLDAPServer these are opt-in: search results can be of
+    # any size, and the server is one the client chose to talk to.
+    maxPDUSize = None
+    maxNestingDepth = None
+    maxElements = None
+
     def __init__(self):
         self.onwire = {}
-        self.buffer = ''
+        self.buffer = pureber.BERFramer(maxLength=self.maxPDUSize,
+                                        maxDepth=self.maxNestingDepth,
+                                        maxElements=self.maxElements)
         self.connected = None
 
+    def makeConnection(self, transport):
+        factory = getattr(self, 'factory', None)
+        self.buffer = pureber.BERFramer(
+            maxLength=getattr(factory, 'maxPDUSize', self.maxPDUSize),
+            maxDepth=getattr(factory, 'maxNestingDepth', self.maxNestingDepth),
+            maxElements=getattr(factory, 'maxElements', self.maxElements))
+        protocol.Protocol.makeConnection(self, transport)
+
     berdecoder = pureldap.LDAPBERDecoderContext_TopLevel(
         inherit=pureldap.LDAPBERDecoderContext_LDAPMessage(
         fallback=pureldap.LDAPBERDecoderContext(fallback=pureber.BERDecoderContext()),
         inherit=pureldap.LDAPBERDecoderContext(fallback=pureber.BERDecoderContext())))
 
     def dataReceived(self, recd):
-        self.buffer += recd
-        while 1:
-            try:
-                o, bytes = pureber.berDecodeObject(self.berdecoder, self.buffer)
-            except pureber.BERExceptionInsufficientData:
-                o, bytes = None, 0
-            self.buffer = self.buffer[bytes:]
-            if not o:
-                break
-            self.handle(o)
+        try:
+            frames = self.buffer.feed(recd)
+        except pureber.BERExceptionLimitExceeded, e:
+            log.msg('Dropping connection: %s' % e)
+            self.transport.loseConnection()
+            return
+        for frame in frames:
+            o, bytes = pureber.berDecodeObject(self.berdecoder, frame)
+            if o is not None:
+                self.handle(o)
 
     def connectionMade(self):
         """TCP connection has opened"""
@@ -109,7 +129,7 @@ class LDAPClient(protocol.Protocol):
         assert op.needs_answer
         d = defer.Deferred()
         self.onwire[msg.id]=(d, None, None, None)
-        self.transport.write(str(msg))
+        self.transport.writeSequence(pureber.berEncodeChunks(msg))
         return d
 
     def send_multiResponse(self, op, handler, *args, **kwargs):
@@ -138,7 +158,7 @@ class LDAPClient(protocol.Protocol):
         assert op.needs_answer
         d = defer.Deferred()
         self.onwire[msg.id]=(d, handler, args, kwargs)
-        self.transport.write(str(msg))
+        self.transport.writeSequence(pureber.berEncodeChunks(msg))
         return d
 
     def send_noResponse(self, op):
@@ -151,7 +171,7 @@ class LDAPClient(protocol.Protocol):
         """
         msg = self._send(op)
         assert not op.needs_answer
-        self.transport.write(str(msg))
+        self.transport.writeSequence(pureber.berEncodeChunks(msg))
 
     def unsolicitedNotification(self, msg):
         log.msg("Got unsolicited notification: %s" % repr(msg))
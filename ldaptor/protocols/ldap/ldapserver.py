@@ -30,10 +30,31 @@ class LDAPServerConnectionLostException(ldaperrors.LDAPException):
 class BaseLDAPServer(protocol.Protocol):
     debug = False
 
+    # Limits on the requests a client may send, see
+    # pureber.BERFramer; None means no limit. A factory that has
+    # attributes of the same names overrides these for the protocols
+    # it builds. A client exceeding them is disconnected. The defaults
+    # leave room for large modify requests, e.g. of big groups or
+    # photos, while keeping a client from making the server buffer or
+    # decode without bound.
+    maxPDUSize = 4*1024*1024
+    maxNestingDepth = 100
+    maxElements = 200000
+
     def __init__(self):
-        self.buffer = ''
+        self.buffer = pureber.BERFramer(maxLength=self.maxPDUSize,
+                                        maxDepth=self.maxNestingDepth,
+                                        maxElements=self.maxElements)
         self.connected = None
 
+    def makeConnection(self, transport):
+        factory = getattr(self, 'factory', None)
+        self.buffer = pureber.BERFramer(
+            maxLength=getattr(factory, 'maxPDUSize', self.maxPDUSize),
+            maxDepth=getattr(factory, 'maxNestingDepth', self.maxNestingDepth),
+            maxElements=getattr(factory, 'maxElements', self.maxElements))
+        protocol.Protocol.makeConnection(self, transport)
+
     berdecoder = pureldap.LDAPBERDecoderContext_TopLevel(
         inherit=pureldap.LDAPBERDecoderContext_LDAPMessage(
             fallback=pureldap.LDAPBERDecoderContext(
@@ -42,17 +63,16 @@ class BaseLDAPServer(protocol.Protocol):
                 fallback=pureber.BERDecoderContext())))
 
     def dataReceived(self, recd):
-        self.buffer += recd
-        while 1:
-            try:
-                o, bytes = pureber.berDecodeObject(
-                    self.berdecoder, self.buffer)
-            except pureber.BERExceptionInsufficientData:
-                o, bytes = None, 0
-            self.buffer = self.buffer[bytes:]
-            if o is None:
-                break
-            self.handle(o)
+        try:
+            frames = self.buffer.feed(recd)
+        except pureber.BERExceptionLimitExceeded, e:
+            log.msg('Dropping connection: %s' % e)
+            self.transport.loseConnection()
+            return
+        for frame in frames:
+            o, bytes = pureber.berDecodeObject(self.berdecoder, frame)
+            if o is not None:
+                self.handle(o)
 
     def connectionMade(self):
         """TCP connection has opened"""
@@ -68,7 +88,7 @@ class BaseLDAPServer(protocol.Protocol):
         msg = pureldap.LDAPMessage(op, id=id)
         if self.debug:
             log.msg('S->C %s' % repr(msg), debug=True)
-        self.transport.write(str(msg))
+        self.transport.writeSequence(pureber.berEncodeChunks(msg))
 
     def unsolicitedNotification(self, msg):
         log.msg("Got unsolicited notification: %s" % repr(msg))
@@ -364,8 +384,7 @@ class LDAPServer(BaseLDAPServer):
             newSuperior = dn.up()
         else:
             newSuperior = distinguishedname.DistinguishedName(newSuperior)
-        newdn = distinguishedname.DistinguishedName(
-            listOfRDNs=(newrdn,)+newSuperior.split())
+        newdn = newSuperior.child(newrdn)
         root = interfaces.IConnectedLDAPEntry(self.factory)
         d = root.lookup(dn)
 
@@ -390,8 +390,7 @@ class LDAPEntryWithClient(entry.EditableLDAPEntry):
         attributes = a+sorted(attributes.items())
         del a
         rdn = distinguishedname.RelativeDistinguishedName(rdn)
-        dn = distinguishedname.DistinguishedName(
-            listOfRDNs=(rdn,)+self.dn.split())
+        dn = self.dn.child(rdn)
 
         ldapAttrs = []
         for attrType, values in attributes:
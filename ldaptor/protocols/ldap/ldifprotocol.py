@@ -127,8 +127,8 @@ class LDIF(object, basic.LineReceiver):
         if line == '':
             # end of entry
             self.mode = WAIT_FOR_DN
-            o = entry.BaseLDAPEntry(dn=self.dn,
-                                    attributes=self.data)
+            o = self.makeEntry(dn=self.dn,
+                               attributes=self.data)
             self.dn = None
             self.data = None
             self.gotEntry(o)
@@ -141,6 +141,13 @@ class LDIF(object, basic.LineReceiver):
 
         self.data[key].append(val)
 
+    def makeEntry(self, dn, attributes):
+        """
+        Return the entry to pass to gotEntry for dn, a string, and
+        attributes, a dict of lists of values by attribute type.
+        """
+        return entry.BaseLDAPEntry(dn=dn, attributes=attributes)
+
     def gotEntry(self, obj):
         pass
 
@@ -2,7 +2,7 @@
 
 from twisted.internet import reactor, defer
 from ldaptor.protocols.ldap import ldapserver, ldapconnector, ldapclient
-from ldaptor.protocols import pureldap
+from ldaptor.protocols import pureldap, pureber
 
 class Proxy(ldapserver.BaseLDAPServer):
     protocol = ldapclient.LDAPClient
@@ -11,6 +11,13 @@ class Proxy(ldapserver.BaseLDAPServer):
     waitingConnect = []
     unbound = False
 
+    berdecoder = pureldap.LDAPBERDecoderContext_LazyTopLevel(
+        inherit=pureldap.LDAPBERDecoderContext_LDAPMessage(
+            fallback=pureldap.LDAPBERDecoderContext(
+                fallback=pureber.BERDecoderContext()),
+            inherit=pureldap.LDAPBERDecoderContext(
+                fallback=pureber.BERDecoderContext())))
+
     def __init__(self, config):
         """
         Initialize the object.
@@ -30,6 +37,7 @@ class Proxy(ldapserver.BaseLDAPServer):
             return defer.maybeDeferred(fn, *a, **kw)
 
     def _cbConnectionMade(self, proto):
+        proto.berdecoder = self.berdecoder
         self.client = proto
         while self.waitingConnect:
             d, fn, a, kw = self.waitingConnect.pop(0)
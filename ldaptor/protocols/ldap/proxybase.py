@@ -3,7 +3,7 @@ LDAP protocol proxy server.
 """
 from __future__ import absolute_import, division, print_function
 from ldaptor.protocols.ldap import ldapserver, ldapconnector, ldaperrors
-from ldaptor.protocols import pureldap
+from ldaptor.protocols import pureldap, pureber
 from twisted.internet import defer
 from twisted.python import log
 
@@ -15,12 +15,22 @@ class ProxyBase(ldapserver.BaseLDAPServer):
     the client.
     Override `handleProxiedResponse()` to inspect/modify responses from
     the proxied server.
+
+    Requests and responses are decoded lazily: a protocol op that is
+    only forwarded is passed on as the bytes it was received as.
     """
     client = None
     unbound = False
     use_tls = False
     clientConnector = None
 
+    berdecoder = pureldap.LDAPBERDecoderContext_LazyTopLevel(
+        inherit=pureldap.LDAPBERDecoderContext_LDAPMessage(
+            fallback=pureldap.LDAPBERDecoderContext(
+                fallback=pureber.BERDecoderContext()),
+            inherit=pureldap.LDAPBERDecoderContext(
+                fallback=pureber.BERDecoderContext())))
+
     def __init__(self):
         ldapserver.BaseLDAPServer.__init__(self)
         # Requests that are ready before the client connection is established
@@ -56,6 +66,7 @@ class ProxyBase(ldapserver.BaseLDAPServer):
         """
         The connection to the proxied server is set up.
         """
+        proto.berdecoder = self.berdecoder
         if self.use_tls:
             d = proto.startTLS()
             d.addCallback(self._establishedTLS)
@@ -31,7 +31,8 @@
 #     this protocol definition.
 
 
-import string
+import inspect
+import struct
 
 # xxxxxxxx
 # |/|\.../
@@ -69,33 +70,140 @@ class UnknownBERTag(Exception):
         return "BERDecoderContext has no tag 0x%02x: %s" \
                % (self.tag, self.context)
 
-import UserList
+def _encodeWithStr(obj, chunks):
+    encoded = str(obj)
+    chunks.append(encoded)
+    return len(encoded)
+
+def _encodeCached(encodeInto):
+    def encode(obj, chunks):
+        d = obj.__dict__
+        encoded = d.get('_encoding')
+        if encoded is None:
+            if not d.get('_encodingCached'):
+                return encodeInto(obj, chunks)
+            l = []
+            encodeInto(obj, l)
+            encoded = d['_encoding'] = ''.join(l)
+        chunks.append(encoded)
+        return len(encoded)
+    return encode
+
+_encoders = {}
+
+def _findEncoder(klass):
+    plainStr = (BERBase.__dict__['__str__'],
+                BERCachedEncoding.__dict__['__str__'])
+    encode = _encodeWithStr
+    for base in inspect.getmro(klass):
+        encodeInto = base.__dict__.get('encodeInto')
+        if encodeInto is not None:
+            encode = encodeInto
+            break
+        __str__ = base.__dict__.get('__str__')
+        if __str__ is not None and __str__ not in plainStr:
+            # Only knows how to turn itself into a string, as a
+            # subclass that overrides __str__ does.
+            break
+    if issubclass(klass, BERCachedEncoding):
+        encode = _encodeCached(encode)
+    return encode
+
+def berEncodeInto(obj, chunks):
+    """
+    Append the BER encoding of obj to the list chunks.
+
+    Returns the number of bytes appended. obj does not need to be a
+    BERBase; anything that has no encodeInto, or overrides __str__
+    below the class that defines it, is encoded with str().
+    """
+    klass = obj.__class__
+    try:
+        encode = _encoders[klass]
+    except KeyError:
+        encode = _encoders[klass] = _findEncoder(klass)
+    return encode(obj, chunks)
+
+def berEncodeStructured(identification, members, chunks):
+    """
+    Append a structured element containing members to chunks.
+
+    Returns the number of bytes appended.
+    """
+    i = len(chunks)
+    chunks.append(None)
+    length = 0
+    for x in members:
+        length += berEncodeInto(x, chunks)
+    header = chr(identification)+int2berlen(length)
+    chunks[i] = header
+    return len(header)+length
+
+def berEncodeChunks(obj):
+    """
+    Return the BER encoding of obj as a list of strings, for
+    transport.writeSequence.
+    """
+    chunks = []
+    berEncodeInto(obj, chunks)
+    return chunks
 
 def berDecodeLength(m, offset=0):
     """
     Return a tuple of (length, lengthLength).
     m must be atleast one byte long.
     """
-    l=ber2int(m[offset+0])
+    l=_byteValues[m[offset]]
     ll=1
     if l&0x80:
         ll=1+(l&0x7F)
         need(m, offset+ll)
-        l=ber2int(m[offset+1:offset+ll], signed=0)
+        l=0L
+        for i in xrange(offset+1, offset+ll):
+            l=(l<<8)|_byteValues[m[i]]
     return (l, ll)
 
+# Integers and lengths are encoded and decoded for nearly every
+# element. Small ones come from these tables; the rest go through
+# struct when they fit in 64 bits.
+_packShort = struct.Struct('>H').pack
+_packSigned = struct.Struct('>q').pack
+_packUnsigned = struct.Struct('>Q').pack
+_unpackSigned = struct.Struct('>q').unpack
+_unpackUnsigned = struct.Struct('>Q').unpack
+
+_smallInts = {}
+_smallLengths = [chr(i) for i in range(128)] \
+                + ['\x81'+chr(i) for i in range(128, 256)]
+_byteValues = dict((chr(i), 0L+i) for i in range(256))
+_signedByteValues = dict((chr(i), 0L+i-256*(i>>7)) for i in range(256))
+
 def int2berlen(i):
     assert i>=0
+    if i<256:
+        return _smallLengths[i]
+    if i<65536:
+        return '\x82'+_packShort(i)
     e=int2ber(i, signed=False)
-    if i <= 127:
-        return e
-    else:
-        l=len(e)
-        assert l>0
-        assert l<=127
-        return chr(0x80|l) + e
+    l=len(e)
+    assert l>0
+    assert l<=127
+    return chr(0x80|l) + e
 
 def int2ber(i, signed=True):
+    if signed:
+        encoded=_smallInts.get(i)
+        if encoded is not None:
+            return encoded
+        if -0x8000000000000000 <= i <= 0x7fffffffffffffff:
+            if i < 0:
+                n = (~i).bit_length()//8+1
+            else:
+                n = i.bit_length()//8+1
+            return _packSigned(i)[8-n:]
+    elif 0 <= i <= 0xffffffffffffffff:
+        n = (i.bit_length()+7)//8 or 1
+        return _packUnsigned(i)[8-n:]
     encoded=''
     while ((signed and (i>127 or i<-128))
            or (not signed and (i>255))):
@@ -104,7 +212,54 @@ def int2ber(i, signed=True):
     encoded=chr(i%256)+encoded
     return encoded
 
+_smallInts.update([(i, int2ber(i)) for i in range(-128, 1024)])
+
+def ber2str(content):
+    """
+    Return content as a string.
+
+    Decoding passes nested content around as memoryview slices of the
+    original buffer; leaf values call this to copy out just their own
+    bytes.
+    """
+    if isinstance(content, memoryview):
+        return content.tobytes()
+    return content
+
+_viewAware = {}
+
+def berContentFor(berclass, content):
+    """
+    Return content the way berclass.fromBER expects it.
+
+    The classes of ldaptor take memoryview content, see ber2str.
+    Classes defined elsewhere were written for strings and get their
+    content as one, copied out of the buffer.
+    """
+    try:
+        aware = _viewAware[berclass]
+    except KeyError:
+        aware = _viewAware[berclass] = \
+                (getattr(berclass, '__module__', None) or '').startswith('ldaptor.')
+    if aware:
+        return content
+    return ber2str(content)
+
 def ber2int(e, signed=True):
+    l=len(e)
+    if l==1:
+        if signed:
+            return _signedByteValues[e[0]]
+        return _byteValues[e[0]]
+    if 1<l<=8:
+        e=ber2str(e)
+        if signed:
+            if ord(e[0])&0x80:
+                e='\xff'*(8-l)+e
+            else:
+                e='\0'*(8-l)+e
+            return 0L+_unpackSigned(e)[0]
+        return 0L+_unpackUnsigned('\0'*(8-l)+e)[0]
     need(e, 1)
     v=0L+ord(e[0])
     if v&0x80 and signed:
@@ -113,15 +268,69 @@ def ber2int(e, signed=True):
         v=(v<<8) | ord(e[i])
     return v
 
+class _BERType(type):
+    """
+    Metaclass of BERBase.
+
+    Moves the tag given in a class body to _classTag, where the tag
+    descriptor on BERBase finds it, so that BER objects can keep a
+    per-instance tag in a slot instead of in a __dict__.
+    """
+
+    def __new__(meta, name, bases, d):
+        if 'tag' in d and not isinstance(d['tag'], _TagDescriptor):
+            d['_classTag'] = d.pop('tag')
+        return type.__new__(meta, name, bases, d)
+
+    def __setattr__(klass, name, value):
+        if name == 'tag':
+            name = '_classTag'
+        type.__setattr__(klass, name, value)
+
+class _TagDescriptor(object):
+    """
+    The tag of a BER object: the one given to the constructor, or the
+    tag of its class.
+    """
+
+    def __get__(self, obj, klass):
+        if obj is not None:
+            tag = getattr(obj, '_tag', None)
+            if tag is not None:
+                return tag
+        return klass._classTag
+
+    def __set__(self, obj, value):
+        obj._tag = value
+
 class BERBase(object):
-    tag = None
+    __metaclass__ = _BERType
+    __slots__ = ('_tag',)
+
+    tag = _TagDescriptor()
+    _classTag = None
 
     def identification(self):
         return self.tag
 
     def __init__(self, tag=None):
-        if tag is not None:
-            self.tag=tag
+        self._tag = tag
+
+    def __str__(self):
+        chunks = []
+        self.encodeInto(chunks)
+        return ''.join(chunks)
+
+    def encodeInto(self, chunks):
+        """
+        Append the BER encoding of self to the list chunks.
+
+        Returns the number of bytes appended. Structured types reserve
+        a slot for their header, encode their members after it and
+        fill the header in once the length of the content is known, so
+        nothing is copied until the chunks are joined or written out.
+        """
+        raise NotImplementedError
 
     def __len__(self):
         return len(str(self))
@@ -144,7 +353,40 @@ class BERBase(object):
         else:
             return False
 
+class BERCachedEncoding(object):
+    """
+    Mixin for BER objects that can remember their encoding.
+
+    Nothing is cached until cacheEncoding() is called on an instance;
+    after that the encoding is computed once and reused by str() and
+    berEncodeInto() until an attribute of the object is assigned or
+    deleted. Changes made inside mutable members, like the list of
+    values of an attribute or a nested filter, are not noticed and need
+    an explicit invalidateEncoding().
+    """
+
+    def cacheEncoding(self):
+        """Start caching the encoding of self."""
+        self.__dict__['_encodingCached'] = True
+
+    def invalidateEncoding(self):
+        """Forget the cached encoding of self, if any."""
+        self.__dict__.pop('_encoding', None)
+
+    def __setattr__(self, name, value):
+        self.__dict__.pop('_encoding', None)
+        super(BERCachedEncoding, self).__setattr__(name, value)
+
+    def __delattr__(self, name):
+        self.__dict__.pop('_encoding', None)
+        super(BERCachedEncoding, self).__delattr__(name)
+
+    def __str__(self):
+        return ''.join(berEncodeChunks(self))
+
 class BERStructured(BERBase):
+    __slots__ = ()
+
     def identification(self):
         return STRUCTURED|self.tag
 
@@ -152,14 +394,17 @@ class BERException(Exception): pass
 
 class BERExceptionInsufficientData(Exception): pass
 
+class BERExceptionLimitExceeded(BERException):
+    """A received element is larger or more complex than allowed."""
+
 def need(buf, n):
     d=n-len(buf)
     if d>0:
         raise BERExceptionInsufficientData, d
 
 class BERInteger(BERBase):
+    __slots__ = ('value',)
     tag = 0x02
-    value = None
 
     def fromBER(klass, tag, content, berdecoder=None):
         assert len(content)>0
@@ -176,11 +421,13 @@ class BERInteger(BERBase):
         assert value is not None
         self.value=value
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         encoded=int2ber(self.value)
-        return chr(self.identification()) \
-               +int2berlen(len(encoded)) \
-               +encoded
+        encoded=chr(self.identification()) \
+                 +int2berlen(len(encoded)) \
+                 +encoded
+        chunks.append(encoded)
+        return len(encoded)
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -190,13 +437,12 @@ class BERInteger(BERBase):
                    %(self.value, self.tag)
 
 class BEROctetString(BERBase):
+    __slots__ = ('value',)
     tag = 0x04
 
-    value = None
-
     def fromBER(klass, tag, content, berdecoder=None):
         assert len(content)>=0
-        r = klass(value=content, tag=tag)
+        r = klass(value=ber2str(content), tag=tag)
         return r
     fromBER = classmethod(fromBER)
 
@@ -205,11 +451,13 @@ class BEROctetString(BERBase):
         assert value is not None
         self.value=value
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         value = str(self.value)
-        return chr(self.identification()) \
-               +int2berlen(len(value)) \
-               +value
+        header = chr(self.identification()) \
+                 +int2berlen(len(value))
+        chunks.append(header)
+        chunks.append(value)
+        return len(header)+len(value)
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -221,6 +469,7 @@ class BEROctetString(BERBase):
                    %(repr(self.value), self.tag)
 
 class BERNull(BERBase):
+    __slots__ = ()
     tag = 0x05
 
     def fromBER(klass, tag, content, berdecoder=None):
@@ -232,8 +481,9 @@ class BERNull(BERBase):
     def __init__(self, tag=None):
         BERBase.__init__(self, tag)
 
-    def __str__(self):
-        return chr(self.identification())+chr(0)
+    def encodeInto(self, chunks):
+        chunks.append(chr(self.identification())+chr(0))
+        return 2
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -242,6 +492,7 @@ class BERNull(BERBase):
             return self.__class__.__name__+"(tag=%d)"%self.tag
 
 class BERBoolean(BERBase):
+    __slots__ = ('value',)
     tag = 0x01
 
     def fromBER(klass, tag, content, berdecoder=None):
@@ -261,11 +512,12 @@ class BERBoolean(BERBase):
             value=0xFF
         self.value=value
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         assert self.value==0 or self.value==0xFF
-        return chr(self.identification()) \
-               +int2berlen(1) \
-               +chr(self.value)
+        chunks.append(chr(self.identification()) \
+                      +int2berlen(1) \
+                      +chr(self.value))
+        return 3
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -276,12 +528,21 @@ class BERBoolean(BERBase):
 
 
 class BEREnumerated(BERInteger):
+    __slots__ = ()
     tag = 0x0a
 
-class BERSequence(BERStructured, UserList.UserList):
-    # TODO __getslice__ calls __init__ with no args.
+class BERSequence(BERStructured):
+    """
+    A sequence of BER objects.
+
+    Behaves like a list of its members; slicing returns a plain list.
+    """
+    __slots__ = ('data',)
     tag = 0x10
 
+    # Mutable, and compared by encoding.
+    __hash__ = None
+
     def fromBER(klass, tag, content, berdecoder=None):
         l = berDecodeMultiple(content, berdecoder)
         r = klass(l, tag=tag)
@@ -290,13 +551,62 @@ class BERSequence(BERStructured, UserList.UserList):
 
     def __init__(self, value=None, tag=None):
         BERStructured.__init__(self, tag)
-        UserList.UserList.__init__(self)
         assert value is not None
-        self[:]=value
+        self.data=list(value)
 
-    def __str__(self):
-        r=string.join(map(str, self.data), '')
-        return chr(self.identification())+int2berlen(len(r))+r
+    def __getitem__(self, i):
+        return self.data[i]
+
+    def __setitem__(self, i, item):
+        self.data[i]=item
+
+    def __delitem__(self, i):
+        del self.data[i]
+
+    def __getslice__(self, i, j):
+        return self.data[i:j]
+
+    def __setslice__(self, i, j, other):
+        self.data[i:j]=other
+
+    def __delslice__(self, i, j):
+        del self.data[i:j]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __contains__(self, item):
+        return item in self.data
+
+    def append(self, item):
+        self.data.append(item)
+
+    def extend(self, other):
+        self.data.extend(other)
+
+    def insert(self, i, item):
+        self.data.insert(i, item)
+
+    def pop(self, i=-1):
+        return self.data.pop(i)
+
+    def remove(self, item):
+        self.data.remove(item)
+
+    def index(self, item, *args):
+        return self.data.index(item, *args)
+
+    def count(self, item):
+        return self.data.count(item)
+
+    def reverse(self):
+        self.data.reverse()
+
+    def sort(self, *args, **kwds):
+        self.data.sort(*args, **kwds)
+
+    def encodeInto(self, chunks):
+        return berEncodeStructured(self.identification(), self.data, chunks)
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -307,14 +617,64 @@ class BERSequence(BERStructured, UserList.UserList):
 
 
 class BERSequenceOf(BERSequence):
-    pass
+    __slots__ = ()
 
 class BERSet(BERSequence):
+    __slots__ = ()
     tag = 0x11
-    pass
 
 
 
+class BERDispatchTable(dict):
+    """
+    A flattened tag to class mapping for a BERDecoderContext.
+
+    The table holds the Identities of a context merged over those of
+    all its fallbacks, so finding the class for a tag is a single dict
+    lookup instead of a walk down the fallback chain. Tables derived
+    from this one are cached, so contexts created while decoding share
+    the table built the first time their chain was seen.
+
+    Tables are built lazily when a chain is first used rather than
+    when the context classes are defined, and a context class gets
+    one only if neither it nor any context in its fallback chain
+    overrides lookup_id. A cached table is rebuilt when the Identities
+    attribute of a class is replaced; changing an Identities dict in
+    place after it has been used is not noticed.
+    """
+    def __init__(self, identities, parent=None):
+        if parent is not None:
+            dict.__init__(self, parent)
+        self.update(identities)
+        self.identities = identities
+        self.derived = {}
+
+    def extend(self, klass):
+        """
+        Return the table for a context of class klass using a context
+        with this table as fallback.
+        """
+        try:
+            identities, table = self.derived[klass]
+        except KeyError:
+            pass
+        else:
+            if identities is klass.Identities:
+                return table
+        for tag, class_ in klass.Identities.items():
+            if self.get(tag) is not class_:
+                table = BERDispatchTable(klass.Identities, parent=self)
+                break
+        else:
+            # Nothing to add, e.g. a filter context falling back to
+            # another filter context; share the table so nesting does
+            # not create new ones.
+            table = self
+        self.derived[klass] = (klass.Identities, table)
+        return table
+
+_rootDispatchTables = {}
+
 class BERDecoderContext:
     Identities = {
         BERInteger.tag: BERInteger,
@@ -329,8 +689,31 @@ class BERDecoderContext:
     def __init__(self, fallback=None, inherit=None):
         self.fallback=fallback
         self.inherit_context=inherit
+        self.dispatch=self._dispatchTable()
+
+    def _dispatchTable(self):
+        klass = self.__class__
+        if getattr(klass.lookup_id, 'im_func', None) \
+               is not BERDecoderContext.lookup_id.im_func:
+            # lookup_id is overridden, a table would bypass it; this
+            # also keeps contexts falling back to this one walking
+            return None
+        if self.fallback is None:
+            table = _rootDispatchTables.get(klass)
+            if table is None or table.identities is not klass.Identities:
+                table = BERDispatchTable(klass.Identities)
+                _rootDispatchTables[klass] = table
+            return table
+        parent = getattr(self.fallback, 'dispatch', None)
+        if parent is None:
+            # fallback is not a BERDecoderContext or does its own
+            # lookups, only lookup_id can be relied on
+            return None
+        return parent.extend(klass)
 
     def lookup_id(self, id):
+        if self.dispatch is not None:
+            return self.dispatch.get(id)
         try:
             return self.Identities[id]
         except KeyError:
@@ -355,10 +738,18 @@ class BERDecoderContext:
 def berDecodeObject(context, m):
     """berDecodeObject(context, string) -> (berobject, bytesUsed)
     berobject may be None.
+
+    m may also be a memoryview. A string is wrapped in one, so the
+    content handed to fromBER is a slice of the original buffer and
+    nested objects are never copied; only leaf values are turned into
+    strings, see ber2str. Classes from outside ldaptor still get their
+    content as a string, see berContentFor.
     """
+    if isinstance(m, str):
+        m = memoryview(m)
     while m:
         need(m, 2)
-        i=ber2int(m[0], signed=0)&(CLASS_MASK|TAG_MASK)
+        i=_byteValues[m[0]]&(CLASS_MASK|TAG_MASK)
 
         length, lenlen = berDecodeLength(m, offset=1)
         need(m, 1+lenlen+length)
@@ -369,7 +760,7 @@ def berDecodeObject(context, m):
             inh=context.inherit()
             assert inh
             r = berclass.fromBER(tag=i,
-                                 content=m2,
+                                 content=berContentFor(berclass, m2),
                                  berdecoder=inh)
             return (r, 1+lenlen+length)
         else:
@@ -387,6 +778,8 @@ def berDecodeMultiple(content, berdecoder):
     All of content will be decoded, and content must contain complete
     BER objects.
     """
+    if isinstance(content, str):
+        content = memoryview(content)
     l = []
     while content:
         n, bytes = berDecodeObject(berdecoder, content)
@@ -396,6 +789,152 @@ def berDecodeMultiple(content, berdecoder):
         content = content[bytes:]
     return l
 
+class BERFramer(object):
+    """
+    Split a stream of bytes into complete top-level BER elements.
+
+    Only the tag and length header of each element is parsed. Received
+    data is kept as a list of chunks and joined once per batch of
+    complete elements, so an element arriving in many small pieces
+    costs time linear in its size, and a single read carrying many
+    elements is split without re-copying the rest of the buffer.
+
+    maxLength limits the size of an element, including its header;
+    it is checked as soon as the header has arrived, before the rest
+    of the element is buffered. maxDepth limits how deeply structured
+    elements nest and maxElements how many elements one top-level
+    element holds in total, itself included; they are checked by
+    walking the headers of a complete element before it is returned
+    for decoding. None means no limit.
+
+    Once a limit has been exceeded the stream can not be framed any
+    further: feed raises BERExceptionLimitExceeded for that and every
+    later call, and drops whatever was buffered.
+    """
+
+    # tag octet, length octet and at most 127 octets of long form length
+    maxHeaderLength = 2+127
+
+    def __init__(self, maxLength=None, maxDepth=None, maxElements=None):
+        self.maxLength = maxLength
+        self.maxDepth = maxDepth
+        self.maxElements = maxElements
+        self.chunks = []
+        self.buffered = 0
+        self.frameLength = None
+        self.failure = None
+
+    def __len__(self):
+        return self.buffered
+
+    def _header(self):
+        head = ''
+        for chunk in self.chunks:
+            head += chunk[:self.maxHeaderLength-len(head)]
+            if len(head) >= self.maxHeaderLength:
+                break
+        try:
+            need(head, 2)
+            length, lenlen = berDecodeLength(head, offset=1)
+        except BERExceptionInsufficientData:
+            return None
+        return self._checkLength(1+lenlen+length)
+
+    def _checkLength(self, frameLength):
+        if self.maxLength is not None and frameLength > self.maxLength:
+            raise BERExceptionLimitExceeded(
+                'BER element of %d bytes exceeds the limit of %d bytes'
+                % (frameLength, self.maxLength))
+        return frameLength
+
+    def _checkStructure(self, frame):
+        # Iterates over the headers only; ends holds the end offsets of
+        # the structured elements enclosing the current one.
+        maxDepth = self.maxDepth
+        maxElements = self.maxElements
+        ends = []
+        elements = 0
+        offset = 0
+        while offset+2 <= len(frame):
+            while ends and offset >= ends[-1]:
+                ends.pop()
+            elements += 1
+            if maxElements is not None and elements > maxElements:
+                raise BERExceptionLimitExceeded(
+                    'BER element holds more than %d elements'
+                    % maxElements)
+            tag = _byteValues[frame[offset]]
+            try:
+                length, lenlen = berDecodeLength(frame, offset=offset+1)
+            except BERExceptionInsufficientData:
+                # Malformed; left for the decoder to complain about.
+                return
+            offset += 1+lenlen
+            if tag & STRUCTURED:
+                ends.append(offset+length)
+                if maxDepth is not None and len(ends) > maxDepth:
+                    raise BERExceptionLimitExceeded(
+                        'BER elements nested more than %d deep'
+                        % maxDepth)
+            else:
+                offset += length
+
+    def feed(self, data):
+        """
+        Add data to the buffer.
+
+        Returns a list of complete BER elements, as memoryviews, in
+        the order they were received; data belonging to an incomplete
+        element is kept for the next call.
+        """
+        if self.failure is not None:
+            raise self.failure
+        try:
+            return self._feed(data)
+        except BERExceptionLimitExceeded, e:
+            self.failure = e
+            self.chunks = []
+            self.buffered = 0
+            self.frameLength = None
+            raise
+
+    def _feed(self, data):
+        if data:
+            self.chunks.append(data)
+            self.buffered += len(data)
+        if self.frameLength is None:
+            self.frameLength = self._header()
+        if self.frameLength is None or self.frameLength > self.buffered:
+            return []
+
+        buf = memoryview(''.join(self.chunks))
+        frames = []
+        offset = 0
+        while True:
+            frames.append(buf[offset:offset+self.frameLength])
+            offset += self.frameLength
+            try:
+                need(buf, offset+2)
+                length, lenlen = berDecodeLength(buf, offset=offset+1)
+            except BERExceptionInsufficientData:
+                self.frameLength = None
+                break
+            self.frameLength = self._checkLength(1+lenlen+length)
+            if offset+self.frameLength > len(buf):
+                break
+
+        if self.maxDepth is not None or self.maxElements is not None:
+            for frame in frames:
+                self._checkStructure(frame)
+
+        rest = buf[offset:].tobytes()
+        if rest:
+            self.chunks = [rest]
+        else:
+            self.chunks = []
+        self.buffered = len(rest)
+        return frames
+
 #TODO unimplemented classes are below:
 
 #class BERObjectIdentifier(BERBase):
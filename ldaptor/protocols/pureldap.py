@@ -19,12 +19,14 @@ import string
 
 from pureber import (
 
-    BERBoolean, BERDecoderContext, BEREnumerated, BERInteger, BERNull,
-    BEROctetString, BERSequence, BERSequenceOf, BERSet, BERStructured,
+    BERBase, BERBoolean, BERCachedEncoding, BERDecoderContext, BEREnumerated, BERInteger,
+    BERNull, BEROctetString, BERSequence, BERSequenceOf, BERSet,
+    BERStructured, UnknownBERTag,
 
-    CLASS_APPLICATION, CLASS_CONTEXT,
+    CLASS_APPLICATION, CLASS_CONTEXT, CLASS_MASK, TAG_MASK,
 
-    berDecodeMultiple, berDecodeObject, int2berlen,
+    ber2int, ber2str, berContentFor, berDecodeLength, berDecodeMultiple,
+    berDecodeObject, berEncodeStructured, need,
     )
 
 next_ldap_message_id=1
@@ -53,36 +55,27 @@ def smart_escape(s, threshold=0.30):
     return escape(s)
 
 class LDAPInteger(BERInteger):
-    pass
+    __slots__ = ()
 
 class LDAPString(BEROctetString):
+    __slots__ = ('escaper',)
+
     def __init__(self, *args, **kwargs):
         self.escaper = kwargs.pop('escaper', escape)
         super(LDAPString, self).__init__(*args, **kwargs)
 
 class LDAPAttributeValue(BEROctetString):
-    pass
+    __slots__ = ()
 
 class LDAPMessage(BERSequence):
-    id = None
-    value = None
+    __slots__ = ('id', 'value', 'controls')
 
     def fromBER(klass, tag, content, berdecoder=None):
         l = berDecodeMultiple(content, berdecoder)
 
         id_=l[0].value
         value=l[1]
-        if l[2:]:
-            controls = []
-            for c in l[2]:
-                controls.append((
-                    c.controlType,
-                    c.criticality,
-                    c.controlValue,
-                    ))
-        else:
-            controls = None
-        assert not l[3:]
+        controls = _decodeControls(l[2:])
 
         r = klass(id=id_,
                   value=value,
@@ -100,11 +93,11 @@ class LDAPMessage(BERSequence):
         self.value=value
         self.controls = controls
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         l = [BERInteger(self.id), self.value]
         if self.controls is not None:
             l.append(LDAPControls([LDAPControl(*a) for a in self.controls]))
-        return str(BERSequence(l))
+        return BERSequence(l).encodeInto(chunks)
 
     def __repr__(self):
         l=[]
@@ -114,11 +107,142 @@ class LDAPMessage(BERSequence):
             l.append('tag=%d' % self.tag)
         return self.__class__.__name__+'('+', '.join(l)+')'
 
+def _decodeControls(l):
+    if l:
+        controls = []
+        for c in l[0]:
+            controls.append((
+                c.controlType,
+                c.criticality,
+                c.controlValue,
+                ))
+    else:
+        controls = None
+    assert not l[1:]
+    return controls
+
+# Attributes a LazyLDAPProtocolOp answers without decoding itself.
+_lazyAttributes = frozenset(['__class__', '__dict__', 'tag', '_tag',
+                             'needs_answer'])
+
+class LazyLDAPProtocolOp(object):
+    """
+    Mixin for a protocol op whose BER content has not been decoded yet.
+
+    Instances are created by LazyLDAPMessage with the tag in its slot
+    and the undecoded element in their __dict__. Reading or setting any
+    attribute other than the class, tag and needs_answer decodes the op
+    and turns the instance into a plain instance of the real class. An
+    op that was never looked into encodes to exactly the bytes it was
+    decoded from.
+    """
+
+    def _decode(self):
+        d = object.__getattribute__(self, '__dict__')
+        berclass, raw, headerLength, berdecoder = d.pop('_lazy')
+        decoded = berclass.fromBER(tag=object.__getattribute__(self, '_tag'),
+                                   content=berContentFor(
+                                       berclass, memoryview(raw)[headerLength:]),
+                                   berdecoder=berdecoder)
+        d.clear()
+        d.update(decoded.__dict__)
+        object.__setattr__(self, '__class__', berclass)
+        for klass in type(decoded).__mro__:
+            slots = klass.__dict__.get('__slots__', ())
+            if isinstance(slots, basestring):
+                slots = (slots,)
+            for name in slots:
+                if name in ('__dict__', '__weakref__'):
+                    continue
+                try:
+                    value = getattr(decoded, name)
+                except AttributeError:
+                    # not set
+                    continue
+                object.__setattr__(self, name, value)
+
+    def __getattribute__(self, name):
+        if name in _lazyAttributes:
+            return object.__getattribute__(self, name)
+        LazyLDAPProtocolOp._decode(self)
+        return getattr(self, name)
+
+    def __setattr__(self, name, value):
+        LazyLDAPProtocolOp._decode(self)
+        setattr(self, name, value)
+
+    def __delattr__(self, name):
+        LazyLDAPProtocolOp._decode(self)
+        delattr(self, name)
+
+    def __str__(self):
+        return object.__getattribute__(self, '__dict__')['_lazy'][1]
+
+_lazyProtocolOpClasses = {}
+
+def _lazyProtocolOpClass(berclass):
+    try:
+        return _lazyProtocolOpClasses[berclass]
+    except KeyError:
+        pass
+    # Named like the real class, so handlers looked up by class name,
+    # as BaseLDAPServer.handle does, still find it.
+    lazyclass = type(berclass.__name__,
+                     (LazyLDAPProtocolOp, berclass),
+                     {'__module__': berclass.__module__})
+    _lazyProtocolOpClasses[berclass] = lazyclass
+    return lazyclass
+
+class LazyLDAPMessage(LDAPMessage):
+    """
+    An LDAPMessage that decodes only its envelope.
+
+    The message id and controls are decoded right away, the protocol op
+    is kept as raw bytes in a LazyLDAPProtocolOp and decoded when it is
+    first used. A proxy that only looks at the id and the type of the
+    op forwards the op without decoding or encoding it.
+    """
+    __slots__ = ()
+
+    def fromBER(klass, tag, content, berdecoder=None):
+        id_, bytes = berDecodeObject(berdecoder, content)
+        content = content[bytes:]
+
+        need(content, 2)
+        optag = ber2int(content[0], signed=0)&(CLASS_MASK|TAG_MASK)
+        length, lenlen = berDecodeLength(content, offset=1)
+        end = 1+lenlen+length
+        need(content, end)
+        berclass = berdecoder.lookup_id(optag)
+        if berclass is None:
+            raise UnknownBERTag(optag, berdecoder)
+        if issubclass(berclass, BERBase):
+            lazyclass = _lazyProtocolOpClass(berclass)
+            value = lazyclass.__new__(lazyclass)
+            object.__setattr__(value, '_tag', optag)
+            d = object.__getattribute__(value, '__dict__')
+            d['_lazy'] = (berclass, ber2str(content[:end]), 1+lenlen,
+                          berdecoder.inherit())
+        else:
+            value = berclass.fromBER(tag=optag,
+                                     content=berContentFor(
+                                         berclass, content[1+lenlen:end]),
+                                     berdecoder=berdecoder.inherit())
+
+        controls = _decodeControls(berDecodeMultiple(content[end:],
+                                                     berdecoder))
+        r = klass(id=id_.value,
+                  value=value,
+                  controls=controls,
+                  tag=tag)
+        return r
+    fromBER = classmethod(fromBER)
+
 class LDAPProtocolOp:
     def __init__(self):
         pass
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         raise NotImplementedError
 
 class LDAPProtocolRequest(LDAPProtocolOp):
@@ -178,16 +302,16 @@ class LDAPBindRequest(LDAPProtocolRequest, BERSequence):
             assert(not sasl)
         self.sasl=sasl
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         if not self.sasl:
             auth_ber = BEROctetString(self.auth, tag=CLASS_CONTEXT|0)
         else:
             auth_ber = BERSequence([BEROctetString(self.auth[0]), BEROctetString(self.auth[1])], tag=CLASS_CONTEXT|3)
-        return str(BERSequence([
+        return BERSequence([
             BERInteger(self.version),
             BEROctetString(self.dn),
             auth_ber,
-            ], tag=self.tag))
+            ], tag=self.tag).encodeInto(chunks)
 
     def __repr__(self):
         l=[]
@@ -200,6 +324,7 @@ class LDAPBindRequest(LDAPProtocolRequest, BERSequence):
         return self.__class__.__name__+'('+', '.join(l)+')'
 
 class LDAPReferral(BERSequence):
+    __slots__ = ()
     tag = CLASS_CONTEXT | 0x03
 
 
@@ -256,14 +381,14 @@ class LDAPResult(LDAPProtocolResponse, BERSequence):
         self.referral=referral
         self.serverSaslCreds=serverSaslCreds
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         assert self.referral is None #TODO
-        return str(BERSequence([
+        return BERSequence([
             BEREnumerated(self.resultCode),
             BEROctetString(self.matchedDN),
             BEROctetString(self.errorMessage),
             #TODO referral [3] Referral OPTIONAL
-            ], tag=self.tag))
+            ], tag=self.tag).encodeInto(chunks)
 
     def __repr__(self):
         l=[]
@@ -279,10 +404,9 @@ class LDAPResult(LDAPProtocolResponse, BERSequence):
         return self.__class__.__name__+'('+', '.join(l)+')'
 
 class LDAPBindResponse_serverSaslCreds(BEROctetString):
+    __slots__ = ()
     tag = CLASS_CONTEXT|0x07
 
-    pass
-
 class LDAPBERDecoderContext_BindResponse(BERDecoderContext):
     Identities = {
         LDAPBindResponse_serverSaslCreds.tag: LDAPBindResponse_serverSaslCreds,
@@ -329,8 +453,8 @@ class LDAPBindResponse(LDAPResult):
         LDAPResult.__init__(self, resultCode=resultCode, matchedDN=matchedDN, errorMessage=errorMessage,
                             referral=referral, serverSaslCreds=serverSaslCreds, tag=None)
 
-    def __str__(self):
-        return LDAPResult.__str__(self)
+    def encodeInto(self, chunks):
+        return LDAPResult.encodeInto(self, chunks)
 
     def __repr__(self):
         return LDAPResult.__repr__(self)
@@ -343,11 +467,11 @@ class LDAPUnbindRequest(LDAPProtocolRequest, BERNull):
         LDAPProtocolRequest.__init__(self)
         BERNull.__init__(self, *args, **kwargs)
 
-    def __str__(self):
-        return BERNull.__str__(self)
+    def encodeInto(self, chunks):
+        return BERNull.encodeInto(self, chunks)
 
 class LDAPAttributeDescription(BEROctetString):
-    pass
+    __slots__ = ()
 
 class LDAPAttributeValueAssertion(BERSequence):
     def fromBER(klass, tag, content, berdecoder=None):
@@ -367,10 +491,10 @@ class LDAPAttributeValueAssertion(BERSequence):
         self.assertionValue=assertionValue
         self.escaper=escaper
 
-    def __str__(self):
-        return str(BERSequence([self.attributeDesc,
-                                self.assertionValue],
-                               tag=self.tag))
+    def encodeInto(self, chunks):
+        return BERSequence([self.attributeDesc,
+                            self.assertionValue],
+                           tag=self.tag).encodeInto(chunks)
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -381,11 +505,11 @@ class LDAPAttributeValueAssertion(BERSequence):
                    %(repr(self.attributeDesc), repr(self.assertionValue), self.tag)
 
 
-class LDAPFilter(BERStructured):
+class LDAPFilter(BERCachedEncoding, BERStructured):
     def __init__(self, tag=None):
         BERStructured.__init__(self, tag=tag)
 
-class LDAPFilterSet(BERSet):
+class LDAPFilterSet(BERCachedEncoding, BERSet):
     def fromBER(klass, tag, content, berdecoder=None):
         l = berDecodeMultiple(content, LDAPBERDecoderContext_Filter(fallback=berdecoder))
         r = klass(l, tag=tag)
@@ -431,14 +555,13 @@ class LDAPFilter_not(LDAPFilter):
                    +"(value=%s, tag=%d)"\
                    %(repr(self.value), self.tag)
 
-    def __str__(self):
-        r=str(self.value)
-        return chr(self.identification())+int2berlen(len(r))+r
+    def encodeInto(self, chunks):
+        return berEncodeStructured(self.identification(), [self.value], chunks)
 
     def asText(self):
         return '(!'+self.value.asText()+')'
 
-class LDAPFilter_equalityMatch(LDAPAttributeValueAssertion):
+class LDAPFilter_equalityMatch(BERCachedEncoding, LDAPAttributeValueAssertion):
     tag = CLASS_CONTEXT|0x03
 
     def asText(self):
@@ -446,6 +569,7 @@ class LDAPFilter_equalityMatch(LDAPAttributeValueAssertion):
                +self.escaper(self.assertionValue.value)+')'
 
 class LDAPFilter_substrings_initial(LDAPString):
+    __slots__ = ()
     tag = CLASS_CONTEXT|0x00
 
     def asText(self):
@@ -453,12 +577,14 @@ class LDAPFilter_substrings_initial(LDAPString):
 
 
 class LDAPFilter_substrings_any(LDAPString):
+    __slots__ = ()
     tag = CLASS_CONTEXT|0x01
 
     def asText(self):
         return self.escaper(self.value)
 
 class LDAPFilter_substrings_final(LDAPString):
+    __slots__ = ()
     tag = CLASS_CONTEXT|0x02
 
     def asText(self):
@@ -471,7 +597,7 @@ class LDAPBERDecoderContext_Filter_substrings(BERDecoderContext):
         LDAPFilter_substrings_final.tag: LDAPFilter_substrings_final,
         }
 
-class LDAPFilter_substrings(BERSequence):
+class LDAPFilter_substrings(BERCachedEncoding, BERSequence):
     tag = CLASS_CONTEXT|0x04
 
     def fromBER(klass, tag, content, berdecoder=None):
@@ -492,10 +618,10 @@ class LDAPFilter_substrings(BERSequence):
         self.type=type
         self.substrings=substrings
 
-    def __str__(self):
-        return str(BERSequence([
+    def encodeInto(self, chunks):
+        return BERSequence([
             LDAPString(self.type),
-            BERSequence(self.substrings)], tag=self.tag))
+            BERSequence(self.substrings)], tag=self.tag).encodeInto(chunks)
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -537,27 +663,28 @@ class LDAPFilter_substrings(BERSequence):
         return '('+self.type+'=' \
                +'*'.join([initial]+any+[final])+')'
 
-class LDAPFilter_greaterOrEqual(LDAPAttributeValueAssertion):
+class LDAPFilter_greaterOrEqual(BERCachedEncoding, LDAPAttributeValueAssertion):
     tag = CLASS_CONTEXT|0x05
 
     def asText(self):
         return '('+self.attributeDesc.value+'>=' \
                +self.escaper(self.assertionValue.value)+')'
 
-class LDAPFilter_lessOrEqual(LDAPAttributeValueAssertion):
+class LDAPFilter_lessOrEqual(BERCachedEncoding, LDAPAttributeValueAssertion):
     tag = CLASS_CONTEXT|0x06
 
     def asText(self):
         return '('+self.attributeDesc.value+'<=' \
                +self.escaper(self.assertionValue.value)+')'
 
-class LDAPFilter_present(LDAPAttributeDescription):
+class LDAPFilter_present(BERCachedEncoding, LDAPAttributeDescription):
+    __slots__ = ()
     tag = CLASS_CONTEXT|0x07
 
     def asText(self):
         return '(%s=*)' % self.value
 
-class LDAPFilter_approxMatch(LDAPAttributeValueAssertion):
+class LDAPFilter_approxMatch(BERCachedEncoding, LDAPAttributeValueAssertion):
     tag = CLASS_CONTEXT|0x08
 
 
@@ -566,26 +693,26 @@ class LDAPFilter_approxMatch(LDAPAttributeValueAssertion):
                +self.escaper(self.assertionValue.value)+')'
 
 class LDAPMatchingRuleId(LDAPString):
-    pass
+    __slots__ = ()
 
 class LDAPAssertionValue(BEROctetString):
-    pass
+    __slots__ = ()
 
 class LDAPMatchingRuleAssertion_matchingRule(LDAPMatchingRuleId):
+    __slots__ = ()
     tag = CLASS_CONTEXT|0x01
-    pass
 
 class LDAPMatchingRuleAssertion_type(LDAPAttributeDescription):
+    __slots__ = ()
     tag = CLASS_CONTEXT|0x02
-    pass
 
 class LDAPMatchingRuleAssertion_matchValue(LDAPAssertionValue):
+    __slots__ = ()
     tag = CLASS_CONTEXT|0x03
-    pass
 
 class LDAPMatchingRuleAssertion_dnAttributes(BERBoolean):
+    __slots__ = ()
     tag = CLASS_CONTEXT|0x04
-    pass
 
 class LDAPBERDecoderContext_MatchingRuleAssertion(BERDecoderContext):
     Identities = {
@@ -657,10 +784,11 @@ class LDAPMatchingRuleAssertion(BERSequence):
         if not self.dnAttributes:
             self.dnAttributes = None
 
-    def __str__(self):
-        return str(BERSequence(
+    def encodeInto(self, chunks):
+        return BERSequence(
             filter(lambda x: x is not None,
-                   [self.matchingRule, self.type, self.matchValue, self.dnAttributes]), tag=self.tag))
+                   [self.matchingRule, self.type, self.matchValue, self.dnAttributes]),
+            tag=self.tag).encodeInto(chunks)
 
     def __repr__(self):
         l=[]
@@ -673,7 +801,7 @@ class LDAPMatchingRuleAssertion(BERSequence):
         return self.__class__.__name__+'('+', '.join(l)+')'
 
 
-class LDAPFilter_extensibleMatch(LDAPMatchingRuleAssertion):
+class LDAPFilter_extensibleMatch(BERCachedEncoding, LDAPMatchingRuleAssertion):
     tag = CLASS_CONTEXT|0x09
     pass
 
@@ -763,8 +891,8 @@ class LDAPSearchRequest(LDAPProtocolRequest, BERSequence):
         if attributes is not None:
             self.attributes=attributes
 
-    def __str__(self):
-        return str(BERSequence([
+    def encodeInto(self, chunks):
+        return BERSequence([
             BEROctetString(self.baseObject),
             BEREnumerated(self.scope),
             BEREnumerated(self.derefAliases),
@@ -773,7 +901,7 @@ class LDAPSearchRequest(LDAPProtocolRequest, BERSequence):
             BERBoolean(self.typesOnly),
             self.filter,
             BERSequenceOf(map(BEROctetString, self.attributes)),
-            ], tag=self.tag))
+            ], tag=self.tag).encodeInto(chunks)
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -796,7 +924,7 @@ class LDAPSearchRequest(LDAPProtocolRequest, BERSequence):
                        self.timeLimit, self.typesOnly,
                        self.filter, self.attributes, self.tag)
 
-class LDAPSearchResultEntry(LDAPProtocolResponse, BERSequence):
+class LDAPSearchResultEntry(BERCachedEncoding, LDAPProtocolResponse, BERSequence):
     tag=CLASS_APPLICATION|0x04
 
     def fromBER(klass, tag, content, berdecoder=None):
@@ -820,15 +948,15 @@ class LDAPSearchResultEntry(LDAPProtocolResponse, BERSequence):
         self.objectName=objectName
         self.attributes=attributes
 
-    def __str__(self):
-        return str(BERSequence([
+    def encodeInto(self, chunks):
+        return BERSequence([
             BEROctetString(self.objectName),
             BERSequence(map(lambda (attr,li):
                             BERSequence([BEROctetString(attr),
                                          BERSet(map(BEROctetString,
                                                     li))]),
                             self.attributes)),
-            ], tag=self.tag))
+            ], tag=self.tag).encodeInto(chunks)
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -856,6 +984,7 @@ class LDAPSearchResultDone(LDAPResult):
     pass
 
 class LDAPControls(BERSequence):
+    __slots__ = ()
     tag = CLASS_CONTEXT|0x00
 
     def fromBER(klass, tag, content, berdecoder=None):
@@ -866,7 +995,7 @@ class LDAPControls(BERSequence):
         return r
     fromBER = classmethod(fromBER)
 
-class LDAPControl(BERSequence):
+class LDAPControl(BERCachedEncoding, BERSequence):
     criticality = None
     controlValue = None
 
@@ -900,13 +1029,13 @@ class LDAPControl(BERSequence):
         self.criticality = criticality
         self.controlValue = controlValue
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         self.data=[LDAPOID(self.controlType)]
         if self.criticality is not None:
             self.data.append(BERBoolean(self.criticality))
         if self.controlValue is not None:
             self.data.append(BEROctetString(self.controlValue))
-        return BERSequence.__str__(self)
+        return BERSequence.encodeInto(self, chunks)
 
 class LDAPBERDecoderContext_LDAPControls(BERDecoderContext):
     Identities = {
@@ -924,6 +1053,11 @@ class LDAPBERDecoderContext_TopLevel(BERDecoderContext):
         BERSequence.tag: LDAPMessage,
         }
 
+class LDAPBERDecoderContext_LazyTopLevel(BERDecoderContext):
+    Identities = {
+        BERSequence.tag: LazyLDAPMessage,
+        }
+
 class LDAPModifyRequest(LDAPProtocolRequest, BERSequence):
     tag=CLASS_APPLICATION|0x06
     object = None
@@ -983,11 +1117,11 @@ class LDAPModifyRequest(LDAPProtocolRequest, BERSequence):
         self.object=object
         self.modification=modification
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         l=[LDAPString(self.object)]
         if self.modification is not None:
             l.append(BERSequence(self.modification))
-        return str(BERSequence(l, tag=self.tag))
+        return BERSequence(l, tag=self.tag).encodeInto(chunks)
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -1038,11 +1172,11 @@ class LDAPAddRequest(LDAPProtocolRequest, BERSequence):
         self.entry=entry
         self.attributes=attributes
 
-    def __str__(self):
-        return str(BERSequence([
+    def encodeInto(self, chunks):
+        return BERSequence([
             LDAPString(self.entry),
             BERSequence(map(BERSequence, self.attributes)),
-            ], tag=self.tag))
+            ], tag=self.tag).encodeInto(chunks)
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -1071,8 +1205,8 @@ class LDAPDelRequest(LDAPProtocolRequest, LDAPString):
         LDAPProtocolRequest.__init__(self)
         LDAPString.__init__(self, value=entry, tag=tag)
 
-    def __str__(self):
-        return LDAPString.__str__(self)
+    def encodeInto(self, chunks):
+        return LDAPString.encodeInto(self, chunks)
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -1090,10 +1224,9 @@ class LDAPDelResponse(LDAPResult):
 
 
 class LDAPModifyDNResponse_newSuperior(LDAPString):
+    __slots__ = ()
     tag = CLASS_CONTEXT|0x00
 
-    pass
-
 class LDAPBERDecoderContext_ModifyDNRequest(BERDecoderContext):
     Identities = {
         LDAPModifyDNResponse_newSuperior.tag: LDAPModifyDNResponse_newSuperior,
@@ -1146,7 +1279,7 @@ class LDAPModifyDNRequest(LDAPProtocolRequest, BERSequence):
         self.deleteoldrdn=deleteoldrdn
         self.newSuperior=newSuperior
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         l=[
             LDAPString(self.entry),
             LDAPString(self.newrdn),
@@ -1154,7 +1287,7 @@ class LDAPModifyDNRequest(LDAPProtocolRequest, BERSequence):
             ]
         if self.newSuperior is not None:
             l.append(LDAPString(self.newSuperior, tag=CLASS_CONTEXT|0))
-        return str(BERSequence(l, tag=self.tag))
+        return BERSequence(l, tag=self.tag).encodeInto(chunks)
 
     def __repr__(self):
         l = [
@@ -1209,9 +1342,9 @@ class LDAPCompareRequest(LDAPProtocolRequest, BERSequence):
         self.entry = entry
         self.ava = ava
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         l = [LDAPString(self.entry), self.ava]
-        return str(BERSequence(l, tag=self.tag))
+        return BERSequence(l, tag=self.tag).encodeInto(chunks)
 
     def __repr__(self):
         l = ["entry={}".format(self.entry), "ava={}".format(repr(self.ava))]
@@ -1237,8 +1370,8 @@ class LDAPAbandonRequest(LDAPProtocolRequest, LDAPInteger):
         LDAPProtocolRequest.__init__(self)
         LDAPInteger.__init__(self, value=id, tag=tag)
 
-    def __str__(self):
-        return LDAPInteger.__str__(self)
+    def encodeInto(self, chunks):
+        return LDAPInteger.encodeInto(self, chunks)
 
     def __repr__(self):
         if self.tag==self.__class__.tag:
@@ -1250,12 +1383,14 @@ class LDAPAbandonRequest(LDAPProtocolRequest, LDAPInteger):
                    %(repr(self.value), self.tag)
 
 class LDAPOID(BEROctetString):
-    pass
+    __slots__ = ()
 
 class LDAPResponseName(LDAPOID):
+    __slots__ = ()
     tag = CLASS_CONTEXT|10
 
 class LDAPResponse(BEROctetString):
+    __slots__ = ()
     tag = CLASS_CONTEXT|11
 
 class LDAPBERDecoderContext_LDAPExtendedRequest(BERDecoderContext):
@@ -1297,17 +1432,20 @@ class LDAPExtendedRequest(LDAPProtocolRequest, BERSequence):
         self.requestName=requestName
         self.requestValue=requestValue
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         l=[LDAPOID(self.requestName, tag=CLASS_CONTEXT|0)]
         if self.requestValue is not None:
             l.append(BEROctetString(str(self.requestValue), tag=CLASS_CONTEXT|1))
-        return str(BERSequence(l, tag=self.tag))
+        return BERSequence(l, tag=self.tag).encodeInto(chunks)
 
 class LDAPPasswordModifyRequest_userIdentity(BEROctetString):
+    __slots__ = ()
     tag=CLASS_CONTEXT|0
 class LDAPPasswordModifyRequest_oldPasswd(BEROctetString):
+    __slots__ = ()
     tag=CLASS_CONTEXT|1
 class LDAPPasswordModifyRequest_newPasswd(BEROctetString):
+    __slots__ = ()
     tag=CLASS_CONTEXT|2
 
 class LDAPBERDecoderContext_LDAPPasswordModifyRequest(BERDecoderContext):
@@ -1410,7 +1548,7 @@ class LDAPExtendedResponse(LDAPResult):
         self.responseName=responseName
         self.response=response
 
-    def __str__(self):
+    def encodeInto(self, chunks):
         assert self.referral is None #TODO
         l=[BEREnumerated(self.resultCode),
            BEROctetString(self.matchedDN),
@@ -1421,7 +1559,7 @@ class LDAPExtendedResponse(LDAPResult):
             l.append(LDAPOID(self.responseName, tag=CLASS_CONTEXT|0x0a))
         if self.response is not None:
             l.append(BEROctetString(self.response, tag=CLASS_CONTEXT|0x0b))
-        return str(BERSequence(l, tag=self.tag))
+        return BERSequence(l, tag=self.tag).encodeInto(chunks)
 
 class LDAPStartTLSRequest(LDAPExtendedRequest):
     """
@@ -0,0 +1,38 @@
+"""
+Test cases for the ldaptor.checkers module.
+"""
+
+from twisted.trial import unittest
+from twisted.cred import credentials, error
+from ldaptor import checkers, config, ldapfilter
+
+class OldConfig:
+    """A configuration without getIdentitySearchFilter."""
+
+    def __init__(self, identitySearch):
+        self.identitySearch = identitySearch
+
+    def getIdentityBaseDN(self):
+        return 'dc=example,dc=com'
+
+    def getIdentitySearch(self, name):
+        return self.identitySearch % {'name': name}
+
+class TestIdentitySearchFilter(unittest.TestCase):
+    def testConfig(self):
+        conf = config.LDAPConfig(identitySearch='(&(bar=thud)(quux=%(name)s))')
+        checker = checkers.LDAPBindingChecker(conf)
+        self.assertEquals(checker._identitySearchFilter('foo'),
+                          ldapfilter.parseFilter('(&(bar=thud)(quux=foo))'))
+
+    def testOldConfig(self):
+        checker = checkers.LDAPBindingChecker(
+            OldConfig('(&(bar=thud)(quux=%(name)s))'))
+        self.assertEquals(checker._identitySearchFilter('foo'),
+                          ldapfilter.parseFilter('(&(bar=thud)(quux=foo))'))
+
+    def testOldConfig_invalid(self):
+        checker = checkers.LDAPBindingChecker(OldConfig('(quux=%(name)s'))
+        d = checker.requestAvatarId(
+            credentials.UsernamePassword('foo', 'secret'))
+        self.failUnless(d.check(error.UnauthorizedLogin))
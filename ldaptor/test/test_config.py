@@ -4,7 +4,7 @@ Test cases for the ldaptor.config module.
 
 from twisted.trial import unittest
 import os
-from ldaptor import config
+from ldaptor import config, ldapfilter
 
 def writeFile(path, content):
     f = file(path, 'w')
@@ -65,3 +65,33 @@ identity-search = (something=%(name)s)
         conf = config.LDAPConfig(identitySearch='(&(bar=thud)(quux=%(name)s))')
         self.assertEquals(conf.getIdentitySearch('foo'),
                           '(&(bar=thud)(quux=foo))')
+
+class IdentitySearchFilter(unittest.TestCase):
+    def setUp(self):
+        self.dir = self.mktemp()
+        os.mkdir(self.dir)
+        self.f1 = os.path.join(self.dir, 'one.cfg')
+        writeFile(self.f1, """\
+[authentication]
+ou = People
+identity-search = (&(ou=%(ou)s)(something=%(name)s)(percent=100%%))
+""")
+        self.cfg = config.loadConfig(
+            configFiles=[self.f1],
+            reload=True)
+        self.config = config.LDAPConfig()
+
+    def testConfig(self):
+        self.assertEquals(self.config.getIdentitySearchFilter('foo'),
+                          ldapfilter.parseFilter(
+            '(&(ou=People)(something=foo)(percent=100%))'))
+
+    def testInitArg(self):
+        conf = config.LDAPConfig(identitySearch='(&(bar=thud)(quux=%(name)s))')
+        self.assertEquals(conf.getIdentitySearchFilter('foo'),
+                          ldapfilter.parseFilter('(&(bar=thud)(quux=foo))'))
+
+    def testLiteralName(self):
+        conf = config.LDAPConfig(identitySearch='(uid=%(name)s)')
+        self.assertEquals(conf.getIdentitySearchFilter('*').asText(),
+                          r'(uid=\2a)')
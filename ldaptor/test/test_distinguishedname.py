@@ -280,6 +280,18 @@ class LDAPDistinguishedName_contains(unittest.TestCase):
         assert not self.c.contains(self.other)
         assert not self.other.contains(self.c)
 
+    def test_case(self):
+        """contains() tells case apart like ==, containsIgnoringCase() not."""
+        upper=dn.DistinguishedName('CN=Host,dc=Sub,dc=example,dc=com')
+        self.failIf(self.sec.contains(upper))
+        self.failIf(self.sec == upper.up())
+        self.failUnless(self.sec.containsIgnoringCase(upper))
+        self.failUnless(self.sec.containsIgnoringCase(self.hsec))
+        self.failUnless(self.sec.containsIgnoringCase(
+            'cn=x,DC=SUB,dc=example,dc=com'))
+        self.failIf(self.sec.containsIgnoringCase(self.ec))
+        self.failIf(self.sec.containsIgnoringCase(self.soc))
+
 class LDAPDistinguishedName_Malformed(unittest.TestCase):
     def testMalformed(self):
         self.assertRaises(dn.InvalidRelativeDistinguishedName,
@@ -327,3 +339,185 @@ class DistinguishedName_Comparison(unittest.TestCase):
         dn1=dn.DistinguishedName('dc=example,dc=com')
         dn2=dn.DistinguishedName('dc=bar,dc=example,dc=com')
         self.failUnless(dn1 > dn2)
+
+class DistinguishedName_Intern(unittest.TestCase):
+    def testSameString(self):
+        d1=dn.DistinguishedName('cn=foo,dc=example,dc=com')
+        d2=dn.DistinguishedName(stringValue='cn=foo,dc=example,dc=com')
+        self.assertIdentical(d1, d2)
+
+    def testDifferentString(self):
+        d1=dn.DistinguishedName('cn=foo,dc=example,dc=com')
+        d2=dn.DistinguishedName('cn=foo, dc=example, dc=com')
+        self.assertNotIdentical(d1, d2)
+        self.assertEquals(d1, d2)
+
+    def testNotFromString(self):
+        d1=dn.DistinguishedName('cn=foo,dc=example,dc=com')
+        d2=dn.DistinguishedName(d1)
+        self.assertNotIdentical(d1, d2)
+        self.assertEquals(d1, d2)
+
+    def testBounded(self):
+        self.patch(dn, '_MAXCACHE', 10)
+        for i in range(25):
+            dn.DistinguishedName('cn=foo%d' % i)
+            self.failUnless(len(dn._cache) <= 10)
+
+    def testSetListOfRDNs(self):
+        d1=dn.DistinguishedName('cn=foo,dc=example,dc=com')
+        self.assertRaises(AttributeError, setattr, d1, 'listOfRDNs',
+                          [dn.RelativeDistinguishedName('cn=bar')])
+        self.assertEquals(str(d1), 'cn=foo,dc=example,dc=com')
+
+        for d2 in [dn.DistinguishedName(d1),
+                   dn.DistinguishedName('dc=example,dc=com').child('cn=foo')]:
+            d2.key()
+            d2.listOfRDNs=[dn.RelativeDistinguishedName('cn=bar')]
+            self.assertEquals(d2, dn.DistinguishedName('cn=bar'))
+            self.assertEquals(d2.key(), dn.DistinguishedName('cn=bar').key())
+            self.assertEquals(d2.up(), dn.DistinguishedName(''))
+
+class DistinguishedName_Parse(unittest.TestCase):
+    def testLong(self):
+        s=','.join(['ou=unit\\,%d' % i for i in range(5000)])
+        d=dn.DistinguishedName(s)
+        self.assertEquals(len(d.split()), 5000)
+        self.assertEquals(d.split()[4999].split()[0].value, 'unit,4999')
+        self.assertEquals(str(d), s)
+
+    def testTrailingSeparator(self):
+        self.assertRaises(dn.InvalidRelativeDistinguishedName,
+                          dn.DistinguishedName,
+                          'cn=foo,')
+        self.assertRaises(dn.InvalidRelativeDistinguishedName,
+                          dn.DistinguishedName,
+                          'cn=foo, ')
+        self.assertRaises(dn.InvalidRelativeDistinguishedName,
+                          dn.RelativeDistinguishedName,
+                          'cn=foo+')
+
+class DistinguishedName_Key(unittest.TestCase):
+    def testCase(self):
+        d1=dn.DistinguishedName('CN=Foo,DC=example,DC=com')
+        d2=dn.DistinguishedName('cn=foo,dc=Example,dc=com')
+        self.assertEquals(d1.key(), d2.key())
+        self.assertNotEquals(d1, d2)
+
+    def testMultiValued(self):
+        r1=dn.RelativeDistinguishedName('cn=foo+sn=bar')
+        r2=dn.RelativeDistinguishedName('SN=bar+cn=foo')
+        self.assertEquals(r1.key(), r2.key())
+
+    def testRootFirst(self):
+        d=dn.DistinguishedName('cn=foo,dc=example,dc=com')
+        self.assertEquals(d.key(), ((('dc', 'com'),),
+                                    (('dc', 'example'),),
+                                    (('cn', 'foo'),)))
+        self.assertEquals(dn.DistinguishedName('').key(), ())
+
+    def testCached(self):
+        d=dn.DistinguishedName('cn=foo,dc=example,dc=com')
+        self.assertIdentical(d.key(), d.key())
+
+    def testContainsIgnoresCase(self):
+        d1=dn.DistinguishedName('DC=Example,dc=com')
+        d2=dn.DistinguishedName('cn=foo,dc=example,DC=COM')
+        self.failUnless(d1.containsIgnoringCase(d2))
+        self.failIf(d2.containsIgnoringCase(d1))
+        self.failIf(d1.contains(d2))
+
+    def testHash(self):
+        d1=dn.DistinguishedName(listOfRDNs=[
+            dn.RelativeDistinguishedName('cn=foo'),
+            dn.RelativeDistinguishedName('dc=com')])
+        d2=dn.DistinguishedName('cn=foo,dc=com')
+        self.assertEquals(hash(d1), hash(d2))
+        self.assertEquals(hash(d1), hash('cn=foo,dc=com'))
+        self.assertEquals({d1: 1}[d2], 1)
+
+class DistinguishedName_Child(unittest.TestCase):
+    def setUp(self):
+        self.parent=dn.DistinguishedName('ou=People,dc=example,dc=com')
+        self.child=self.parent.child('uid=jdoe')
+
+    def testEquals(self):
+        want=dn.DistinguishedName('uid=jdoe,ou=People,dc=example,dc=com')
+        self.assertEquals(self.child, want)
+        self.assertEquals(hash(self.child), hash(want))
+        self.assertEquals(self.child.key(), want.key())
+        self.assertEquals(str(self.child), str(want))
+
+    def testSplit(self):
+        self.assertEquals(self.child.split(),
+                          (dn.RelativeDistinguishedName('uid=jdoe'),)
+                          + self.parent.split())
+        self.assertEquals(self.child.listOfRDNs, self.child.split())
+
+    def testUp(self):
+        self.assertIdentical(self.child.up(), self.parent)
+
+    def testGrandchild(self):
+        grandchild=self.child.child(dn.RelativeDistinguishedName('cn=x'))
+        self.assertEquals(str(grandchild),
+                          'cn=x,uid=jdoe,ou=People,dc=example,dc=com')
+        self.failUnless(self.parent.contains(grandchild))
+        self.failIf(grandchild.contains(self.child))
+
+    def testRoot(self):
+        child=dn.DistinguishedName('').child('dc=com')
+        self.assertEquals(child, dn.DistinguishedName('dc=com'))
+        self.assertEquals(child.up(), dn.DistinguishedName(''))
+
+class DistinguishedName_Str(unittest.TestCase):
+    def testCached(self):
+        d=dn.DistinguishedName(listOfRDNs=[
+            dn.RelativeDistinguishedName('cn=foo\\,bar+uid=x'),
+            dn.RelativeDistinguishedName('dc=example')])
+        s=str(d)
+        self.assertEquals(s, 'cn=foo\\,bar+uid=x,dc=example')
+        self.assertIdentical(str(d), s)
+        rdn=d.split()[0]
+        self.assertIdentical(str(rdn), str(rdn))
+
+    def testLinked(self):
+        parent=dn.DistinguishedName('ou=People,dc=example,dc=com')
+        child=parent.child('uid=jdoe')
+        self.assertEquals(str(child), 'uid=jdoe,ou=People,dc=example,dc=com')
+        self.assertEquals(child.key(), parent.key() + (child.split()[0].key(),))
+        # built from the parent's, not kept in every leaf
+        self.assertIdentical(child._str, None)
+        self.assertIdentical(child._key, None)
+        self.assertIdentical(str(parent), str(parent))
+        # but kept once used for a child
+        grandChild=child.child('cn=x')
+        self.assertEquals(str(grandChild),
+                          'cn=x,uid=jdoe,ou=People,dc=example,dc=com')
+        self.assertEquals(grandChild.key(), dn.DistinguishedName(
+            'CN=X,uid=jdoe,ou=People,dc=example,dc=com').key())
+        self.assertIdentical(str(child), str(child))
+        self.assertIdentical(child.key(), child.key())
+        self.assertIdentical(grandChild._str, None)
+
+    def testEscapeLong(self):
+        s=',+"\\<>;=\x01' * 2000
+        self.assertEquals(dn.unescape(dn.escape(s)), s)
+        self.assertEquals(dn.escape('a\nb'), 'a\\0Ab')
+
+class DistinguishedName_ParseLinked(unittest.TestCase):
+    def testParse(self):
+        s='cn=foo\\,bar+uid=x,ou=People,dc=example,dc=com'
+        d=dn.parseLinked(s)
+        self.assertEquals(d, dn.DistinguishedName(s))
+        self.assertEquals(str(d), s)
+        self.assertIdentical(d.up(),
+                             dn.DistinguishedName('ou=People,dc=example,dc=com'))
+
+    def testSingle(self):
+        self.assertEquals(dn.parseLinked('dc=com'), dn.DistinguishedName('dc=com'))
+        self.assertEquals(dn.parseLinked(''), dn.DistinguishedName(''))
+
+    def testTrailingSeparator(self):
+        self.assertRaises(dn.InvalidRelativeDistinguishedName,
+                          dn.parseLinked,
+                          'cn=foo, ')
@@ -1,12 +1,19 @@
 """
 Test cases for ldaptor.inmemory module.
 """
+import os
+import sys
 from twisted.trial import unittest
+from twisted.internet import defer, error
+from twisted.python.failure import Failure
 from cStringIO import StringIO
-from ldaptor import inmemory, delta, testutil
+from ldaptor import inmemory, delta, ldapfilter, testutil
+from ldaptor.protocols import pureldap
 from ldaptor.protocols.ldap import distinguishedname, ldaperrors
 
-class TestInMemoryDatabase(unittest.TestCase):
+class InMemoryTree(object):
+    """Build the tree of entries the tests run on."""
+
     def setUp(self):
         self.root = inmemory.ReadOnlyInMemoryLDAPEntry(
             dn=distinguishedname.DistinguishedName('dc=example,dc=com'))
@@ -49,6 +56,7 @@ class TestInMemoryDatabase(unittest.TestCase):
             'cn': ['theChild'],
             })
 
+class TestInMemoryDatabase(InMemoryTree, unittest.TestCase):
     def test_children_empty(self):
         d = self.empty.children()
         d.addCallback(self.assertItemsEqual, [])
@@ -125,11 +133,34 @@ class TestInMemoryDatabase(unittest.TestCase):
             'cn': 'foo',
             })
 
+    def test_addChild_ExistsOtherCase(self):
+        self.assertRaises(ldaperrors.LDAPEntryAlreadyExists,
+                          self.meta.addChild,
+                          rdn='CN=FOO',
+                          attributes={
+            'objectClass': ['a'],
+            'cn': 'FOO',
+            })
+        d = self.meta.deleteChild('CN=FOO')
+        def eb(fail):
+            fail.trap(ldaperrors.LDAPNoSuchObject)
+        d.addCallbacks(testutil.mustRaise, eb)
+        d.addCallback(lambda _: self.root.lookup(
+            'cn=foo,ou=metasyntactic,dc=example,dc=com'))
+        d.addCallback(self.assertIdentical, self.foo)
+        return d
+
     def test_parent(self):
         self.assertEquals(self.foo.parent(), self.meta)
         self.assertEquals(self.meta.parent(), self.root)
         self.assertEquals(self.root.parent(), None)
 
+    def test_addChild_linkedDN(self):
+        """Children share the DN of their parent."""
+        self.assertIdentical(self.foo.dn.up(), self.meta.dn)
+        self.assertIdentical(self.meta.dn.up(), self.root.dn)
+        self.assertIdentical(self.foo.dn._parent, self.meta.dn)
+        self.assertIdentical(self.foo.dn._rdns, None)
 
     def test_subtree_empty(self):
         d = self.empty.subtree()
@@ -219,6 +250,32 @@ class TestInMemoryDatabase(unittest.TestCase):
         d.addCallback(self.assertEquals, self.bar)
         return d
 
+    def test_lookup_caseInsensitive(self):
+        d = self.root.lookup('CN=Bar,ou=Metasyntactic,dc=example,dc=com')
+        d.addCallback(self.assertIdentical, self.bar)
+        return d
+
+    def test_lookup_fromChild(self):
+        d = self.meta.lookup('cn=foo,ou=metasyntactic,dc=example,dc=com')
+        d.addCallback(self.assertIdentical, self.foo)
+        return d
+
+    def test_lookup_fromChild_outOfSubtree(self):
+        d = self.meta.lookup('cn=theChild,ou=oneChild,dc=example,dc=com')
+        def eb(fail):
+            fail.trap(ldaperrors.LDAPNoSuchObject)
+        d.addCallbacks(testutil.mustRaise, eb)
+        return d
+
+    def test_lookup_deleted(self):
+        d = self.meta.deleteChild('cn=bar')
+        d.addCallback(lambda _: self.root.lookup(
+            'cn=bar,ou=metasyntactic,dc=example,dc=com'))
+        def eb(fail):
+            fail.trap(ldaperrors.LDAPNoSuchObject)
+        d.addCallbacks(testutil.mustRaise, eb)
+        return d
+
     def test_delete_root(self):
         newRoot = inmemory.ReadOnlyInMemoryLDAPEntry(
             dn=distinguishedname.DistinguishedName('dc=example,dc=com'))
@@ -296,6 +353,31 @@ class TestInMemoryDatabase(unittest.TestCase):
             ])
         return d
 
+    def testSearch_filterCache(self):
+        cache = ldapfilter.FilterCache()
+        self.patch(self.root, 'filterCache', cache)
+        d = self.root.search(filterText='(|(cn=foo)(cn=bar))')
+        d.addCallback(lambda _: self.root.search(
+            filterText='(|(cn=foo)(cn=bar))'))
+        d.addCallback(self.assertItemsEqual, [
+            self.bar,
+            self.foo,
+            ])
+        d.addCallback(lambda _: self.assertEquals(
+            (cache.hits, cache.misses), (2, 2)))
+        return d
+
+    def testSearch_overriddenMatch(self):
+        class Matching(inmemory.ReadOnlyInMemoryLDAPEntry):
+            def match(self, filter):
+                return True
+        entry = Matching(dn='cn=matching,dc=example,dc=com',
+                         attributes={'cn': ['matching']})
+        d = entry.search(filterText='(cn=other)',
+                         scope=pureldap.LDAP_SCOPE_baseObject)
+        d.addCallback(self.assertEquals, [entry])
+        return d
+
     def test_move_noChildren_sameSuperior(self):
         d = self.empty.move('ou=moved,dc=example,dc=com')
         def getChildren(dummy):
@@ -312,6 +394,28 @@ class TestInMemoryDatabase(unittest.TestCase):
             ])
         return d
 
+    def test_move_exists(self):
+        d = self.foo.move('CN=BAR,ou=metasyntactic,dc=example,dc=com')
+        d.addCallbacks(testutil.mustRaise, lambda fail: fail.trap(
+            ldaperrors.LDAPEntryAlreadyExists))
+        d.addCallback(lambda _: self.theChild.move(
+            'cn=bar,ou=metasyntactic,dc=example,dc=com'))
+        d.addCallbacks(testutil.mustRaise, lambda fail: fail.trap(
+            ldaperrors.LDAPEntryAlreadyExists))
+        d.addCallback(lambda _: self.meta.children())
+        d.addCallback(self.assertItemsEqual, [self.foo, self.bar])
+        d.addCallback(lambda _: self.assertEquals(
+            str(self.theChild.dn), 'cn=theChild,ou=oneChild,dc=example,dc=com'))
+        return d
+
+    def test_move_case(self):
+        d = self.foo.move('CN=foo,ou=metasyntactic,dc=example,dc=com')
+        d.addCallback(lambda _: self.meta.children())
+        d.addCallback(self.assertItemsEqual, [self.foo, self.bar])
+        d.addCallback(lambda _: self.assertEquals(
+            str(self.foo.dn), 'CN=foo,ou=metasyntactic,dc=example,dc=com'))
+        return d
+
     def test_move_children_sameSuperior(self):
         d = self.meta.move('ou=moved,dc=example,dc=com')
         def getChildren(dummy):
@@ -373,12 +477,619 @@ class TestInMemoryDatabase(unittest.TestCase):
             ])
         return d
 
+    def test_move_children_lookup(self):
+        d = self.meta.move('ou=moved,ou=oneChild,dc=example,dc=com')
+        d.addCallback(lambda _: self.root.lookup(
+            'cn=foo,ou=moved,ou=oneChild,dc=example,dc=com'))
+        d.addCallback(self.assertIdentical, self.foo)
+        d.addCallback(lambda _: self.assertEquals(
+            self.foo.dn, 'cn=foo,ou=moved,ou=oneChild,dc=example,dc=com'))
+        d.addCallback(lambda _: self.assertIdentical(
+            self.meta.parent(), self.oneChild))
+        d.addCallback(lambda _: self.root.lookup(
+            'cn=foo,ou=metasyntactic,dc=example,dc=com'))
+        def eb(fail):
+            fail.trap(ldaperrors.LDAPNoSuchObject)
+        d.addCallbacks(testutil.mustRaise, eb)
+        return d
+
     def test_commit(self):
         """ReadOnlyInMemoryLDAPEntry.commit() succeeds immediately."""
         self.meta['foo'] = ['bar']
         d = self.meta.commit()
         self.failUnless(d.called)
 
+    def searchChanging(self, change, filterText='(objectClass=a)'):
+        """
+        Search the tree, calling change with the first entry found
+        before going on, and return the entries found.
+        """
+        got = []
+        def callback(e):
+            if not got:
+                change(e)
+            got.append(e)
+        d = self.root.search(filterText=filterText, callback=callback)
+        def cb(_):
+            # no searches pin older versions of the entries any more
+            self.assertEquals(
+                [e for e in self.root._walk() if e._old is not None], [])
+            self.assertEquals(self.root._versions._saved, [])
+            return got
+        d.addCallback(cb)
+        return d
+
+    searchable = [
+        'ou=metasyntactic,dc=example,dc=com',
+        'cn=foo,ou=metasyntactic,dc=example,dc=com',
+        'cn=bar,ou=metasyntactic,dc=example,dc=com',
+        'ou=empty,dc=example,dc=com',
+        'ou=oneChild,dc=example,dc=com',
+        'cn=theChild,ou=oneChild,dc=example,dc=com',
+        ]
+
+    def testSearch_whileAdding(self):
+        def change(first):
+            self.meta.addChild('cn=new', {'objectClass': ['a'],
+                                          'cn': ['new']})
+        d = self.searchChanging(change)
+        d.addCallback(lambda got: [str(e.dn) for e in got])
+        d.addCallback(self.assertItemsEqual, self.searchable)
+        d.addCallback(lambda _: self.root.search(filterText='(cn=new)'))
+        d.addCallback(lambda got: [str(e.dn) for e in got])
+        d.addCallback(self.assertEquals,
+                      ['cn=new,ou=metasyntactic,dc=example,dc=com'])
+        return d
+
+    def testSearch_whileDeleting(self):
+        def change(first):
+            self.oneChild.deleteChild('cn=theChild')
+        d = self.searchChanging(change)
+        d.addCallback(lambda got: [str(e.dn) for e in got])
+        d.addCallback(self.assertItemsEqual, self.searchable)
+        d.addCallback(lambda _: self.root.search(filterText='(cn=theChild)'))
+        d.addCallback(self.assertEquals, [])
+        return d
+
+    def testSearch_whileModifying(self):
+        changed = []
+        def change(first):
+            e = [e for e in [self.foo, self.bar] if e.dn != first.dn][0]
+            e['cn'].add('changed')
+            e['sn'] = ['changed']
+            e.commit()
+            changed.append(e)
+        d = self.searchChanging(change)
+        def cb(got):
+            self.assertEquals(sorted([v for e in got
+                                      for v in e.get('cn', ())]),
+                              ['bar', 'foo', 'theChild'])
+            self.assertEquals([e for e in got if 'sn' in e], [])
+            self.assertEquals(len(changed[0]['cn']), 2)
+            self.assertEquals(changed[0]['sn'], ['changed'])
+        d.addCallback(cb)
+        return d
+
+    def testSearch_whileMoving(self):
+        # the entry passed to the callback, found before the change,
+        # is not one that moves
+        def change(first):
+            if first.dn != self.theChild.dn:
+                self.theChild.move('cn=moved,ou=empty,dc=example,dc=com')
+            else:
+                self.meta.move('ou=moved,dc=example,dc=com')
+        d = self.searchChanging(change)
+        d.addCallback(lambda got: [str(e.dn) for e in got])
+        d.addCallback(self.assertItemsEqual, self.searchable)
+        return d
+
+    def testSearch_nested(self):
+        inner = []
+        def change(first):
+            self.meta.addChild('cn=new', {'objectClass': ['a'],
+                                          'cn': ['new']})
+            self.root.search(filterText='(cn=new)', callback=inner.append)
+        d = self.searchChanging(change)
+        d.addCallback(lambda _: [str(e.dn) for e in inner])
+        d.addCallback(self.assertEquals,
+                      ['cn=new,ou=metasyntactic,dc=example,dc=com'])
+        return d
+
+    def testSearch_reading(self):
+        """Reading entries while searching does not copy them."""
+        substrings = ldapfilter.parseFilter('(objectClass=*a*)')
+        def callback(e):
+            e['objectClass']
+            e.get('cn')
+            e.match(substrings)
+            e.items()
+            str(e)
+            self.assertIdentical(e._old, None)
+            self.assertEquals(self.root._versions._saved, [])
+        d = self.root.search(filterText='(|(cn=*o*)(ou=*))', callback=callback)
+        return d
+
+    def testSearch_changingValues(self):
+        """Values changed in place while searching are not seen by it."""
+        got = []
+        changed = []
+        def callback(e):
+            # the callback does see its own changes to the entry it
+            # was passed, so change theChild while passed another one
+            if not changed and e.dn != self.theChild.dn:
+                values = self.theChild['cn']
+                values.add('new')
+                values.remove('theChild')
+                values.add('newer')
+                changed.append(e)
+            got.append((str(e.dn), sorted(e.get('cn', ()))))
+        d = self.root.search(filterText='(objectClass=a)', callback=callback)
+        def cb(_):
+            self.assertIn(('cn=theChild,ou=oneChild,dc=example,dc=com',
+                           ['theChild']), got)
+            self.assertEquals(sorted(self.theChild['cn']), ['new', 'newer'])
+        d.addCallback(cb)
+        return d
+
+    def test_change_notSearching(self):
+        """Changes made while no search runs are made in place."""
+        d = self.root.search(filterText='(cn=foo)')
+        def cb(_):
+            attributes = self.foo._attributes
+            self.foo['cn'] = ['changed']
+            self.foo.commit()
+            self.assertIdentical(self.foo._attributes, attributes)
+            self.assertIdentical(self.foo._old, None)
+        d.addCallback(cb)
+        return d
+
+class TestInMemoryDatabase_Indexed(InMemoryTree, unittest.TestCase):
+    def setUp(self):
+        InMemoryTree.setUp(self)
+        self.root.addIndex('cn')
+        self.theChild.addIndex('objectClass')
+        self.meta.addIndex('cn', 'substring')
+
+    def search(self, filterText, base=None, **kw):
+        if base is None:
+            base = self.root
+        filterObject = ldapfilter.parseFilter(filterText)
+        self.failIfIdentical(base._plan(filterObject), None)
+        return base.search(filterObject=filterObject, **kw)
+
+    def testSearch_equality(self):
+        d = self.search('(CN=Foo)')
+        d.addCallback(self.assertItemsEqual, [self.foo])
+        return d
+
+    def testSearch_and(self):
+        d = self.search('(&(cn=foo)(ou=*))')
+        d.addCallback(self.assertItemsEqual, [])
+        d.addCallback(lambda _: self.search('(&(objectClass=a)(!(cn=foo)))'))
+        d.addCallback(self.assertItemsEqual, [
+            self.meta,
+            self.bar,
+            self.empty,
+            self.oneChild,
+            self.theChild,
+            ])
+        return d
+
+    def assertPlan(self, filterText, entries):
+        plan = self.root._plan(ldapfilter.parseFilter(filterText))
+        self.assertItemsEqual(plan.values(), entries)
+
+    def test_plan(self):
+        self.assertPlan('(cn=foo)', [self.foo])
+        self.assertPlan('(cn=nomatch)', [])
+        self.assertPlan('(objectClass=a)', [
+            self.meta, self.foo, self.bar, self.empty, self.oneChild,
+            self.theChild])
+        self.assertPlan('(|(cn=foo)(cn=b*))', [self.foo, self.bar])
+        # members that are not indexed do not narrow an AND down
+        self.assertPlan('(&(cn=foo)(ou=*))', [self.foo])
+        self.assertPlan('(&(objectClass=a)(cn=ba*)(!(cn=foo)))',
+                        [self.bar])
+        for filterText in ['(ou=empty)',
+                           '(!(cn=foo))',
+                           '(cn=*)',
+                           '(|(cn=foo)(ou=empty))',
+                           '(&(ou=empty)(!(cn=foo)))',
+                           '(uidNumber>=10)']:
+            self.assertIdentical(
+                self.root._plan(ldapfilter.parseFilter(filterText)), None)
+
+    def test_plan_range(self):
+        numbered = self.addNumbered()
+        self.assertPlan('(uidNumber>=10)', [numbered['10'], numbered['100']])
+        self.assertPlan('(&(uidNumber>=9)(uidNumber<=10)(cn=foo))', [])
+        self.assertPlan('(&(uidNumber>=9)(uidNumber<=10)(objectClass=a))',
+                        [])
+        self.assertPlan('(&(uidNumber>=9)(uidNumber<=10))',
+                        [numbered['9'], numbered['10']])
+
+    def testSearch_whileChanging(self):
+        """Indexed searches see the tree as it was when they started."""
+        got = []
+        def callback(e):
+            got.append(str(e.dn))
+            if len(got) == 1:
+                self.meta.deleteChild('cn=bar')
+                self.theChild.move('cn=moved,ou=empty,dc=example,dc=com')
+                self.empty.addChild('cn=new', {'cn': ['new']})
+        d = self.root.search(filterText='(|(cn=foo)(cn=bar)(cn=theChild)'
+                                        '(cn=moved)(cn=new))',
+                             callback=callback)
+        d.addCallback(lambda _: self.assertItemsEqual(got, [
+            'cn=foo,ou=metasyntactic,dc=example,dc=com',
+            'cn=bar,ou=metasyntactic,dc=example,dc=com',
+            'cn=theChild,ou=oneChild,dc=example,dc=com',
+            ]))
+        d.addCallback(lambda _: self.search('(|(cn=bar)(cn=moved)(cn=new))'))
+        d.addCallback(self.assertItemsEqual, [self.theChild,
+                                              self.empty._get(
+            distinguishedname.DistinguishedName(
+            'cn=new,ou=empty,dc=example,dc=com').key())])
+        return d
+
+    def testSearch_notInTree(self):
+        """Entries the indexes know of but the tree not are not found."""
+        del self.meta._children['cn=bar']
+        d = self.search('(cn=bar)')
+        d.addCallback(self.assertItemsEqual, [])
+        d.addCallback(lambda _: self.search('(cn=bar)', base=self.meta))
+        d.addCallback(self.assertItemsEqual, [])
+        d.addCallback(lambda _: self.search(
+            '(cn=bar)', base=self.meta,
+            scope=pureldap.LDAP_SCOPE_singleLevel))
+        d.addCallback(self.assertItemsEqual, [])
+        return d
+
+    def testSearch_orNotIndexed(self):
+        filterObject = ldapfilter.parseFilter('(|(cn=foo)(ou=empty))')
+        self.assertIdentical(self.root._plan(filterObject), None)
+        d = self.root.search(filterObject=filterObject)
+        d.addCallback(self.assertItemsEqual, [self.foo, self.empty])
+        return d
+
+    def testSearch_scope(self):
+        d = self.search('(objectClass=a)', base=self.meta,
+                        scope=pureldap.LDAP_SCOPE_singleLevel)
+        d.addCallback(self.assertItemsEqual, [self.foo, self.bar])
+        d.addCallback(lambda _: self.search('(|(cn=foo)(cn=theChild))',
+                                            base=self.oneChild))
+        d.addCallback(self.assertItemsEqual, [self.theChild])
+        return d
+
+    def testSearch_addChild(self):
+        baz = self.meta.addChild(rdn='cn=baz', attributes={'cn': ['baz']})
+        d = self.search('(cn=baz)')
+        d.addCallback(self.assertItemsEqual, [baz])
+        return d
+
+    def testSearch_deleted(self):
+        d = self.meta.deleteChild('cn=bar')
+        d.addCallback(lambda _: self.search('(cn=bar)'))
+        d.addCallback(self.assertItemsEqual, [])
+        return d
+
+    def testSearch_moved(self):
+        d = self.theChild.move('cn=moved,ou=metasyntactic,dc=example,dc=com')
+        d.addCallback(lambda _: self.search('(cn=moved)', base=self.meta))
+        d.addCallback(self.assertItemsEqual, [self.theChild])
+        d.addCallback(lambda _: self.search('(cn=theChild)'))
+        d.addCallback(self.assertItemsEqual, [])
+        return d
+
+    def testSearch_commit(self):
+        self.foo['cn'] = ['quux']
+        d = self.foo.commit()
+        d.addCallback(lambda _: self.search('(cn=quux)'))
+        d.addCallback(self.assertItemsEqual, [self.foo])
+        d.addCallback(lambda _: self.search('(cn=foo)'))
+        d.addCallback(self.assertItemsEqual, [])
+        return d
+
+    def testSearch_substrings(self):
+        d = self.search('(cn=F*)')
+        d.addCallback(self.assertItemsEqual, [self.foo])
+        d.addCallback(lambda _: self.search('(cn=*r)'))
+        d.addCallback(self.assertItemsEqual, [self.bar])
+        d.addCallback(lambda _: self.search('(cn=*heCh*)'))
+        d.addCallback(self.assertItemsEqual, [self.theChild])
+        d.addCallback(lambda _: self.search('(cn=b*a*r)'))
+        d.addCallback(self.assertItemsEqual, [self.bar])
+        d.addCallback(lambda _: self.search('(cn=*oo*f)'))
+        d.addCallback(self.assertItemsEqual, [])
+        return d
+
+    def testSearch_substrings_and(self):
+        d = self.search('(&(cn=*o*)(cn=fo*))')
+        d.addCallback(self.assertItemsEqual, [self.foo])
+        return d
+
+    def testSearch_substrings_tooShort(self):
+        filterObject = ldapfilter.parseFilter('(cn=*o*)')
+        self.assertIdentical(self.root._plan(filterObject), None)
+        d = self.root.search(filterObject=filterObject)
+        d.addCallback(self.assertItemsEqual, [self.foo])
+        return d
+
+    def addNumbered(self):
+        self.root.addIndex('uidNumber', 'range')
+        numbered = {}
+        for uidNumber in ['9', '10', '100', 'x']:
+            numbered[uidNumber] = self.empty.addChild(
+                rdn='uid=u%s' % uidNumber,
+                attributes={'uidNumber': [uidNumber]})
+        return numbered
+
+    def testSearch_range(self):
+        numbered = self.addNumbered()
+        d = self.search('(uidNumber>=10)')
+        d.addCallback(self.assertItemsEqual,
+                      [numbered['10'], numbered['100']])
+        d.addCallback(lambda _: self.search(
+            '(&(uidNumber<=10)(cn=*)(uidNumber>=9)(uidNumber<=50))'))
+        d.addCallback(self.assertItemsEqual, [])
+        d.addCallback(lambda _: self.search(
+            '(&(uidNumber<=10)(uidNumber>=9)(uidNumber<=50))'))
+        d.addCallback(self.assertItemsEqual,
+                      [numbered['9'], numbered['10']])
+        d.addCallback(lambda _: self.search('(uidNumber<=x)'))
+        d.addCallback(self.assertItemsEqual, [])
+        return d
+
+    def testSearch_range_commit(self):
+        numbered = self.addNumbered()
+        numbered['x']['uidNumber'] = ['50']
+        d = numbered['x'].commit()
+        d.addCallback(lambda _: numbered['100'].delete())
+        d.addCallback(lambda _: self.search('(uidNumber>=10)'))
+        d.addCallback(self.assertItemsEqual,
+                      [numbered['10'], numbered['x']])
+        return d
+
+    def testSearch_range_multiValued(self):
+        numbered = self.addNumbered()
+        numbered['x']['uidNumber'] = ['1', '1000']
+        d = numbered['x'].commit()
+        d.addCallback(lambda _: self.search(
+            '(&(uidNumber<=5)(uidNumber>=500))'))
+        d.addCallback(self.assertItemsEqual, [numbered['x']])
+        return d
+
+    def testSearch_deletedCommitted(self):
+        d = self.foo.delete()
+        def cb(_):
+            self.foo['cn'] = ['bar']
+            return self.foo.commit()
+        d.addCallback(cb)
+        d.addCallback(lambda _: self.search('(cn=bar)'))
+        d.addCallback(self.assertItemsEqual, [self.bar])
+        return d
+
+    def test_removeIndex(self):
+        self.root.removeIndex('CN')
+        self.assertIdentical(
+            self.root._plan(ldapfilter.parseFilter('(cn=foo)')), None)
+        self.assertRaises(KeyError, self.root.removeIndex, 'cn')
+        self.root.removeIndex('cn', 'substring')
+        self.assertIdentical(
+            self.root._plan(ldapfilter.parseFilter('(cn=foo*)')), None)
+
+
+class TestSnapshot(InMemoryTree, unittest.TestCase):
+    entries = ['root', 'meta', 'foo', 'bar', 'empty', 'oneChild', 'theChild']
+
+    def setUp(self):
+        InMemoryTree.setUp(self)
+        return self.reload()
+
+    def snapshot(self, db):
+        path = self.mktemp()
+        f = open(path, 'wb')
+        inmemory.toSnapshotFile(db, f)
+        f.close()
+        return path
+
+    def reload(self):
+        """Replace the entries of the test with those of a snapshot."""
+        d = inmemory.fromSnapshotFile(self.snapshot(self.root))
+        def cb(root):
+            self.addCleanup(root.close)
+            for name in self.entries:
+                e = getattr(self, name)
+                setattr(self, name, root._get(e.dn.key()))
+        d.addCallback(cb)
+        return d
+
+    def test_lazy(self):
+        self.assertIdentical(self.foo._decoded, None)
+        self.assertEquals(self.foo['cn'], ['foo'])
+        self.failIfIdentical(self.foo._decoded, None)
+        self.assertIdentical(self.bar._decoded, None)
+
+    def test_change(self):
+        self.foo['sn'] = ['foo']
+        self.assertEquals(self.foo['cn'], ['foo'])
+        self.foo['cn'].add('quux')
+        d = self.foo.commit()
+        d.addCallback(lambda _: self.meta.deleteChild('cn=bar'))
+        d.addCallback(lambda _: self.theChild.move(
+            'cn=theChild,ou=empty,dc=example,dc=com'))
+        d.addCallback(lambda _: self.root.search(filterText='(cn=*)'))
+        d.addCallback(lambda got: [(str(e.dn), sorted(e['cn'])) for e in got])
+        d.addCallback(self.assertItemsEqual, [
+            ('cn=foo,ou=metasyntactic,dc=example,dc=com', ['foo', 'quux']),
+            ('cn=theChild,ou=empty,dc=example,dc=com', ['theChild']),
+            ])
+        d.addCallback(lambda _: self.assertEquals(self.foo['sn'], ['foo']))
+        return d
+
+    def test_indexes(self):
+        self.root.addIndex('cn')
+        self.root.addIndex('cn', 'substring')
+        self.root.addIndex('uidNumber', 'range')
+        self.foo['uidNumber'] = ['10']
+        self.foo.commit()
+        d = self.reload()
+        def cb(_):
+            self.assertItemsEqual(self.root._attributeIndexes.keys(), [
+                ('equality', 'cn'),
+                ('range', 'uidnumber'),
+                ('substring', 'cn'),
+                ])
+            for filterText, entries in [
+                ('(cn=bar)', [self.bar]),
+                ('(cn=*heCh*)', [self.theChild]),
+                ('(uidNumber>=9)', [self.foo]),
+                ]:
+                plan = self.root._plan(ldapfilter.parseFilter(filterText))
+                self.assertItemsEqual(plan.values(), entries)
+            # loading the indexes does not decode the entries
+            for e in self.root._walk():
+                self.assertIdentical(e._decoded, None)
+            self.bar['cn'] = ['baz']
+            return self.bar.commit()
+        d.addCallback(cb)
+        d.addCallback(lambda _: self.root.search(filterText='(cn=baz)'))
+        d.addCallback(self.assertItemsEqual, [self.bar])
+        return d
+
+    def test_sameTree(self):
+        before = [str(e) for e in self.root._walk()]
+        d = self.reload()
+        d.addCallback(lambda _: [str(e) for e in self.root._walk()])
+        d.addCallback(self.assertItemsEqual, before)
+        return d
+
+    def test_subtree(self):
+        d = inmemory.fromSnapshotFile(self.snapshot(self.meta))
+        def cb(db):
+            self.assertEquals(db.dn, self.meta.dn)
+            self.assertEquals(db['ou'], ['metasyntactic'])
+            return db.lookup('cn=foo,ou=metasyntactic,dc=example,dc=com')
+        d.addCallback(cb)
+        d.addCallback(lambda e: self.assertEquals(e['cn'], ['foo']))
+        return d
+
+    def test_values(self):
+        self.foo['description'] = [u'\xe5', 42]
+        self.foo.commit()
+        d = self.reload()
+        d.addCallback(lambda _: self.foo['description'])
+        d.addCallback(self.assertItemsEqual, ['\xc3\xa5', '42'])
+        return d
+
+    def test_escapedRDN(self):
+        self.meta.addChild('cn=a\\,b+sn=c', {'cn': ['a,b'], 'sn': ['c']})
+        d = self.reload()
+        d.addCallback(lambda _: self.meta.lookup(
+            'sn=c+cn=a\\,b,ou=metasyntactic,dc=example,dc=com'))
+        d.addCallback(lambda e: self.assertEquals(
+            str(e.dn), 'cn=a\\,b+sn=c,ou=metasyntactic,dc=example,dc=com'))
+        d.addCallback(lambda _: self.meta.deleteChild('cn=a\\,b+sn=c'))
+        return d
+
+    def test_notSnapshot(self):
+        l = []
+        for data in ['', 'dn: dc=example,dc=com\n\n']:
+            path = self.mktemp()
+            f = open(path, 'wb')
+            f.write(data)
+            f.close()
+            l.append(self.assertInvalid(path, None))
+        return defer.gatherResults(l)
+
+    def rewrite(self, path, **header):
+        """Change the fields named in header in the snapshot at path."""
+        f = open(path, 'r+b')
+        fields = inmemory._snapshotHeader.unpack(
+            f.read(inmemory._snapshotHeader.size))
+        names = ['magic', 'version', 'marshalVersion', 'pythonVersion',
+                 'count', 'dataOffset', 'tableOffset', 'namesOffset',
+                 'indexesOffset']
+        fields = [header.get(name, value)
+                  for name, value in zip(names, fields)]
+        f.seek(0)
+        f.write(inmemory._snapshotHeader.pack(*fields))
+        f.close()
+
+    def assertInvalid(self, path, reason):
+        d = self.assertFailure(inmemory.fromSnapshotFile(path),
+                               inmemory.InvalidSnapshotError)
+        d.addCallback(lambda e: self.assertEquals(e.reason, reason))
+        return d
+
+    def test_otherVersion(self):
+        l = []
+        for header, reason in [
+            ({'version': 1}, 'format version 1, not 2'),
+            ({'pythonVersion': 0x0302},
+             'written with marshal version %d by Python 3.2'
+             % inmemory.marshal.version),
+            ({'marshalVersion': 42},
+             'written with marshal version 42 by Python %d.%d'
+             % sys.version_info[:2]),
+            ]:
+            path = self.snapshot(self.root)
+            self.rewrite(path, **header)
+            l.append(self.assertInvalid(path, reason))
+        return defer.gatherResults(l)
+
+    def test_damaged(self):
+        l = []
+        path = self.snapshot(self.root)
+        self.rewrite(path, count=3)
+        l.append(self.assertInvalid(path, 'damaged header'))
+
+        data = open(self.snapshot(self.root), 'rb').read()
+        for length, reason in [(len(data) // 2, 'damaged header'),
+                               (len(data) - 1, 'damaged data')]:
+            path = self.mktemp()
+            f = open(path, 'wb')
+            f.write(data[:length])
+            f.close()
+            l.append(self.assertInvalid(path, reason))
+
+        path = self.snapshot(self.root)
+        self.rewrite(path, dataOffset=inmemory._snapshotHeader.size + 1)
+        l.append(self.assertInvalid(path, 'damaged data'))
+        return defer.gatherResults(l)
+
+    def openFiles(self):
+        return len(os.listdir('/proc/self/fd'))
+
+    def test_close(self):
+        if not os.path.isdir('/proc/self/fd'):
+            raise unittest.SkipTest('Cannot count open files.')
+        path = self.snapshot(self.root)
+        before = self.openFiles()
+        d = inmemory.fromSnapshotFile(path)
+        def cb(db):
+            self.assertEquals(self.openFiles(), before + 1)
+            db.close()
+            self.assertEquals(self.openFiles(), before)
+            for e in db._walk():
+                self.failIfIdentical(e._decoded, None)
+            e = db._get(self.foo.dn.key())
+            self.assertEquals(e['cn'], ['foo'])
+            db.close()
+        d.addCallback(cb)
+        return d
+
+    def test_closeInvalid(self):
+        if not os.path.isdir('/proc/self/fd'):
+            raise unittest.SkipTest('Cannot count open files.')
+        path = self.snapshot(self.root)
+        self.rewrite(path, dataOffset=inmemory._snapshotHeader.size + 1)
+        before = self.openFiles()
+        d = self.assertInvalid(path, 'damaged data')
+        d.addCallback(lambda _: self.assertEquals(self.openFiles(), before))
+        return d
+
+
 class FromLDIF(unittest.TestCase):
     def test_single(self):
         ldif = StringIO('''\
@@ -450,6 +1161,149 @@ cn: foo
         return d
 
 
+class FromLDIF_Bulk(unittest.TestCase):
+    people = """\
+dn: dc=example,dc=com
+objectclass: dcObject
+dc: example
+
+dn: cn=foo,dc=example,dc=com
+objectClass: a
+cn: foo
+
+dn: cn=bar,dc=example,dc=com
+objectClass: a
+cn: bar
+
+"""
+
+    def test_sameTree(self):
+        d = inmemory.fromLDIFFile(StringIO(self.people))
+        def cb1(db):
+            d = inmemory.fromLDIFFile(StringIO(self.people), bulk=True)
+            d.addCallback(lambda bulk: bulk.diffTree(db))
+            return d
+        d.addCallback(cb1)
+        d.addCallback(self.assertEquals, [])
+        return d
+
+    def test_lookup(self):
+        d = inmemory.fromLDIFFile(StringIO(self.people), bulk=True)
+        d.addCallback(lambda db: db.lookup('cn=bar,dc=example,dc=com'))
+        def cb(e):
+            self.assertEquals(e['cn'], ['bar'])
+            self.assertEquals(e.parent().dn, 'dc=example,dc=com')
+        d.addCallback(cb)
+        return d
+
+    def test_progress(self):
+        got = []
+        self.patch(inmemory.BulkInMemoryLDIFProtocol, 'progressInterval', 2)
+        d = inmemory.fromLDIFFile(StringIO(self.people), bulk=True,
+                                  progress=got.append)
+        d.addCallback(lambda _: self.assertEquals(got, [2, 3]))
+        return d
+
+    def test_duplicate(self):
+        ldif = StringIO(self.people + """\
+dn: CN=FOO,dc=example,dc=com
+objectClass: a
+cn: foo
+
+dn: cn=baz,dc=example,dc=com
+cn: baz
+
+""")
+        d = inmemory.fromLDIFFile(ldif, bulk=True)
+        def eb(fail):
+            fail.trap(ldaperrors.LDAPEntryAlreadyExists)
+            self.assertEquals(str(fail.value),
+                              'entryAlreadyExists: cn=foo,dc=example,dc=com')
+        d.addCallbacks(testutil.mustRaise, eb)
+        return d
+
+    def test_missingNode(self):
+        ldif = StringIO(self.people + """\
+dn: cn=x,ou=missing,dc=example,dc=com
+cn: x
+
+""")
+        d = inmemory.fromLDIFFile(ldif, bulk=True)
+        def eb(fail):
+            fail.trap(ldaperrors.LDAPNoSuchObject)
+            self.assertEquals(str(fail.value),
+                              'noSuchObject: ou=missing,dc=example,dc=com')
+        d.addCallbacks(testutil.mustRaise, eb)
+        return d
+
+    def test_addFailed_skip(self):
+        skipped = []
+        class Skipping(inmemory.BulkInMemoryLDIFProtocol):
+            def addFailed(self, reason, entry):
+                reason.trap(ldaperrors.LDAPEntryAlreadyExists)
+                skipped.append(str(entry.dn))
+                return None
+        p = Skipping()
+        p.dataReceived(self.people + """\
+dn: cn=foo,dc=example,dc=com
+cn: foo
+
+dn: cn=baz,dc=example,dc=com
+cn: baz
+
+""")
+        p.connectionLost(Failure(error.ConnectionDone()))
+        self.assertEquals(skipped, ['cn=foo,dc=example,dc=com'])
+        self.assertEquals(p.count, 4)
+        d = p.completed
+        d.addCallback(lambda db: db.subtree())
+        d.addCallback(lambda entries: self.assertEquals(
+            sorted([str(e.dn) for e in entries]),
+            ['cn=bar,dc=example,dc=com',
+             'cn=baz,dc=example,dc=com',
+             'cn=foo,dc=example,dc=com',
+             'dc=example,dc=com']))
+        return d
+
+    def test_addFailed_error(self):
+        """Errors other than LDAP ones are passed to addFailed too."""
+        def _adopt(self, rdn, e):
+            raise RuntimeError('oops')
+        self.patch(inmemory.ReadOnlyInMemoryLDAPEntry, '_adopt', _adopt)
+        d = inmemory.fromLDIFFile(StringIO(self.people), bulk=True)
+        def eb(fail):
+            fail.trap(RuntimeError)
+        d.addCallbacks(testutil.mustRaise, eb)
+        return d
+
+    def test_connectionLost(self):
+        p = inmemory.BulkInMemoryLDIFProtocol()
+        p.dataReceived(self.people)
+        p.connectionLost(Failure(error.ConnectionLost()))
+        d = p.completed
+        def eb(fail):
+            fail.trap(error.ConnectionLost)
+        d.addCallbacks(testutil.mustRaise, eb)
+        return d
+
+    def test_lookupFailed_skip(self):
+        class Skipping(inmemory.BulkInMemoryLDIFProtocol):
+            def lookupFailed(self, reason, entry):
+                reason.trap(ldaperrors.LDAPNoSuchObject)
+                return None
+        p = Skipping()
+        p.dataReceived(self.people + """\
+dn: cn=x,ou=missing,dc=example,dc=com
+cn: x
+
+""")
+        p.connectionLost(Failure(error.ConnectionDone()))
+        d = p.completed
+        d.addCallback(lambda db: db.subtree())
+        d.addCallback(lambda entries: self.assertEquals(len(entries), 3))
+        return d
+
+
 class TestDiff(unittest.TestCase):
     def testNoChange(self):
         a = inmemory.ReadOnlyInMemoryLDAPEntry('dc=example,dc=com',
@@ -6,6 +6,7 @@ from twisted.trial import unittest
 from twisted.test import proto_helpers
 from twisted.internet import defer
 
+from ldaptor.protocols import pureber, pureldap
 from ldaptor.protocols.ldap import ldapclient
 from ldaptor import testutil
 
@@ -34,3 +35,32 @@ class ConnectionLost(unittest.TestCase):
         d2.addCallbacks(testutil.mustRaise, eb)
         
         return defer.DeferredList([d1, d2], fireOnOneErrback=True)
+
+class DataReceived(unittest.TestCase):
+    def test_split(self):
+        c = ldapclient.LDAPClient()
+        c.makeConnection(proto_helpers.StringTransport())
+        handled = []
+        c.handle = handled.append
+        data = (str(pureldap.LDAPMessage(id=1,
+                                         value=pureldap.LDAPUnbindRequest()))
+                + str(pureldap.LDAPMessage(id=2,
+                                           value=pureldap.LDAPDelRequest(
+            entry='cn=foo'))))
+        for i in xrange(0, len(data), 3):
+            c.dataReceived(data[i:i+3])
+        self.assertEquals([o.id for o in handled], [1, 2])
+
+    def test_notEncoded(self):
+        """Received messages are handled without encoding them again."""
+        def notEncoded(self):
+            raise AssertionError('encoded %r' % self)
+        c = ldapclient.LDAPClient()
+        c.makeConnection(proto_helpers.StringTransport())
+        handled = []
+        c.handle = handled.append
+        data = str(pureldap.LDAPMessage(id=1,
+                                        value=pureldap.LDAPUnbindRequest()))
+        self.patch(pureber.BERBase, '__len__', notEncoded)
+        c.dataReceived(data)
+        self.assertEquals(len(handled), 1)
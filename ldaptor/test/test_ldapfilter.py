@@ -5,6 +5,7 @@ Test cases for ldaptor.protocols.ldap.ldapfilter module.
 from twisted.trial import unittest
 from ldaptor.protocols import pureldap
 from ldaptor import ldapfilter
+from ldaptor.test import pyparsingfilter
 import types
 
 def s(*l):
@@ -411,6 +412,11 @@ class TestInvalid(unittest.TestCase):
                           ldapfilter.parseFilter,
                           r'(cn =foo)')
 
+    def test_nestedTooDeeply(self):
+        self.assertRaises(ldapfilter.InvalidLDAPFilter,
+                          ldapfilter.parseFilter,
+                          '(!' * 5000 + '(cn=foo)' + ')' * 5000)
+
 class TestMaybeSubstring(unittest.TestCase):
     def test_item_present(self):
         text = r'*'
@@ -537,3 +543,211 @@ class TestWhitespace(unittest.TestCase):
         self.assertRaises(ldapfilter.InvalidLDAPFilter,
                           ldapfilter.parseFilter,
                           r'(cn=\ 61)')
+
+class TestPyparsingCompatibility(unittest.TestCase):
+    """
+    The hand-written parser agrees with the pyparsing grammar.
+    """
+
+    valid = [
+        '(cn=Babs Jensen)',
+        '(cn==x)',
+        '(cn=\\2ab)',
+        '(cn=*)',
+        '(cn=a*b*c)',
+        '(cn=*a* *)',
+        '(cn~=x)',
+        '(cn>=x)',
+        '(cn<=x)',
+        '(cn:=x)',
+        '(cn:dn:=x)',
+        '(cn:caseExact:=x)',
+        '(cn:dn:1.2.3:=x)',
+        '(:dn:1.2:=x)',
+        '(:1.2:=x)',
+        '(&(a=b)(|(c=d)(!(e=*f))))',
+        ]
+
+    invalid = [
+        '',
+        '(cn=)',
+        '(cn=**)',
+        '(cn=a**)',
+        '(cn:=x*)',
+        '(cn:1.2.:=x)',
+        '(:dn:=x)',
+        '(cn=\\zz)',
+        '(cn~x)',
+        '(&)',
+        '(!(a=b)(c=d))',
+        '(&(a=b) (c=d))',
+        '(a=b)(c=d)',
+        ]
+
+    maybeSubstring = [
+        'foo',
+        ' foo',
+        'f(o)o',
+        '*',
+        ' *',
+        'a*  *',
+        '* *',
+        'a*b(*',
+        ]
+
+    def test_valid(self):
+        for text in self.valid:
+            self.assertEquals(ldapfilter.parseFilter(text),
+                              pyparsingfilter.parseFilter(text))
+
+    def test_invalid(self):
+        for text in self.invalid:
+            self.assertRaises(ldapfilter.InvalidLDAPFilter,
+                              pyparsingfilter.parseFilter, text)
+            self.assertRaises(ldapfilter.InvalidLDAPFilter,
+                              ldapfilter.parseFilter, text)
+
+    def test_maybeSubstring(self):
+        for text in self.maybeSubstring:
+            self.assertEquals(
+                ldapfilter.parseMaybeSubstring('cn', text),
+                pyparsingfilter.parseMaybeSubstring('cn', text))
+
+class TestCanonicalKey(unittest.TestCase):
+    def key(self, text):
+        return ldapfilter.canonicalKey(ldapfilter.parseFilter(text))
+
+    def test_orderAndDuplicates(self):
+        self.assertEquals(self.key('(&(a=1)(|(b=2)(c=3))(a=1))'),
+                          self.key('(&(|(c=3)(b=2))(a=1))'))
+
+    def test_attributeCase(self):
+        self.assertEquals(self.key('(&(CN=x)(Mail=*)(sn=a*b))'),
+                          self.key('(&(cn=x)(mail=*)(SN=a*b))'))
+
+    def test_valueCase(self):
+        self.assertNotEquals(self.key('(cn=x)'), self.key('(cn=X)'))
+
+    def test_filterType(self):
+        self.assertNotEquals(self.key('(cn>=x)'), self.key('(cn<=x)'))
+        self.assertNotEquals(self.key('(&(a=1)(b=2))'),
+                             self.key('(|(a=1)(b=2))'))
+
+    def test_substringsOrder(self):
+        self.assertNotEquals(self.key('(cn=*a*b*)'), self.key('(cn=*b*a*)'))
+
+    def test_extensible(self):
+        self.assertEquals(self.key('(CN:dn:1.2:=x)'),
+                          self.key('(cn:dn:1.2:=x)'))
+        self.assertNotEquals(self.key('(cn:dn:1.2:=x)'),
+                             self.key('(cn:1.2:=x)'))
+
+class TestFilterCache(unittest.TestCase):
+    def test_parseText(self):
+        cache = ldapfilter.FilterCache()
+        a = cache.parse('(cn=foo)')
+        b = cache.parse('(cn=foo)')
+        self.assertIdentical(a, b)
+        self.assertEquals(a, ldapfilter.parseFilter('(cn=foo)'))
+        self.assertEquals((cache.hits, cache.misses), (1, 1))
+        self.assertEquals(cache.hitRate(), 0.5)
+
+    def test_parseObject(self):
+        cache = ldapfilter.FilterCache()
+        a = cache.parse(ldapfilter.parseFilter('(&(cn=foo)(sn=bar))'))
+        b = cache.parse(ldapfilter.parseFilter('(&(SN=bar)(cn=foo))'))
+        self.assertIdentical(a, b)
+        self.assertEquals(cache.hits, 1)
+
+    def test_invalid(self):
+        cache = ldapfilter.FilterCache()
+        self.assertRaises(ldapfilter.InvalidLDAPFilter,
+                          cache.parse, '(cn=foo')
+        self.assertEquals(len(cache), 0)
+
+    def test_compile(self):
+        cache = ldapfilter.FilterCache()
+        a = cache.compile('(cn=foo)')
+        self.assertIdentical(cache.compile('(cn=foo)'), a)
+        self.assertEquals(len(cache), 1)
+
+    def test_evict(self):
+        cache = ldapfilter.FilterCache(maxSize=2)
+        cache.parse('(a=1)')
+        cache.parse('(b=2)')
+        cache.parse('(a=1)')
+        cache.parse('(c=3)')
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(cache.evictions, 1)
+        cache.parse('(a=1)')
+        self.assertEquals(cache.hits, 2)
+        cache.parse('(b=2)')
+        self.assertEquals(cache.misses, 4)
+
+    def test_clear(self):
+        cache = ldapfilter.FilterCache()
+        cache.parse('(a=1)')
+        cache.parse('(a=1)')
+        cache.clear()
+        self.assertEquals(len(cache), 0)
+        self.assertEquals((cache.hits, cache.misses, cache.evictions),
+                          (0, 0, 0))
+        self.assertEquals(cache.hitRate(), 0.0)
+
+class TestPreparedFilter(unittest.TestCase):
+    def test_bind(self):
+        prepared = ldapfilter.PreparedFilter(
+            '(&(objectClass=person)(|(uid=%(name)s)(mail=%(name)s@%(domain)s)))')
+        self.assertEquals(
+            prepared.bind({'name': 'jdoe', 'domain': 'example.com'}),
+            ldapfilter.parseFilter(
+                '(&(objectClass=person)(|(uid=jdoe)(mail=jdoe@example.com)))'))
+
+    def test_bindLiteral(self):
+        prepared = ldapfilter.PreparedFilter('(uid=%(name)s)')
+        filt = prepared.bind({'name': '*)(uid=*'})
+        self.assertEquals(filt, pureldap.LDAPFilter_equalityMatch(
+            attributeDesc=pureldap.LDAPAttributeDescription('uid'),
+            assertionValue=pureldap.LDAPAssertionValue('*)(uid=*')))
+        self.assertEquals(filt.asText(), r'(uid=\2a\29\28uid=\2a)')
+
+    def test_bindTwice(self):
+        prepared = ldapfilter.PreparedFilter('(!(cn>=%(name)s))')
+        self.assertEquals(prepared.bind({'name': 'a'}),
+                          ldapfilter.parseFilter('(!(cn>=a))'))
+        self.assertEquals(prepared.bind({'name': 'b'}),
+                          ldapfilter.parseFilter('(!(cn>=b))'))
+
+    def test_substrings(self):
+        prepared = ldapfilter.PreparedFilter('(cn=%(a)s*x*%(b)s\\2a%%)')
+        self.assertEquals(prepared.bind({'a': 'A%', 'b': '('}),
+                          ldapfilter.parseFilter('(cn=A%*x*\\28\\2a%)'))
+
+    def test_extensible(self):
+        prepared = ldapfilter.PreparedFilter('(cn:dn:1.2:=%(name)s)')
+        self.assertEquals(prepared.bind({'name': 'x'}),
+                          ldapfilter.parseFilter('(cn:dn:1.2:=x)'))
+
+    def test_noPlaceholders(self):
+        prepared = ldapfilter.PreparedFilter('(cn=foo)')
+        self.assertEquals(prepared.bind({}),
+                          ldapfilter.parseFilter('(cn=foo)'))
+
+    def test_missingValue(self):
+        prepared = ldapfilter.PreparedFilter('(cn=%(name)s)')
+        self.assertRaises(KeyError, prepared.bind, {})
+
+    def test_placeholderNotInValue(self):
+        self.assertRaises(ldapfilter.InvalidLDAPFilter,
+                          ldapfilter.PreparedFilter, '(%(attr)s=foo)')
+
+    def test_invalid(self):
+        self.assertRaises(ldapfilter.InvalidLDAPFilter,
+                          ldapfilter.PreparedFilter, '(cn=%(name)s')
+        self.assertRaises(ldapfilter.InvalidLDAPFilter,
+                          ldapfilter.PreparedFilter, '(cn=%(name)x)')
+
+    def test_prepareFilter(self):
+        template = '(uid=%(name)s)'
+        self.assertIdentical(ldapfilter.prepareFilter(template),
+                             ldapfilter.prepareFilter(template))
@@ -3,7 +3,7 @@ Test cases for ldaptor.protocols.ldap.ldapserver module.
 """
 
 from twisted.trial import unittest
-from ldaptor import inmemory
+from ldaptor import inmemory, entryhelpers, ldapfilter
 from ldaptor.protocols import pureldap, pureber
 from ldaptor.protocols.ldap import ldapsyntax
 
@@ -383,6 +383,45 @@ class TestEntryMatch(unittest.TestCase):
                                                          pureber.BERInteger(3)))
         self.assertEquals(result, False)
 
+    def test_greaterOrEqual_integer(self):
+        o=inmemory.ReadOnlyInMemoryLDAPEntry(dn='cn=foo,dc=example,dc=com',
+                                             attributes={
+            'objectClass': ['a', 'b'],
+            'uidNumber': ['10'],
+            })
+        result = o.match(pureldap.LDAPFilter_greaterOrEqual(pureber.BEROctetString('uidnumber'),
+                                                            pureber.BEROctetString('9')))
+        self.assertEquals(result, True)
+        result = o.match(pureldap.LDAPFilter_lessOrEqual(pureber.BEROctetString('uidNumber'),
+                                                         pureber.BEROctetString('9')))
+        self.assertEquals(result, False)
+
+    def test_lessOrEqual_generalizedTime(self):
+        o=inmemory.ReadOnlyInMemoryLDAPEntry(dn='cn=foo,dc=example,dc=com',
+                                             attributes={
+            'objectClass': ['a', 'b'],
+            'modifyTimestamp': ['20240101120000+0200'],
+            })
+        result = o.match(pureldap.LDAPFilter_lessOrEqual(pureber.BEROctetString('modifyTimestamp'),
+                                                         pureber.BEROctetString('20240101103000Z')))
+        self.assertEquals(result, True)
+        result = o.match(pureldap.LDAPFilter_greaterOrEqual(pureber.BEROctetString('modifyTimestamp'),
+                                                            pureber.BEROctetString('2024010110.6Z')))
+        self.assertEquals(result, False)
+
+    def test_greaterOrEqual_notOrdered(self):
+        o=inmemory.ReadOnlyInMemoryLDAPEntry(dn='cn=foo,dc=example,dc=com',
+                                             attributes={
+            'objectClass': ['a', 'b'],
+            'uidNumber': ['ten', '3'],
+            })
+        result = o.match(pureldap.LDAPFilter_greaterOrEqual(pureber.BEROctetString('uidNumber'),
+                                                            pureber.BEROctetString('5')))
+        self.assertEquals(result, False)
+        result = o.match(pureldap.LDAPFilter_lessOrEqual(pureber.BEROctetString('uidNumber'),
+                                                         pureber.BEROctetString('five')))
+        self.assertEquals(result, False)
+
     def test_extensibleMatch4(self):
         """
         An extensibleMatch filter that uses DN attributes matches an entry
@@ -439,3 +478,118 @@ class TestEntryMatch(unittest.TestCase):
 
 # TODO LDAPFilter_approxMatch
 # TODO LDAPFilter_extensibleMatch
+
+class TestCompiledEntryMatch(unittest.TestCase):
+    entries = [
+        inmemory.ReadOnlyInMemoryLDAPEntry(
+            dn='cn=foo,ou=fings,dc=example,dc=com',
+            attributes={
+            'objectClass': ['a', 'b'],
+            'cn': ['foo', 'Foo Bar'],
+            'uidNumber': ['10', 'ten'],
+            'modifyTimestamp': ['20240101120000+0200'],
+            }),
+        inmemory.ReadOnlyInMemoryLDAPEntry(
+            dn='cn=bar,dc=example,dc=com',
+            attributes={
+            'objectClass': ['a'],
+            'cn': ['bar'],
+            'uidNumber': ['9'],
+            }),
+        inmemory.ReadOnlyInMemoryLDAPEntry(
+            dn='dc=example,dc=com',
+            attributes={}),
+        ]
+
+    filters = [
+        '(objectClass=*)',
+        '(UIDNUMBER=*)',
+        '(cn=FOO)',
+        '(cn=foo*)',
+        '(cn=*bar)',
+        '(cn=f*o*b*r)',
+        '(cn=*o b*)',
+        '(uidNumber>=9)',
+        '(uidNumber<=9)',
+        '(uidNumber>=ten)',
+        '(modifyTimestamp<=20240101103000Z)',
+        '(modifyTimestamp>=2024010110.6Z)',
+        '(!(cn=bar))',
+        '(&(objectClass=a)(|(cn=bar)(uidNumber>=10)))',
+        '(|(cn=nomatch)(!(objectClass=b)))',
+        '(ou:dn:=fings)',
+        '(cn:=foo)',
+        ]
+
+    def test_sameAsMatch(self):
+        """Compiled filters match the same entries as MatchMixin.match."""
+        for text in self.filters:
+            filt = ldapfilter.parseFilter(text)
+            predicate = entryhelpers.compileFilter(filt)
+            for o in self.entries:
+                self.assertEquals((text, str(o.dn), predicate(o)),
+                                  (text, str(o.dn), o.match(filt)))
+
+    def test_notImplemented(self):
+        class UnknownMatch(object): pass
+        predicate = entryhelpers.compileFilter(UnknownMatch())
+        self.assertRaises(ldapsyntax.MatchNotImplemented,
+                          predicate, self.entries[0])
+
+    def test_cheapestFirst(self):
+        """AND tries its cheapest member first."""
+        seen = []
+        class Entry(inmemory.ReadOnlyInMemoryLDAPEntry):
+            def get(self, key, default=None):
+                seen.append(key)
+                return inmemory.ReadOnlyInMemoryLDAPEntry.get(
+                    self, key, default)
+        o=Entry(dn='cn=foo,dc=example,dc=com',
+                attributes={
+            'objectClass': ['a', 'b'],
+            })
+        predicate = entryhelpers.compileFilter(
+            ldapfilter.parseFilter('(&(objectClass=*x*)(noSuchValue=*))'))
+        self.assertEquals(predicate(o), False)
+        self.assertEquals(seen, [])
+
+    def test_notImplementedInOrder(self):
+        """
+        AND and OR do not reorder their members around a match that
+        is not implemented, so it raises just like MatchMixin.match.
+        """
+        o=inmemory.ReadOnlyInMemoryLDAPEntry(dn='cn=foo,dc=example,dc=com',
+                                             attributes={
+            'objectClass': ['a', 'b'],
+            'cn': ['foo'],
+            })
+        filt = ldapfilter.parseFilter('(&(cn=nomatch)(cn:1.2.3:=x))')
+        self.assertEquals(entryhelpers.compileFilter(filt)(o), False)
+        filt = ldapfilter.parseFilter('(|(cn=foo)(cn:1.2.3:=x))')
+        self.assertEquals(entryhelpers.compileFilter(filt)(o), True)
+        for text in ['(&(cn:1.2.3:=x)(cn=nomatch))',
+                     '(&(cn=foo)(cn:1.2.3:=x))',
+                     '(|(cn:1.2.3:=x)(cn=foo))']:
+            filt = ldapfilter.parseFilter(text)
+            self.assertRaises(ldapsyntax.MatchNotImplemented,
+                              entryhelpers.compileFilter(filt), o)
+
+class TestOrdering(unittest.TestCase):
+    def test_integer(self):
+        self.assertEquals(entryhelpers.integerOrdering('-42'), -42)
+        self.assertRaises(ValueError, entryhelpers.integerOrdering, '4.2')
+
+    def test_generalizedTime(self):
+        t = entryhelpers.generalizedTimeOrdering
+        self.assertEquals(t('19700101000000Z'), 0)
+        self.assertEquals(t('1970010101Z'), 3600)
+        self.assertEquals(t('197001010130-0100'), 9000)
+        self.assertEquals(t('1970010100.5Z'), 1800)
+        self.assertEquals(t('197001010000,25Z'), 15)
+        self.assertEquals(t('19700101000001.5'), 1.5)
+        self.assertRaises(ValueError, t, '1970-01-01')
+
+    def test_orderingFor(self):
+        self.assertIdentical(entryhelpers.orderingFor('UIDNUMBER'),
+                             entryhelpers.integerOrdering)
+        self.assertEquals(entryhelpers.orderingFor('cn')('x'), 'x')
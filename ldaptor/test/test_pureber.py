@@ -410,3 +410,269 @@ class BERSequenceKnownValues(unittest.TestCase):
 
 # TODO BERSequenceOf
 # TODO BERSet
+
+class BERDecodeBuffer(unittest.TestCase):
+    def testLeavesAreStrings(self):
+        """Decoding a memoryview gives plain string leaf values"""
+        m=str(pureber.BERSequence([
+            pureber.BEROctetString('foo'),
+            pureber.BERSequence([pureber.BEROctetString('bar'),
+                                 pureber.BERInteger(42)]),
+            ]))
+        result, bytes = pureber.berDecodeObject(pureber.BERDecoderContext(),
+                                                memoryview('junk'+m)[4:])
+        self.assertEquals(bytes, len(m))
+        self.assertEquals(type(result[0].value), str)
+        self.assertEquals(result[0].value, 'foo')
+        self.assertEquals(type(result[1][0].value), str)
+        self.assertEquals(result[1][0].value, 'bar')
+        self.assertEquals(result[1][1].value, 42)
+        self.assertEquals(str(result), m)
+
+    def testPartialBuffer(self):
+        """A truncated memoryview raises BERExceptionInsufficientData"""
+        m=str(pureber.BERSequence([pureber.BEROctetString('foo')]))
+        self.assertRaises(pureber.BERExceptionInsufficientData,
+                          pureber.berDecodeObject,
+                          pureber.BERDecoderContext(),
+                          memoryview(m)[:-1])
+
+    def testForeignClassesGetStrings(self):
+        """fromBER of classes from outside ldaptor gets a string"""
+        got=[]
+        class Foreign(pureber.BEROctetString):
+            __module__ = 'elsewhere'
+            def fromBER(klass, tag, content, berdecoder=None):
+                got.append(content)
+                return pureber.BEROctetString.fromBER(tag, content, berdecoder)
+            fromBER = classmethod(fromBER)
+        class Context(pureber.BERDecoderContext):
+            Identities = {
+                Foreign.tag: Foreign,
+                }
+        m=str(pureber.BEROctetString('foo'))
+        result, bytes = pureber.berDecodeObject(Context(),
+                                                memoryview('junk'+m)[4:])
+        self.assertEquals(got, ['foo'])
+        self.assertEquals(type(got[0]), str)
+
+class BERFramerTests(unittest.TestCase):
+    def frames(self, framer, data):
+        return [f.tobytes() for f in framer.feed(data)]
+
+    def testWhole(self):
+        """A complete element is returned as one frame"""
+        m=str(pureber.BERSequence([pureber.BERInteger(2)]))
+        framer=pureber.BERFramer()
+        self.assertEquals(self.frames(framer, m), [m])
+        self.assertEquals(len(framer), 0)
+
+    def testByteAtATime(self):
+        """An element fed one byte at a time is returned once complete"""
+        m=str(pureber.BEROctetString('x'*1000))
+        framer=pureber.BERFramer()
+        for c in m[:-1]:
+            self.assertEquals(self.frames(framer, c), [])
+        self.assertEquals(len(framer), len(m)-1)
+        self.assertEquals(self.frames(framer, m[-1]), [m])
+        self.assertEquals(len(framer), 0)
+
+    def testMany(self):
+        """Many elements in one read are split; a trailing partial one is kept"""
+        elements=[str(pureber.BEROctetString('x'*n)) for n in range(300)]
+        framer=pureber.BERFramer()
+        tail=elements[-1]
+        self.assertEquals(self.frames(framer, ''.join(elements[:-1])+tail[:3]),
+                          elements[:-1])
+        self.assertEquals(len(framer), 3)
+        self.assertEquals(self.frames(framer, tail[3:]), [tail])
+
+    def nested(self, depth):
+        o=pureber.BERInteger(1)
+        for i in range(depth):
+            o=pureber.BERSequence([o])
+        return str(o)
+
+    def testMaxLength(self):
+        """An element too large is refused once its header is in"""
+        framer=pureber.BERFramer(maxLength=10)
+        self.assertEquals(self.frames(framer, s(0x04, 8)+'x'*8), [s(0x04, 8)+'x'*8])
+        self.assertRaises(pureber.BERExceptionLimitExceeded,
+                          framer.feed, s(0x04, 0x82, 0x10, 0x00))
+        self.assertEquals(len(framer), 0)
+        self.assertRaises(pureber.BERExceptionLimitExceeded,
+                          framer.feed, 'more')
+        self.assertEquals(len(framer), 0)
+
+    def testMaxDepth(self):
+        """Structured elements may nest only maxDepth deep"""
+        framer=pureber.BERFramer(maxDepth=3)
+        self.assertEquals(self.frames(framer, self.nested(3)), [self.nested(3)])
+        self.assertRaises(pureber.BERExceptionLimitExceeded,
+                          framer.feed, self.nested(4))
+
+    def testMaxElements(self):
+        """A top-level element may hold only maxElements elements"""
+        m=str(pureber.BERSequence([pureber.BEROctetString('x')]*9))
+        self.assertEquals(self.frames(pureber.BERFramer(maxElements=10), m), [m])
+        self.assertRaises(pureber.BERExceptionLimitExceeded,
+                          pureber.BERFramer(maxElements=9).feed, m)
+
+class BERDecoderContextDispatch(unittest.TestCase):
+    class Outer(pureber.BERDecoderContext):
+        Identities = {
+            pureber.CLASS_CONTEXT|0x00: pureber.BEROctetString,
+            pureber.BERInteger.tag: pureber.BEREnumerated,
+            }
+
+    class Inner(pureber.BERDecoderContext):
+        Identities = {
+            pureber.CLASS_CONTEXT|0x01: pureber.BERInteger,
+            }
+
+    def testLookupFollowsFallback(self):
+        """Flattened lookup gives the same answer as walking the fallbacks"""
+        ctx=self.Inner(fallback=self.Outer(fallback=pureber.BERDecoderContext()))
+        self.assertIdentical(ctx.lookup_id(pureber.CLASS_CONTEXT|0x01), pureber.BERInteger)
+        self.assertIdentical(ctx.lookup_id(pureber.CLASS_CONTEXT|0x00), pureber.BEROctetString)
+        self.assertIdentical(ctx.lookup_id(pureber.BERInteger.tag), pureber.BEREnumerated)
+        self.assertIdentical(ctx.lookup_id(pureber.BERNull.tag), pureber.BERNull)
+        self.assertIdentical(ctx.lookup_id(pureber.CLASS_CONTEXT|0x02), None)
+
+    def testTablesAreShared(self):
+        """Contexts with the same chain share one dispatch table"""
+        root=pureber.BERDecoderContext()
+        a=self.Inner(fallback=root)
+        b=self.Inner(fallback=root)
+        self.assertIdentical(a.dispatch, b.dispatch)
+        nested=self.Inner(fallback=self.Inner(fallback=a))
+        self.assertIdentical(nested.dispatch, a.dispatch)
+
+    def testForeignFallback(self):
+        """A fallback that only implements lookup_id is still consulted"""
+        class Foreign:
+            def lookup_id(self, id):
+                return pureber.BERNull
+        ctx=self.Inner(fallback=Foreign())
+        self.assertIdentical(ctx.lookup_id(pureber.CLASS_CONTEXT|0x01), pureber.BERInteger)
+        self.assertIdentical(ctx.lookup_id(0x42), pureber.BERNull)
+
+    def testOverriddenFallback(self):
+        """A fallback context overriding lookup_id is not bypassed"""
+        class Overriding(pureber.BERDecoderContext):
+            def lookup_id(self, id):
+                if id == 0x42:
+                    return pureber.BERNull
+                return pureber.BERDecoderContext.lookup_id(self, id)
+        ctx=self.Inner(fallback=self.Inner(fallback=Overriding()))
+        self.assertIdentical(ctx.lookup_id(0x42), pureber.BERNull)
+        self.assertIdentical(ctx.lookup_id(pureber.CLASS_CONTEXT|0x01), pureber.BERInteger)
+        self.assertIdentical(ctx.lookup_id(pureber.BERInteger.tag), pureber.BERInteger)
+
+    def testChangedIdentities(self):
+        """Replacing Identities after first use is honoured"""
+        class Changing(pureber.BERDecoderContext):
+            Identities = {
+                pureber.CLASS_CONTEXT|0x01: pureber.BERInteger,
+                }
+        root=pureber.BERDecoderContext()
+        self.assertIdentical(Changing().lookup_id(pureber.CLASS_CONTEXT|0x01), pureber.BERInteger)
+        self.assertIdentical(Changing(fallback=root).lookup_id(pureber.CLASS_CONTEXT|0x01), pureber.BERInteger)
+        Changing.Identities = {
+            pureber.CLASS_CONTEXT|0x01: pureber.BERNull,
+            }
+        self.assertIdentical(Changing().lookup_id(pureber.CLASS_CONTEXT|0x01), pureber.BERNull)
+        self.assertIdentical(Changing(fallback=root).lookup_id(pureber.CLASS_CONTEXT|0x01), pureber.BERNull)
+
+class BEREncodeChunks(unittest.TestCase):
+    def testChunks(self):
+        """berEncodeChunks gives the same bytes as str()"""
+        o=pureber.BERSequence([
+            pureber.BEROctetString('foo'),
+            pureber.BERSet([pureber.BERInteger(1000), pureber.BERNull()]),
+            pureber.BERBoolean(True),
+            ])
+        chunks=pureber.berEncodeChunks(o)
+        self.assertEquals(''.join(chunks), str(o))
+        self.assertEquals(''.join(chunks),
+                          s(0x30, 16,
+                            0x04, 3, 'foo',
+                            0x31, 6, 0x02, 2, 0x03, 0xe8, 0x05, 0,
+                            0x01, 1, 0xff))
+
+    def testStrOverride(self):
+        """Members that only override __str__ are encoded with str()"""
+        class Custom(pureber.BEROctetString):
+            def __str__(self):
+                return s(0x04, 1, 'x')
+        o=pureber.BERSequence([Custom('ignored')])
+        self.assertEquals(''.join(pureber.berEncodeChunks(o)),
+                          s(0x30, 3, 0x04, 1, 'x'))
+        self.assertEquals(str(o), s(0x30, 3, 0x04, 1, 'x'))
+
+class BERCompactObjects(unittest.TestCase):
+    def testNoInstanceDict(self):
+        """Decoded BER objects keep their state in slots"""
+        o, bytes=pureber.berDecodeObject(
+            pureber.BERDecoderContext(),
+            str(pureber.BERSequence([pureber.BEROctetString('foo'),
+                                     pureber.BERInteger(1)])))
+        for x in [o]+list(o):
+            self.failIf(hasattr(x, '__dict__'), x)
+
+    def testTag(self):
+        """Instances fall back to the tag of their class"""
+        self.assertEquals(pureber.BERInteger.tag, 0x02)
+        self.assertEquals(pureber.BERInteger(1).tag, 0x02)
+        self.assertEquals(pureber.BERInteger(1, tag=0x42).tag, 0x42)
+        self.assertEquals(pureber.BEREnumerated(1).tag, 0x0a)
+        class Custom(pureber.BERInteger):
+            tag = 0x43
+        self.assertEquals(Custom.tag, 0x43)
+        self.assertEquals(Custom(1).tag, 0x43)
+        self.assertEquals(str(Custom(1)), s(0x43, 1, 1))
+
+    def testSequenceIsListLike(self):
+        """BERSequence behaves like a list of its members"""
+        a=pureber.BERInteger(1)
+        b=pureber.BERInteger(2)
+        o=pureber.BERSequence([a])
+        o.append(b)
+        self.assertEquals(len(list(o)), 2)
+        self.assertIdentical(o[1], b)
+        self.assert_(b in o)
+        self.assertEquals(o[:1], [a])
+        self.assertEquals(o.index(b), 1)
+        del o[0]
+        self.assertEquals(list(o), [b])
+        self.assertEquals(str(o), s(0x30, 3, 0x02, 1, 2))
+        self.assertRaises(TypeError, hash, o)
+
+class BERIntegerBoundaries(unittest.TestCase):
+    knownValues=(
+        (0, [0x00]),
+        (127, [0x7f]),
+        (128, [0x00, 0x80]),
+        (-128, [0x80]),
+        (-129, [0xff, 0x7f]),
+        (1023, [0x03, 0xff]),
+        (1024, [0x04, 0x00]),
+        (2**63-1, [0x7f]+[0xff]*7),
+        (2**63, [0x00, 0x80]+[0x00]*7),
+        (-2**63, [0x80]+[0x00]*7),
+        (-2**63-1, [0xff, 0x7f]+[0xff]*7),
+        )
+
+    def testInt2BER(self):
+        """int2ber and ber2int agree on the edges of the fast paths"""
+        for integer, encoded in self.knownValues:
+            encoded=s(*encoded)
+            self.assertEquals(pureber.int2ber(integer), encoded)
+            self.assertEquals(pureber.ber2int(encoded), integer)
+            self.assertEquals(pureber.ber2int(memoryview(encoded)), integer)
+
+    def testUnsigned(self):
+        """Unsigned decoding never sees a sign bit"""
+        for integer in (0, 0xff, 0x100, 0xffff, 2**64-1, 2**64):
+            encoded=pureber.int2ber(integer, signed=False)
+            self.assertEquals(pureber.ber2int(encoded, signed=False), integer)
@@ -704,6 +704,159 @@ class Substrings(unittest.TestCase):
         # when empty, and that tripped e.g. entry.match()
         self.assertEquals(len(filt.substrings), 1)
 
+class LazyMessage(unittest.TestCase):
+    berdecoder = pureldap.LDAPBERDecoderContext_LazyTopLevel(
+        inherit=pureldap.LDAPBERDecoderContext_LDAPMessage(
+            fallback=pureldap.LDAPBERDecoderContext(
+                fallback=pureber.BERDecoderContext()),
+            inherit=pureldap.LDAPBERDecoderContext(
+                fallback=pureber.BERDecoderContext())))
+
+    def decode(self, m):
+        msg, bytes = pureber.berDecodeObject(self.berdecoder, m)
+        self.assertEquals(bytes, len(m))
+        self.assertIsInstance(msg, pureldap.LazyLDAPMessage)
+        return msg
+
+    def test_envelope(self):
+        """The id, op type and controls are available without decoding the op."""
+        m = str(pureldap.LDAPMessage(
+            pureldap.LDAPSearchResultDone(resultCode=0),
+            controls=[('1.2.3', True, 'foo')],
+            id=42))
+        msg = self.decode(m)
+        self.assertEquals(msg.id, 42)
+        self.assertEquals(msg.controls, [('1.2.3', 0xFF, 'foo')])
+        self.assertIsInstance(msg.value, pureldap.LDAPSearchResultDone)
+        self.assertIsInstance(msg.value, pureldap.LazyLDAPProtocolOp)
+        self.assertEquals(msg.value.__class__.__name__, 'LDAPSearchResultDone')
+        self.assertEquals(str(msg), m)
+
+    def test_passThrough(self):
+        """An op that is never looked into is re-encoded byte for byte."""
+        entry = str(pureldap.LDAPSearchResultEntry(
+            objectName='cn=foo', attributes=[('cn', ['foo'])]))
+        # same entry, with a needlessly long length encoding
+        op = entry[0] + s(0x82, 0, len(entry)-2) + entry[2:]
+        m = s(0x30, 3+len(op), 0x02, 0x01, 7, op)
+        msg = self.decode(m)
+        self.assertEquals(str(msg), m)
+        self.assertEquals(str(pureldap.LDAPMessage(msg.value, id=7)), m)
+
+    def test_decodeOnAccess(self):
+        """Reading an attribute of the op decodes it."""
+        m = str(pureldap.LDAPMessage(
+            pureldap.LDAPSearchResultEntry(
+                objectName='cn=foo', attributes=[('cn', ['foo'])]),
+            id=7))
+        msg = self.decode(m)
+        self.assertEquals(msg.value.objectName, 'cn=foo')
+        self.assertIdentical(msg.value.__class__,
+                             pureldap.LDAPSearchResultEntry)
+        msg.value.attributes.append(('sn', ['bar']))
+        self.assertEquals(
+            str(msg),
+            str(pureldap.LDAPMessage(
+                pureldap.LDAPSearchResultEntry(
+                    objectName='cn=foo',
+                    attributes=[('cn', ['foo']), ('sn', ['bar'])]),
+                id=7)))
+
+    def test_setAttribute(self):
+        """Setting an attribute of the op decodes it first."""
+        m = str(pureldap.LDAPMessage(
+            pureldap.LDAPSearchResultDone(resultCode=0), id=7))
+        msg = self.decode(m)
+        msg.value.errorMessage = 'oops'
+        self.assertEquals(msg.value.resultCode, 0)
+        self.assertEquals(
+            str(msg),
+            str(pureldap.LDAPMessage(
+                pureldap.LDAPSearchResultDone(resultCode=0,
+                                              errorMessage='oops'),
+                id=7)))
+
+    def test_primitiveValues(self):
+        """Ops that keep their content in slots have it once decoded."""
+        for op, value, r in [
+            (pureldap.LDAPDelRequest(entry='cn=foo'), 'cn=foo',
+             "LDAPDelRequest(entry='cn=foo')"),
+            (pureldap.LDAPAbandonRequest(id=3), 3,
+             'LDAPAbandonRequest(id=3L)'),
+            (pureldap.LDAPUnbindRequest(), None,
+             'LDAPUnbindRequest()'),
+            ]:
+            m = str(pureldap.LDAPMessage(op, id=7))
+            msg = self.decode(m)
+            if value is not None:
+                self.assertEquals(msg.value.value, value)
+            self.assertEquals(repr(msg.value), r)
+            self.assertEquals(repr(msg),
+                              'LazyLDAPMessage(id=7L, value=%s)' % r)
+            self.assertEquals(str(msg), m)
+
+class CachedEncoding(unittest.TestCase):
+    def entry(self):
+        return pureldap.LDAPSearchResultEntry(
+            objectName='cn=foo,dc=example,dc=com',
+            attributes=[('cn', ['foo']), ('objectClass', ['top'])])
+
+    def test_optIn(self):
+        """Nothing is cached unless asked for."""
+        o = self.entry()
+        str(o)
+        self.failIf('_encoding' in o.__dict__)
+        o.cacheEncoding()
+        m = str(o)
+        self.assertIdentical(str(o), m)
+        self.assertEquals(m, str(self.entry()))
+
+    def test_nested(self):
+        """A cached encoding is reused inside an enclosing message."""
+        o = self.entry()
+        o.cacheEncoding()
+        str(o)
+        o.__dict__['_encoding'] = 'cached'
+        self.assertEquals(pureber.berEncodeChunks(pureldap.LDAPMessage(o, id=1))[-1],
+                          'cached')
+
+    def test_invalidateOnAssign(self):
+        """Assigning an attribute forgets the cached encoding."""
+        o = self.entry()
+        o.cacheEncoding()
+        str(o)
+        o.objectName = 'cn=bar,dc=example,dc=com'
+        self.assertEquals(str(o), str(pureldap.LDAPSearchResultEntry(
+            objectName='cn=bar,dc=example,dc=com',
+            attributes=[('cn', ['foo']), ('objectClass', ['top'])])))
+
+    def test_invalidateExplicitly(self):
+        """Changes inside mutable members need invalidateEncoding()."""
+        o = self.entry()
+        o.cacheEncoding()
+        m = str(o)
+        o.attributes[0][1].append('bar')
+        self.assertEquals(str(o), m)
+        o.invalidateEncoding()
+        self.assertNotEquals(str(o), m)
+
+    def test_filterAndControl(self):
+        """Filters and controls can cache their encoding too."""
+        for o in [
+            pureldap.LDAPFilter_present('cn'),
+            pureldap.LDAPFilter_and([
+                pureldap.LDAPFilter_equalityMatch(
+                    attributeDesc=pureldap.LDAPAttributeDescription('cn'),
+                    assertionValue=pureldap.LDAPAssertionValue('foo')),
+                pureldap.LDAPFilter_not(pureldap.LDAPFilter_present('sn')),
+                ]),
+            pureldap.LDAPControl('1.2.3', criticality=True),
+            ]:
+            m = str(o)
+            o.cacheEncoding()
+            self.assertEquals(str(o), m)
+            self.assertEquals(o.__dict__['_encoding'], m)
+
 class TestEscaping(unittest.TestCase):
     def test_escape(self):
         s = '\\*()\0'
@@ -124,6 +124,48 @@ class LDAPServerTest(unittest.TestCase):
                     pureldap.LDAPBindResponse(resultCode=0),
                     id=4)))
 
+    def test_bind_splitAcrossReads(self):
+        m = str(pureldap.LDAPMessage(pureldap.LDAPBindRequest(), id=4))
+        for c in m:
+            self.server.dataReceived(c)
+        self.server.dataReceived(m+m[:3])
+        self.server.dataReceived(m[3:])
+        self.assertEquals(
+            self.server.transport.value(),
+            3*str(
+                pureldap.LDAPMessage(
+                    pureldap.LDAPBindResponse(resultCode=0),
+                    id=4)))
+
+    def test_limitExceeded(self):
+        server = ldapserver.LDAPServer()
+        server.factory = self.root
+        server.maxPDUSize = 100
+        server.makeConnection(proto_helpers.StringTransport())
+        # A header claiming a 2GB request is refused before any of it
+        # is buffered.
+        server.dataReceived('\x30\x84\x7f\xff\xff\xff'+'x'*50)
+        self.assertTrue(server.transport.disconnecting)
+        self.assertEquals(server.transport.value(), '')
+        self.assertEquals(len(server.buffer), 0)
+
+    def test_limitDefaults(self):
+        server = ldapserver.LDAPServer()
+        server.factory = self.root
+        server.makeConnection(proto_helpers.StringTransport())
+        server.dataReceived('\x30\x84\x7f\xff\xff\xff'+'x'*50)
+        self.assertTrue(server.transport.disconnecting)
+
+        server = ldapserver.LDAPServer()
+        server.factory = self.root
+        server.makeConnection(proto_helpers.StringTransport())
+        nested = pureber.BERNull()
+        for i in xrange(server.maxNestingDepth+1):
+            nested = pureber.BERSequence([nested])
+        server.dataReceived(str(nested))
+        self.assertTrue(server.transport.disconnecting)
+        self.assertEquals(server.transport.value(), '')
+
     def test_bind_success(self):
         self.thingie['userPassword'] = ['{SSHA}yVLLj62rFf3kDAbzwEU0zYAVvbWrze8=']  # "secret"
         self.server.dataReceived(
@@ -71,5 +71,6 @@ if __name__ == '__main__':
                    "bin/ldaptor-rename",
                    "bin/ldaptor-fetchschema",
                    "bin/ldaptor-ldifdiff",
-                   "bin/ldaptor-ldifpatch"]
+                   "bin/ldaptor-ldifpatch",
+                   "bin/ldaptor-snapshot"]
           )